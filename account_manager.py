@@ -1,11 +1,19 @@
 import json
 import os
 import random
+import threading
 import time
 
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
 DATA_DIR = "data"
 ACCOUNTS_FILE = os.path.join(DATA_DIR, "accounts.json")
 ACCOUNTS_DIR = os.path.join(DATA_DIR, "accounts_state")
+LOCK_FILE = ACCOUNTS_FILE + ".lock"
 
 # High quality UAs to rotate
 USER_AGENTS = [
@@ -16,36 +24,149 @@ USER_AGENTS = [
     "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36",
 ]
 
+
+class _FileLock:
+    """
+    Exclusive inter-process lock on a sidecar lock file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._f = None
+
+    def __enter__(self):
+        self._f = open(self.path, "a+b")
+        if fcntl is not None:
+            fcntl.flock(self._f.fileno(), fcntl.LOCK_EX)
+        else:
+            self._f.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(self._f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    # LK_LOCK gives up after ~10 s; keep waiting
+                    continue
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            if fcntl is not None:
+                fcntl.flock(self._f.fileno(), fcntl.LOCK_UN)
+            else:
+                self._f.seek(0)
+                msvcrt.locking(self._f.fileno(), msvcrt.LK_UNLCK, 1)
+        finally:
+            self._f.close()
+            self._f = None
+
+
 class AccountManager:
+    """
+    Account store on top of data/accounts.json.
+
+    Reads come from an in-memory cache (list + dict by ID) that is reloaded
+    only when the file's mtime/size/inode changes. Mutations hold a thread
+    lock and an inter-process file lock, re-read the latest file, and write
+    it back atomically (temp file + rename), so Flask request threads, the
+    login worker and scraper processes can share it safely.
+    """
+
     def __init__(self):
+        self._lock = threading.RLock()
+        self._accounts = []
+        self._by_id = {}
+        self._version = None
         self._ensure_setup()
 
     def _ensure_setup(self):
         if not os.path.exists(DATA_DIR):
-            os.makedirs(DATA_DIR)
+            os.makedirs(DATA_DIR, exist_ok=True)
         if not os.path.exists(ACCOUNTS_DIR):
-            os.makedirs(ACCOUNTS_DIR)
+            os.makedirs(ACCOUNTS_DIR, exist_ok=True)
         if not os.path.exists(ACCOUNTS_FILE):
-            with open(ACCOUNTS_FILE, 'w', encoding='utf-8') as f:
-                json.dump([], f)
+            with _FileLock(LOCK_FILE):
+                if not os.path.exists(ACCOUNTS_FILE):
+                    self._write([])
 
-    def get_all_accounts(self):
+    def _file_version(self):
         try:
-            with open(ACCOUNTS_FILE, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except:
-            return []
+            stat = os.stat(ACCOUNTS_FILE)
+        except OSError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
 
-    def save_accounts(self, accounts):
-        with open(ACCOUNTS_FILE, 'w', encoding='utf-8') as f:
+    def _load(self, force=False):
+        """
+        Refreshes the cache if the file changed since it was last read.
+        """
+        with self._lock:
+            version = self._file_version()
+            if not force and version == self._version and version is not None:
+                return
+            try:
+                with open(ACCOUNTS_FILE, 'r', encoding='utf-8') as f:
+                    accounts = json.load(f)
+            except:
+                accounts = []
+            self._set_cache(accounts, version)
+
+    def _set_cache(self, accounts, version):
+        self._accounts = accounts
+        self._by_id = {a['id']: a for a in accounts}
+        self._version = version
+
+    def _write(self, accounts):
+        tmp = f"{ACCOUNTS_FILE}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
             json.dump(accounts, f, ensure_ascii=False, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, ACCOUNTS_FILE)
+
+    def transact(self, change):
+        """
+        Applies `change(accounts)` to the latest accounts under both locks
+        and saves atomically. Returns whatever `change` returns. Use it for
+        read-modify-write sequences that must not race with other writers.
+        """
+        with self._lock, _FileLock(LOCK_FILE):
+            self._load(force=True)
+            accounts = [dict(a) for a in self._accounts]
+            outcome = change(accounts)
+            self._write(accounts)
+            self._set_cache(accounts, self._file_version())
+            return outcome
+
+    def get_all_accounts(self):
+        self._load()
+        with self._lock:
+            return [dict(a) for a in self._accounts]
+
+    def get_account(self, user_id):
+        self._load()
+        with self._lock:
+            account = self._by_id.get(user_id)
+            return dict(account) if account else None
+
+    def save_accounts(self, accounts):
+        def replace(current):
+            current[:] = [dict(a) for a in accounts]
+        self.transact(replace)
+
+    def update_account(self, user_id, **fields):
+        """
+        Updates fields of one account. Returns the updated account or None.
+        """
+        def update(accounts):
+            for a in accounts:
+                if a['id'] == user_id:
+                    a.update(fields)
+                    return dict(a)
+            return None
+        return self.transact(update)
 
     def add_account(self, user_id, nickname, state_path, user_agent=None):
-        accounts = self.get_all_accounts()
-        
-        # Check if exists, update if so
-        existing = next((a for a in accounts if a['id'] == user_id), None)
-        
         new_account = {
             "id": user_id,
             "nickname": nickname,
@@ -55,14 +176,16 @@ class AccountManager:
             "last_used": 0,
             "added_at": time.time()
         }
-        
-        if existing:
-            # Update existing
-            existing.update(new_account)
-        else:
-            accounts.append(new_account)
-            
-        self.save_accounts(accounts)
+
+        def add(accounts):
+            # Check if exists, update if so
+            existing = next((a for a in accounts if a['id'] == user_id), None)
+            if existing:
+                existing.update(new_account)
+            else:
+                accounts.append(dict(new_account))
+
+        self.transact(add)
         return new_account
 
     def get_random_active_account(self):
@@ -73,24 +196,21 @@ class AccountManager:
         return random.choice(active)
 
     def disable_account(self, user_id):
-        accounts = self.get_all_accounts()
-        for a in accounts:
-            if a['id'] == user_id:
-                a['status'] = 'disabled'
-        self.save_accounts(accounts)
+        self.update_account(user_id, status='disabled')
 
     def delete_account(self, user_id):
-        accounts = self.get_all_accounts()
+        def delete(accounts):
+            acc = next((a for a in accounts if a['id'] == user_id), None)
+            accounts[:] = [a for a in accounts if a['id'] != user_id]
+            return acc
+
+        acc = self.transact(delete)
         # Remove state file
-        acc = next((a for a in accounts if a['id'] == user_id), None)
         if acc and os.path.exists(acc['state_file']):
             try:
                 os.remove(acc['state_file'])
             except:
                 pass
-        
-        accounts = [a for a in accounts if a['id'] != user_id]
-        self.save_accounts(accounts)
 
     def get_user_agent_for_session(self):
         return random.choice(USER_AGENTS)
@@ -0,0 +1,266 @@
+import asyncio
+import itertools
+import os
+import threading
+import time
+from retry_policy import account_key
+
+# Limits are opt-in: None (or 0 for the cooldown) means unlimited. Set them
+# per account in its record: "hourly_cap", "daily_cap", "cooldown" (seconds).
+DEFAULT_HOURLY_CAP = None
+DEFAULT_DAILY_CAP = None
+DEFAULT_COOLDOWN = 0
+
+# Uses of unlimited accounts are written to accounts.json in batches this often
+PERSIST_INTERVAL = 5.0
+
+HOUR = 3600
+DAY = 86400
+
+# How long a blocking acquire waits when every account is leased out
+BUSY_POLL = 1.0
+
+
+def _seconds_until(at):
+    return None if at is None else max(at - time.time(), 0.05)
+
+
+class Lease:
+    def __init__(self, lease_id, account):
+        self.id = lease_id
+        self.account = account
+        self.acquired_at = time.time()
+
+    def __repr__(self):
+        return f"Lease({self.id}, {self.account['id']})"
+
+
+class AccountScheduler:
+    """
+    Fair, quota-aware account scheduler.
+
+    acquire() leases the active account with the most remaining budget
+    (min of hourly and daily headroom, least recently used first) that is
+    out of its cooldown. The use is recorded in accounts.json (`last_used`
+    and a 24 h `usage` log). For an account with caps or a cooldown this
+    happens inside an AccountManager transaction on every lease, so
+    separate processes share the same budgets. Unlimited accounts, the
+    default, are picked from the cached accounts and their uses are
+    written in batches every PERSIST_INTERVAL seconds (and on flush()).
+    Accounts whose circuit is open in `breaker`
+    (retry_policy.CircuitBreaker) are paused until it closes.
+
+    When no account is available, acquire() returns None and
+    `next_available_at` holds the exact time the earliest account frees up
+    (None if there are no usable accounts at all). Workers share it, so
+    callers that wait should use acquire_blocking() / acquire_async(),
+    which sleep until the time their own attempt computed.
+
+        lease = scheduler.acquire_blocking()
+        try:
+            scrape(lease.account)
+        finally:
+            scheduler.release(lease)
+    """
+
+    def __init__(self, manager, hourly_cap=DEFAULT_HOURLY_CAP, daily_cap=DEFAULT_DAILY_CAP,
+                 cooldown=DEFAULT_COOLDOWN, max_leases_per_account=None, breaker=None):
+        self.manager = manager
+        self.hourly_cap = hourly_cap
+        self.daily_cap = daily_cap
+        self.cooldown = cooldown
+        self.max_leases_per_account = max_leases_per_account
+        self.breaker = breaker
+        self.next_available_at = None
+        self._pending = {}
+        self._persisted_at = time.time()
+        self._leases = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def _limits(self, account):
+        return (
+            account.get("hourly_cap", self.hourly_cap),
+            account.get("daily_cap", self.daily_cap),
+            account.get("cooldown", self.cooldown),
+        )
+
+    def _limited(self, account):
+        hourly_cap, daily_cap, cooldown = self._limits(account)
+        return hourly_cap is not None or daily_cap is not None or bool(cooldown)
+
+    def _usable(self, account):
+        return account.get("status") == "active" and os.path.exists(account.get("state_file", ""))
+
+    def usable_accounts(self):
+        """
+        Active accounts with a state file, whether or not within their limits.
+        """
+        return [a for a in self.manager.get_all_accounts() if self._usable(a)]
+
+    def evaluate(self, account, now=None):
+        """
+        Returns (remaining, available_at) for an account: how many more uses
+        its caps allow right now, and the earliest time it may be used.
+        """
+        now = now or time.time()
+        hourly_cap, daily_cap, cooldown = self._limits(account)
+        uses = sorted(t for t in account.get("usage", []) if t > now - DAY)
+        hour_uses = [t for t in uses if t > now - HOUR]
+
+        remaining = float("inf")
+        available_at = max(now, account.get("last_used", 0) + (cooldown or 0))
+        # Over a cap: free once enough of the oldest uses age out of the window
+        if hourly_cap is not None:
+            remaining = min(remaining, hourly_cap - len(hour_uses))
+            if len(hour_uses) >= hourly_cap:
+                available_at = max(available_at, hour_uses[len(hour_uses) - hourly_cap] + HOUR)
+        if daily_cap is not None:
+            remaining = min(remaining, daily_cap - len(uses))
+            if len(uses) >= daily_cap:
+                available_at = max(available_at, uses[len(uses) - daily_cap] + DAY)
+        return remaining, available_at
+
+    def _leased(self, account_id):
+        return sum(1 for lease in self._leases.values() if lease.account["id"] == account_id)
+
+    def _merge_pending(self, accounts):
+        """
+        Adds the uses not yet written to accounts.json to `accounts`.
+        """
+        now = time.time()
+        for account in accounts:
+            uses = self._pending.get(account["id"])
+            if uses:
+                account["usage"] = [t for t in account.get("usage", []) if t > now - DAY] + uses
+                account["last_used"] = max(account.get("last_used", 0), uses[-1])
+        return accounts
+
+    def _pick(self, accounts, account_ids):
+        """
+        (best available account, None) or (None, time the earliest one
+        frees up).
+        """
+        now = time.time()
+        best = None
+        best_key = None
+        next_at = None
+        for account in accounts:
+            if not self._usable(account):
+                continue
+            if account_ids is not None and account["id"] not in account_ids:
+                continue
+            remaining, available_at = self.evaluate(account, now)
+            if self.max_leases_per_account and self._leased(account["id"]) >= self.max_leases_per_account:
+                # Frees up on release; poll again shortly
+                available_at = max(available_at, now + BUSY_POLL)
+            if self.breaker is not None:
+                available_at = max(available_at, self.breaker.open_until(account_key(account)))
+            if available_at > now or remaining <= 0:
+                next_at = available_at if next_at is None else min(next_at, available_at)
+                continue
+            key = (-remaining, account.get("last_used", 0))
+            if best is None or key < best_key:
+                best, best_key = account, key
+        return (best, None) if best is not None else (None, next_at)
+
+    def _persist(self, accounts):
+        # Inside a transaction: writes the batched uses along with it
+        self._merge_pending(accounts)
+        self._pending = {}
+        self._persisted_at = time.time()
+
+    def flush(self):
+        """
+        Writes the batched uses of unlimited accounts to accounts.json.
+        """
+        with self._lock:
+            if self._pending:
+                self.manager.transact(self._persist)
+
+    def acquire(self, account_ids=None):
+        """
+        Leases the best available account, or returns None and sets
+        `next_available_at`. `account_ids` restricts the candidates.
+        """
+        return self._acquire(account_ids)[0]
+
+    def _acquire(self, account_ids=None):
+        """
+        (lease, None), or (None, time the earliest account frees up; None
+        if none ever will).
+        """
+        with self._lock:
+            account, next_at = self._pick(self._merge_pending(self.manager.get_all_accounts()), account_ids)
+            if account is not None and not self._limited(account):
+                self._pending.setdefault(account["id"], []).append(time.time())
+                account = dict(account, last_used=self._pending[account["id"]][-1])
+                if time.time() - self._persisted_at >= PERSIST_INTERVAL:
+                    self.manager.transact(self._persist)
+            elif account is not None:
+                # Budgets are shared with other processes: pick again on the
+                # latest accounts.json and record the use in the same transaction
+                def pick(accounts):
+                    self._persist(accounts)
+                    best, next_at = self._pick(accounts, account_ids)
+                    if best is None:
+                        return None, next_at
+                    now = time.time()
+                    best["last_used"] = now
+                    best["usage"] = [t for t in best.get("usage", []) if t > now - DAY] + [now]
+                    return dict(best), None
+
+                account, next_at = self.manager.transact(pick)
+            self.next_available_at = next_at
+            if account is None:
+                return None, next_at
+
+            lease = Lease(next(self._ids), account)
+            self._leases[lease.id] = lease
+            return lease, None
+
+    def release(self, lease):
+        with self._lock:
+            self._leases.pop(lease.id, None)
+
+    def wait_time(self):
+        """
+        Seconds until `next_available_at`, or None if no account will ever be.
+        """
+        return _seconds_until(self.next_available_at)
+
+    def acquire_blocking(self, stop=None, log=None, account_ids=None):
+        """
+        Sleeps until an account can be leased. Returns None when there are
+        no usable accounts at all, or when the `stop` event is set.
+        """
+        while stop is None or not stop.is_set():
+            lease, next_at = self._acquire(account_ids)
+            if lease is not None:
+                return lease
+            wait = _seconds_until(next_at)
+            if wait is None:
+                return None
+            if log and wait > 60:
+                log(f"All accounts at their limits, next available at {time.strftime('%H:%M:%S', time.localtime(next_at))}")
+            if stop is not None:
+                stop.wait(wait)
+            else:
+                time.sleep(wait)
+        return None
+
+    async def acquire_async(self, log=None):
+        """
+        asyncio variant of acquire_blocking(). The accounts.json I/O of a
+        lease runs in a thread so it never blocks the event loop.
+        """
+        while True:
+            lease, next_at = await asyncio.to_thread(self._acquire)
+            if lease is not None:
+                return lease
+            wait = _seconds_until(next_at)
+            if wait is None:
+                return None
+            if log and wait > 60:
+                log(f"All accounts at their limits, next available at {time.strftime('%H:%M:%S', time.localtime(next_at))}")
+            await asyncio.sleep(wait)
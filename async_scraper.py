@@ -0,0 +1,350 @@
+import asyncio
+import time
+from playwright.async_api import async_playwright
+from debug_capture import DebugCapture
+from profiling import Tracer
+from projection import DEFAULT_SPEC, PROJECT_JS, is_empty
+from interception import ResourceBlocker, STATE_READY_JS, STATE_READY_TIMEOUT, WAIT_STATE
+from scraper import (BROWSER_ARGS, STEALTH_SCRIPT, DEFAULT_MAX_PAGES, DEFAULT_MAX_RSS_MB,
+                     DEFAULT_CONTEXTS_PER_ACCOUNT, browser_rss_mb, state_version)
+from session_health import SESSION_EXPIRED
+from metrics import metrics, PAGE_METRIC
+from logging_setup import get_logger
+from retry_policy import (AdaptiveTimeout, classify_exception, ERROR_LOGIN_REDIRECT, ERROR_EMPTY_STATE,
+                          ERROR_EXTRACTION)
+
+engine_log = get_logger("engine")
+scraper_log = get_logger("scraper")
+
+
+class AsyncScraperEngine:
+    """
+    asyncio counterpart of ScraperEngine for the concurrent pipeline.
+
+    One shared Chromium process; each worker owns a tab (page) in one of
+    the account's pooled contexts (see ScraperEngine) and keeps it across
+    many notes. When the recycle policy triggers, new tabs are held back
+    until every open tab has been closed, then the browser is relaunched.
+    Contexts that are dropped while tabs still use them are closed with
+    their last tab.
+
+        async with AsyncScraperEngine() as engine:
+            page = await engine.open_tab(state_file, user_agent)
+            ...
+            await engine.close_tab(page)
+
+    A `lazy` engine launches the browser with the first tab instead.
+    """
+
+    def __init__(self, headless=True, max_pages=DEFAULT_MAX_PAGES, max_rss_mb=DEFAULT_MAX_RSS_MB,
+                 contexts_per_account=DEFAULT_CONTEXTS_PER_ACCOUNT, lazy=False):
+        self.headless = headless
+        self.max_pages = max_pages
+        self.max_rss_mb = max_rss_mb
+        self.contexts_per_account = max(contexts_per_account, 1)
+        self.lazy = lazy
+        self.browser = None
+        self.pages_since_launch = 0
+        self.launches = 0
+        self.recycle_pending = False
+        self._playwright = None
+        self._contexts = {}
+        self._versions = {}
+        self._warm = {}
+        self._retired = set()
+        self._open_tabs = 0
+        self._cond = asyncio.Condition()
+
+    async def __aenter__(self):
+        return self if self.lazy else await self.start()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.stop()
+
+    async def start(self):
+        if self._playwright is None:
+            self._playwright = await async_playwright().start()
+        if self.browser is None:
+            await self._launch()
+            await self._rewarm()
+        return self
+
+    async def stop(self):
+        await self._close_browser()
+        if self._playwright is not None:
+            try:
+                await self._playwright.stop()
+            except Exception as e:
+                engine_log.warning("Failed to stop Playwright: %s", e)
+            self._playwright = None
+
+    async def _launch(self):
+        with metrics.stage("launch"):
+            self.browser = await self._playwright.chromium.launch(
+                headless=self.headless,
+                args=BROWSER_ARGS
+            )
+        self.pages_since_launch = 0
+        self.launches += 1
+        engine_log.info("Browser launched (#%d)", self.launches)
+
+    async def _close_browser(self):
+        for context in [c for pool in self._contexts.values() for c in pool] + list(self._retired):
+            try:
+                await context.close()
+            except Exception:
+                pass
+        self._contexts = {}
+        self._versions = {}
+        self._retired = set()
+        if self.browser is not None:
+            try:
+                await self.browser.close()
+            except Exception as e:
+                engine_log.warning("Failed to close browser: %s", e)
+            self.browser = None
+
+    async def _fill_pool(self, state_file, user_agent):
+        version = state_version(state_file)
+        if state_file in self._versions and self._versions[state_file] != version:
+            engine_log.info("%s changed on disk, reloading its contexts", state_file)
+            await self._retire_pool(state_file)
+        pool = self._contexts.setdefault(state_file, [])
+        while len(pool) < self.contexts_per_account:
+            with metrics.stage("context"):
+                context = await self.browser.new_context(
+                    storage_state=state_file,
+                    user_agent=user_agent
+                )
+                await context.add_init_script(STEALTH_SCRIPT)
+            pool.append(context)
+        self._versions[state_file] = version
+        return pool
+
+    async def _retire_pool(self, state_file):
+        for context in self._contexts.pop(state_file, []):
+            if context.pages:
+                self._retired.add(context)
+                continue
+            try:
+                await context.close()
+            except Exception:
+                pass
+        self._versions.pop(state_file, None)
+
+    async def warm(self, accounts):
+        """
+        Creates the context pool of each account now, and again after every
+        relaunch. A lazy engine that is not running yet only remembers the
+        accounts.
+        """
+        for account in accounts:
+            self._warm[account['state_file']] = account['user_agent']
+        if self.browser is not None or not self.lazy:
+            await self.start()
+            await self._rewarm()
+        return self
+
+    async def _rewarm(self):
+        for state_file, user_agent in list(self._warm.items()):
+            try:
+                await self._fill_pool(state_file, user_agent)
+            except Exception as e:
+                engine_log.warning("Failed to warm %s: %s", state_file, e)
+                self._warm.pop(state_file, None)
+
+    async def drop_context(self, state_file):
+        """
+        Stops using an account's contexts, e.g. after its session expired.
+        """
+        self._warm.pop(state_file, None)
+        await self._retire_pool(state_file)
+
+    async def _get_context(self, state_file, user_agent):
+        pool = await self._fill_pool(state_file, user_agent)
+        return min(pool, key=lambda context: len(context.pages))
+
+    async def open_tab(self, state_file, user_agent):
+        """
+        Opens a tab in the account's shared context. Waits while a recycle
+        is pending so no new work lands on a browser about to be closed.
+        """
+        async with self._cond:
+            await self._cond.wait_for(lambda: not self.recycle_pending)
+            await self.start()
+            context = await self._get_context(state_file, user_agent)
+            page = await context.new_page()
+            self._open_tabs += 1
+            return page
+
+    async def close_tab(self, page):
+        context = page.context
+        try:
+            await page.close()
+        except Exception:
+            pass
+        if context in self._retired and not context.pages:
+            self._retired.discard(context)
+            try:
+                await context.close()
+            except Exception:
+                pass
+        async with self._cond:
+            self._open_tabs -= 1
+            if self.recycle_pending and self._open_tabs == 0:
+                engine_log.info("Recycling browser after %d pages.", self.pages_since_launch)
+                await self._close_browser()
+                await self._launch()
+                await self._rewarm()
+                self.recycle_pending = False
+                self._cond.notify_all()
+
+    def page_done(self):
+        """
+        Counts a finished page and flags a recycle when the policy says so.
+        Workers must close their tab once `recycle_pending` is set.
+        """
+        self.pages_since_launch += 1
+        if self.recycle_pending:
+            return
+        if self.max_pages and self.pages_since_launch >= self.max_pages:
+            self.recycle_pending = True
+        elif self.max_rss_mb:
+            rss = browser_rss_mb()
+            if rss is not None and rss >= self.max_rss_mb:
+                self.recycle_pending = True
+
+
+class AsyncXHSScraper:
+    """
+    Scrapes notes on a tab owned by the caller (see AsyncScraperEngine).
+    Takes the same options and returns the same result dict as
+    XHSScraper.scrape_note. With a `fetcher`, callers try fetch_html()
+    first and only open a tab for the notes it hands back.
+    """
+
+    def __init__(self, blocker=None, wait_mode=WAIT_STATE, debug=None, projection=DEFAULT_SPEC, timeouts=None,
+                 fetcher=None, tracer=None):
+        self.blocker = blocker or ResourceBlocker()
+        self.wait_mode = wait_mode
+        self.debug = debug or DebugCapture()
+        self.projection = projection
+        self.timeouts = timeouts or AdaptiveTimeout()
+        self.fetcher = fetcher
+        self.tracer = tracer or Tracer()
+        self._page_hooks = {}
+
+    async def fetch_html(self, url, state_file, user_agent):
+        """
+        Result of the browserless path (run in a thread), or None when the
+        note needs a tab; notes to trace always do.
+        """
+        if self.fetcher is None or self.tracer.wanted(url):
+            return None
+        started = time.perf_counter()
+        result = await asyncio.to_thread(self.fetcher.fetch, url, state_file, user_agent)
+        if result is not None:
+            metrics.observe(PAGE_METRIC, time.perf_counter() - started)
+        return result
+
+    async def _hooks_for(self, page):
+        # Tabs are reused across notes: install interception and the request
+        # log once per tab, and reset their counters for each note
+        hooks = self._page_hooks.get(page)
+        if hooks is None:
+            hooks = (await self.blocker.install_async(page), self.debug.attach(page))
+            self._page_hooks[page] = hooks
+            page.once("close", lambda _: self._page_hooks.pop(page, None))
+        stats, request_log = hooks
+        stats.reset()
+        if request_log is not None:
+            request_log.reset()
+        return hooks
+
+    async def _wait_for_state(self, page):
+        try:
+            await page.wait_for_function(STATE_READY_JS, timeout=STATE_READY_TIMEOUT)
+        except Exception as e:
+            scraper_log.debug("State wait ended early: %s", e)
+            await page.wait_for_load_state("domcontentloaded")
+
+    async def scrape_on_page(self, page, url, trace=False):
+        result = {
+            "success": False,
+            "data": {},
+            "error": None,
+            "error_class": None,
+            "stats": {}
+        }
+
+        stats, request_log = await self._hooks_for(page)
+        chunk = await self.tracer.begin_async(page, url, force=trace)
+        page_started = time.perf_counter()
+        try:
+            scraper_log.info("Navigating to: %s", url, extra={"url": url})
+            timeout = self.timeouts.current()
+            started = time.time()
+            if self.wait_mode == WAIT_STATE:
+                with metrics.stage("navigate"):
+                    await page.goto(url, timeout=timeout, wait_until="domcontentloaded")
+                with metrics.stage("wait"):
+                    await self._wait_for_state(page)
+            else:
+                with metrics.stage("navigate"):
+                    await page.goto(url, timeout=timeout)
+                with metrics.stage("wait"):
+                    await page.wait_for_load_state("networkidle")
+            load_time = time.time() - started
+
+            await self.debug.capture_async(page, "after_navigation", request_log=request_log)
+
+            if "login" in page.url:
+                scraper_log.warning("Detected login redirect. URL: %s", page.url, extra={"url": url})
+                await self.debug.capture_async(page, "login_redirect", error=True, request_log=request_log)
+                result["error"] = SESSION_EXPIRED
+                result["error_class"] = ERROR_LOGIN_REDIRECT
+                return result
+
+            try:
+                if self.projection is None:
+                    with metrics.stage("extract"):
+                        data = await page.evaluate("() => window.__INITIAL_STATE__")
+                    error = None if data else "window.__INITIAL_STATE__ is empty"
+                else:
+                    with metrics.stage("extract"):
+                        data = await page.evaluate(PROJECT_JS, self.projection)
+                    if data is None:
+                        error = "window.__INITIAL_STATE__ is empty"
+                    elif is_empty(data):
+                        error = "No note found in window.__INITIAL_STATE__"
+                    else:
+                        error = None
+
+                if not error:
+                    result["data"] = data
+                    result["data"]["_scraped_url"] = url
+                    result["success"] = True
+                    self.timeouts.observe(load_time)
+                else:
+                    result["error"] = error
+                    result["error_class"] = ERROR_EMPTY_STATE
+                    await self.debug.capture_async(page, "empty_state", error=True, request_log=request_log)
+
+            except Exception as e:
+                result["error"] = f"Extraction error: {str(e)}"
+                result["error_class"] = ERROR_EXTRACTION
+                await self.debug.capture_async(page, "extraction_error", error=True, request_log=request_log)
+
+        except Exception as e:
+            result["error"] = str(e)
+            result["error_class"] = classify_exception(e)
+            await self.debug.capture_async(page, "scrape_error", error=True, request_log=request_log)
+        finally:
+            result["stats"] = stats.as_dict()
+            elapsed = time.perf_counter() - page_started
+            metrics.observe(PAGE_METRIC, elapsed)
+            trace_path = await self.tracer.end_async(chunk, url, elapsed)
+            if trace_path:
+                result["trace"] = trace_path
+
+        return result
@@ -0,0 +1,875 @@
+"""
+Offline benchmarks for the scraper pipeline.
+
+    python benchmark.py sink --input data/results.jsonl --records 2000
+    python benchmark.py sink --state-kb 300 --project
+    python benchmark.py scrape --workers 1,2,4 --login-rate 0.1
+    python benchmark.py run --workers 1,4
+    python benchmark.py fetch --workers 1,4 --login-rate 0.1
+    python benchmark.py startup --runs 20
+    python benchmark.py media --files 200 --file-kb 500 --concurrency 1,8,32
+
+`scrape` and `run` never touch the live site: they serve fixture note
+pages from a local server (see FixtureServer). `scrape` drives the
+scrapers directly, `run` runs the whole main.py pipeline in a scratch
+directory. `fetch` compares the browserless HTML fetch path (html_fetch.py)
+with the browser per note. `media` downloads generated files from a local static server
+(see MediaServer) with MediaDownloader and with a naive sequential
+baseline. `startup` times xhs.py commands from process start to exit.
+
+Results are printed as a table and can be saved as JSON with --output.
+"""
+import argparse
+import asyncio
+import http.server
+import json
+import os
+import random
+import shutil
+import socket
+import string
+import subprocess
+import sys
+import tempfile
+import concurrent.futures
+import threading
+import time
+import urllib.request
+import results_sink
+from results_sink import JsonlSink, COMPRESSIONS, open_results, results_files
+from projection import project
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+BENCH_USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36"
+
+
+def fake_state(size_kb=200, seed=0):
+    """
+    Builds a dict shaped like a note page's window.__INITIAL_STATE__: one
+    note in note.noteDetailMap, padded with feed/UI store noise up to about
+    `size_kb` KB of JSON.
+    """
+    rng = random.Random(seed)
+    note_id = "".join(rng.choice("0123456789abcdef") for _ in range(24))
+
+    def words(n):
+        return " ".join("".join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(2, 8))) for _ in range(n))
+
+    note = {
+        "noteId": note_id,
+        "title": f"笔记 {words(4)}",
+        "desc": f"{words(60)} #标签[话题]#",
+        "type": "normal",
+        "time": 1700000000000 + seed,
+        "user": {"userId": f"u{seed:023d}", "nickname": f"作者{seed}", "avatar": "https://example.invalid/a.jpg"},
+        "interactInfo": {
+            "likedCount": str(rng.randint(0, 50000)),
+            "collectedCount": str(rng.randint(0, 20000)),
+            "commentCount": str(rng.randint(0, 3000)),
+            "shareCount": str(rng.randint(0, 1000)),
+        },
+        "imageList": [
+            {"urlDefault": f"https://example.invalid/img/{note_id}/{i}.webp", "width": 1080, "height": 1440}
+            for i in range(rng.randint(1, 9))
+        ],
+        "tagList": [{"id": str(i), "name": words(1), "type": "topic"} for i in range(rng.randint(0, 6))],
+    }
+    state = {
+        "global": {"appSettings": {"notificationInterval": 30}, "serverTime": 1700000000000},
+        "user": {"loggedIn": True, "userInfo": {}, "activeTab": None},
+        "note": {"currentNoteId": note_id, "noteDetailMap": {note_id: {"note": note, "comments": {"list": []}}}},
+        "feed": {"feeds": []},
+    }
+
+    target = size_kb * 1024
+    size = len(json.dumps(state, ensure_ascii=False))
+    while size < target:
+        item = {"id": words(1), "noteCard": {"displayTitle": words(8), "cover": {"urlDefault": words(3)}}}
+        state["feed"]["feeds"].append(item)
+        size += len(json.dumps(item, ensure_ascii=False)) + 1
+    return state
+
+
+def load_states(path, limit):
+    """
+    Loads up to `limit` captured records (e.g. from data/results.jsonl).
+    """
+    states = []
+    with open_results(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            states.append(results_sink.loads(line))
+            if len(states) >= limit:
+                break
+    return states
+
+
+def bench_sink(states, records, compression, encoder):
+    """
+    Replays `states` through a JsonlSink until `records` have been written.
+    """
+    saved_orjson = results_sink.orjson
+    if encoder == "json":
+        results_sink.orjson = None
+
+    tmp = tempfile.mkdtemp(prefix="xhs_bench_")
+    try:
+        sink = JsonlSink(os.path.join(tmp, "results.jsonl"), compression=compression)
+        start = time.perf_counter()
+        for i in range(records):
+            sink.write(states[i % len(states)])
+        sink.close()
+        elapsed = time.perf_counter() - start
+        on_disk = sum(os.path.getsize(os.path.join(tmp, name)) for name in os.listdir(tmp))
+    finally:
+        results_sink.orjson = saved_orjson
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    return {
+        "encoder": encoder,
+        "compression": compression,
+        "records": records,
+        "seconds": round(elapsed, 4),
+        "records_per_sec": round(records / elapsed, 1),
+        "mb_per_sec": round(sink.bytes_in / elapsed / 1024 / 1024, 2),
+        "bytes_per_record_json": sink.bytes_in // records,
+        "bytes_per_record_disk": on_disk // records,
+    }
+
+
+def cmd_sink(args):
+    if args.input:
+        states = load_states(args.input, args.sample)
+        if not states:
+            raise SystemExit(f"No records in {args.input}")
+    else:
+        states = [fake_state(args.state_kb, seed) for seed in range(args.sample)]
+    if args.project:
+        states = [project(state) for state in states]
+
+    encoders = ["json"] + (["orjson"] if results_sink.orjson is not None else [])
+    compressions = [c for c in COMPRESSIONS if c != "zstd" or results_sink.zstandard is not None]
+
+    rows = []
+    for encoder in encoders:
+        for compression in compressions:
+            rows.append(bench_sink(states, args.records, compression, encoder))
+
+    print(f"{'encoder':8} {'compress':8} {'rec/s':>10} {'MB/s':>8} {'B/rec json':>12} {'B/rec disk':>12}")
+    for row in rows:
+        print(f"{row['encoder']:8} {row['compression']:8} {row['records_per_sec']:>10} {row['mb_per_sec']:>8} "
+              f"{row['bytes_per_record_json']:>12} {row['bytes_per_record_disk']:>12}")
+    return {"benchmark": "sink", "projected": args.project, "rows": rows}
+
+
+class FixtureServer:
+    """
+    Local stand-in for the note site.
+
+    Serves `notes` note pages at /explore/<note id>, each embedding a
+    window.__INITIAL_STATE__ of one of `sizes_kb` and `images` <img> tags
+    of `image_kb` KB each. A `login_rate` share of the notes redirect to
+    /login like an expired session does. Counts requests and bytes served.
+    """
+
+    def __init__(self, notes=40, sizes_kb=(50, 200, 800), images=6, image_kb=300, login_rate=0.0,
+                 latency_ms=0, seed=0):
+        self.latency = latency_ms / 1000
+        self.image = random.Random(seed).randbytes(image_kb * 1024)
+        self.pages = {}
+        self.redirects = set()
+        self.requests = 0
+        self.bytes_served = 0
+        self._lock = threading.Lock()
+        self._server = None
+
+        rng = random.Random(seed)
+        for i in range(notes):
+            state = fake_state(sizes_kb[i % len(sizes_kb)], seed=seed + i)
+            note_id = state["note"]["currentNoteId"]
+            self.pages[note_id] = self._render(note_id, state, images)
+        redirect_count = round(notes * login_rate)
+        self.redirects = set(rng.sample(sorted(self.pages), redirect_count))
+
+    @staticmethod
+    def _render(note_id, state, images):
+        # Like the site's serializer: unset values come out as bare `undefined`
+        payload = json.dumps(state, ensure_ascii=False).replace("</", "<\\/").replace(": null", ": undefined")
+        imgs = "".join(f'<img src="/img/{note_id}/{i}.webp">' for i in range(images))
+        return (f"<!DOCTYPE html><html><head><meta charset=\"utf-8\"><title>{note_id}</title></head>"
+                f"<body><div id=\"app\">{imgs}</div>"
+                f"<script>window.__INITIAL_STATE__={payload}</script></body></html>").encode("utf-8")
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def urls(self):
+        return [f"{self.base_url}/explore/{note_id}?xsec_source=bench" for note_id in self.pages]
+
+    def start(self):
+        fixture = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status, body=b"", content_type="text/html; charset=utf-8", headers=None):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+                with fixture._lock:
+                    fixture.requests += 1
+                    fixture.bytes_served += len(body)
+
+            def do_GET(self):
+                path = self.path.split("?")[0]
+                if fixture.latency:
+                    time.sleep(fixture.latency)
+                if path.startswith("/explore/"):
+                    note_id = path.rsplit("/", 1)[-1]
+                    if note_id in fixture.redirects:
+                        self._send(302, headers={"Location": f"/login?redirectPath={self.path}"})
+                    elif note_id in fixture.pages:
+                        self._send(200, fixture.pages[note_id])
+                    else:
+                        self._send(404, b"Not found")
+                elif path == "/login":
+                    self._send(200, b"<html><body><div class=\"login-container\">login</div></body></html>")
+                elif path.startswith("/img/"):
+                    self._send(200, fixture.image, content_type="image/webp")
+                else:
+                    self._send(404, b"Not found")
+
+        self._server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name="fixture-server", daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+
+class RssSampler:
+    """
+    Samples the resident memory (MB) of a process tree in the background
+    and keeps the peak. Peak is None without psutil.
+    """
+
+    def __init__(self, pid=None, interval=0.2):
+        self.pid = pid or os.getpid()
+        self.interval = interval
+        self.peak = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self):
+        try:
+            proc = psutil.Process(self.pid)
+            total = proc.memory_info().rss
+            for child in proc.children(recursive=True):
+                try:
+                    total += child.memory_info().rss
+                except (psutil.NoSuchProcess, psutil.AccessDenied):
+                    pass
+        except psutil.Error:
+            return
+        mb = total / (1024 * 1024)
+        self.peak = mb if self.peak is None else max(self.peak, mb)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def __enter__(self):
+        if psutil is not None:
+            self._sample()
+            self._thread = threading.Thread(target=self._run, name="rss-sampler", daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._sample()
+
+
+def _percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(int(len(values) * q), len(values) - 1)]
+
+
+def _scrape_row(workers, elapsed, latencies, outcomes, bytes_written, peak_rss, server):
+    pages = len(latencies)
+    return {
+        "workers": workers,
+        "pages": pages,
+        "outcomes": outcomes,
+        "seconds": round(elapsed, 3),
+        "pages_per_sec": round(pages / elapsed, 2) if elapsed else None,
+        "p50_ms": round(_percentile(latencies, 0.5) * 1000) if latencies else None,
+        "p95_ms": round(_percentile(latencies, 0.95) * 1000) if latencies else None,
+        "peak_rss_mb": round(peak_rss) if peak_rss is not None else None,
+        "bytes_written": bytes_written,
+        "bytes_served": server.bytes_served,
+    }
+
+
+def _bench_state_file(directory):
+    path = os.path.join(directory, "bench_state.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"cookies": [], "origins": []}, f)
+    return path
+
+
+def bench_scrape_sync(urls, state_file, blocker):
+    """
+    One link at a time through XHSScraper.scrape_note on a shared engine.
+    """
+    from scraper import ScraperEngine, XHSScraper
+
+    latencies, outcomes, written = [], {}, 0
+    with ScraperEngine(headless=True) as engine:
+        scraper = XHSScraper(engine=engine, blocker=blocker)
+        for url in urls:
+            started = time.perf_counter()
+            result = scraper.scrape_note(url, state_file, BENCH_USER_AGENT)
+            latencies.append(time.perf_counter() - started)
+            outcome = "success" if result["success"] else result["error_class"]
+            outcomes[outcome] = outcomes.get(outcome, 0) + 1
+            if result["success"]:
+                written += len(results_sink.dumps(result["data"])) + 1
+    return latencies, outcomes, written
+
+
+async def bench_scrape_async(urls, state_file, blocker, workers):
+    """
+    `workers` tabs on one AsyncScraperEngine, as the concurrent pipeline
+    runs them, without rate limiting.
+    """
+    from async_scraper import AsyncScraperEngine, AsyncXHSScraper
+
+    latencies, outcomes, written = [], {}, [0]
+    pending = asyncio.Queue()
+    for url in urls:
+        pending.put_nowait(url)
+    scraper = AsyncXHSScraper(blocker=blocker)
+
+    async with AsyncScraperEngine(headless=True) as engine:
+        async def worker():
+            page = await engine.open_tab(state_file, BENCH_USER_AGENT)
+            try:
+                while not pending.empty():
+                    url = pending.get_nowait()
+                    started = time.perf_counter()
+                    result = await scraper.scrape_on_page(page, url)
+                    latencies.append(time.perf_counter() - started)
+                    engine.page_done()
+                    outcome = "success" if result["success"] else result["error_class"]
+                    outcomes[outcome] = outcomes.get(outcome, 0) + 1
+                    if result["success"]:
+                        written[0] += len(results_sink.dumps(result["data"])) + 1
+                    if engine.recycle_pending:
+                        await engine.close_tab(page)
+                        page = await engine.open_tab(state_file, BENCH_USER_AGENT)
+            finally:
+                await engine.close_tab(page)
+
+        await asyncio.gather(*(worker() for _ in range(workers)))
+    return latencies, outcomes, written[0]
+
+
+def _fixture(args):
+    return FixtureServer(notes=args.notes, sizes_kb=tuple(int(s) for s in args.sizes.split(",")),
+                         images=args.images, image_kb=args.image_kb,
+                         login_rate=getattr(args, "login_rate", 0.0), latency_ms=args.latency_ms)
+
+
+def _print_scrape_rows(rows):
+    print(f"{'workers':>7} {'pages':>6} {'pages/s':>8} {'p50 ms':>7} {'p95 ms':>7} {'peak MB':>8} "
+          f"{'written KB':>11} {'served KB':>10}  outcomes")
+    for row in rows:
+        print(f"{row['workers']:>7} {row['pages']:>6} {row['pages_per_sec']!s:>8} {row['p50_ms']!s:>7} "
+              f"{row['p95_ms']!s:>7} {row['peak_rss_mb']!s:>8} {row['bytes_written'] // 1024:>11} "
+              f"{row['bytes_served'] // 1024:>10}  {row['outcomes']}")
+
+
+def cmd_scrape(args):
+    from interception import ResourceBlocker
+
+    blocker = ResourceBlocker(enabled=not args.no_block)
+    rows = []
+    tmp = tempfile.mkdtemp(prefix="xhs_bench_")
+    try:
+        state_file = _bench_state_file(tmp)
+        for workers in (int(w) for w in args.workers.split(",")):
+            with _fixture(args) as server, RssSampler() as rss:
+                started = time.perf_counter()
+                if workers == 1:
+                    latencies, outcomes, written = bench_scrape_sync(server.urls, state_file, blocker)
+                else:
+                    latencies, outcomes, written = asyncio.run(
+                        bench_scrape_async(server.urls, state_file, blocker, workers))
+                elapsed = time.perf_counter() - started
+            rows.append(_scrape_row(workers, elapsed, latencies, outcomes, written, rss.peak, server))
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    _print_scrape_rows(rows)
+    return {"benchmark": "scrape", "blocking": not args.no_block, "login_rate": args.login_rate,
+            "sizes_kb": args.sizes, "rows": rows}
+
+
+def bench_run(server, workers, no_block):
+    """
+    Runs `python main.py --workers N` in a scratch directory holding a
+    links.txt of the fixture URLs and one bench account without limits.
+    Returns (elapsed, metrics summary, bytes written, peak RSS).
+    """
+    from account_manager import AccountManager
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    tmp = tempfile.mkdtemp(prefix="xhs_bench_run_")
+    cwd = os.getcwd()
+    try:
+        os.chdir(tmp)
+        with open("links.txt", "w", encoding="utf-8") as f:
+            f.write("\n".join(server.urls) + "\n")
+        manager = AccountManager()
+        manager.add_account("bench", "bench", _bench_state_file(os.path.join("data", "accounts_state")),
+                            BENCH_USER_AGENT)
+    finally:
+        os.chdir(cwd)
+
+    command = [sys.executable, os.path.join(here, "main.py"), "--workers", str(workers), "--rate", "1000",
+               "--skip-session-check"] + (["--no-block"] if no_block else [])
+    try:
+        started = time.perf_counter()
+        proc = subprocess.Popen(command, cwd=tmp, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        with RssSampler(proc.pid) as rss:
+            proc.wait()
+        elapsed = time.perf_counter() - started
+        if proc.returncode:
+            raise SystemExit(f"main.py exited with {proc.returncode}; see {tmp}/data/scraper.log")
+
+        with open(os.path.join(tmp, "data", "metrics_summary.json"), encoding="utf-8") as f:
+            summary = json.load(f)
+        written = sum(os.path.getsize(path) for path in results_files(os.path.join(tmp, "data", "results.jsonl")))
+        return elapsed, summary, written, rss.peak
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def cmd_run(args):
+    rows = []
+    for workers in (int(w) for w in args.workers.split(",")):
+        with _fixture(args) as server:
+            elapsed, summary, written, peak = bench_run(server, workers, args.no_block)
+        page = summary["histograms"].get("xhs_page_seconds", {})
+        outcomes = {name.split('"')[1]: value for name, value in summary["counters"].items()
+                    if name.startswith("xhs_scrapes_total")}
+        pages = sum(outcomes.values())
+        rows.append({
+            "workers": workers,
+            "pages": pages,
+            "outcomes": outcomes,
+            "seconds": round(elapsed, 3),
+            "pages_per_sec": round(pages / elapsed, 2) if elapsed else None,
+            "p50_ms": round(page["p50"] * 1000) if page.get("p50") is not None else None,
+            "p95_ms": round(page["p95"] * 1000) if page.get("p95") is not None else None,
+            "peak_rss_mb": round(peak) if peak is not None else None,
+            "bytes_written": written,
+            "bytes_served": server.bytes_served,
+            "stages": {name: h for name, h in summary["histograms"].items() if name.startswith("xhs_stage_seconds")},
+        })
+
+    _print_scrape_rows(rows)
+    return {"benchmark": "run", "blocking": not args.no_block, "sizes_kb": args.sizes, "rows": rows}
+
+
+def _cpu_seconds():
+    """
+    CPU time of this process and its reaped children (Playwright's driver
+    and, through it, Chromium once the engine has stopped).
+    """
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+
+def bench_fetch(urls, state_file, workers):
+    """
+    HtmlFetcher alone on `workers` threads; notes it hands to the browser
+    count as fallbacks.
+    """
+    from html_fetch import HtmlFetcher
+
+    fetcher = HtmlFetcher()
+    latencies, outcomes, written = [], {}, [0]
+    lock = threading.Lock()
+
+    def fetch(url):
+        started = time.perf_counter()
+        result = fetcher.fetch(url, state_file, BENCH_USER_AGENT)
+        with lock:
+            latencies.append(time.perf_counter() - started)
+            outcome = "fallback" if result is None else "success"
+            outcomes[outcome] = outcomes.get(outcome, 0) + 1
+            if result is not None:
+                written[0] += len(results_sink.dumps(result["data"])) + 1
+
+    with concurrent.futures.ThreadPoolExecutor(workers) as pool:
+        list(pool.map(fetch, urls))
+    fetcher.close()
+    return latencies, outcomes, written[0], fetcher.counts
+
+
+def cmd_fetch(args):
+    try:
+        import playwright  # noqa: F401
+        paths = ["html", "browser"]
+    except ImportError:
+        print("Playwright not installed, measuring the HTML path only")
+        paths = ["html"]
+    from interception import ResourceBlocker
+
+    blocker = ResourceBlocker(enabled=not args.no_block)
+    rows = []
+    tmp = tempfile.mkdtemp(prefix="xhs_bench_")
+    try:
+        state_file = _bench_state_file(tmp)
+        for workers in (int(w) for w in args.workers.split(",")):
+            for path in paths:
+                counts = None
+                with _fixture(args) as server, RssSampler() as rss:
+                    cpu = _cpu_seconds()
+                    started = time.perf_counter()
+                    if path == "html":
+                        latencies, outcomes, written, counts = bench_fetch(server.urls, state_file, workers)
+                    elif workers == 1:
+                        latencies, outcomes, written = bench_scrape_sync(server.urls, state_file, blocker)
+                    else:
+                        latencies, outcomes, written = asyncio.run(
+                            bench_scrape_async(server.urls, state_file, blocker, workers))
+                    elapsed = time.perf_counter() - started
+                    cpu = _cpu_seconds() - cpu
+                row = _scrape_row(workers, elapsed, latencies, outcomes, written, rss.peak, server)
+                row["path"] = path
+                row["cpu_ms_per_page"] = round(cpu * 1000 / max(len(latencies), 1), 1)
+                if counts is not None:
+                    row["fetch_counts"] = counts
+                    row["html_hit_rate"] = round(counts["html"] / max(sum(counts.values()), 1), 3)
+                rows.append(row)
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    print(f"{'path':8} {'workers':>7} {'pages':>6} {'pages/s':>8} {'p50 ms':>7} {'CPU ms/page':>12} "
+          f"{'peak MB':>8}  outcomes")
+    for row in rows:
+        print(f"{row['path']:8} {row['workers']:>7} {row['pages']:>6} {row['pages_per_sec']!s:>8} "
+              f"{row['p50_ms']!s:>7} {row['cpu_ms_per_page']:>12} {row['peak_rss_mb']!s:>8}  {row['outcomes']}")
+    for row in rows:
+        if row["path"] == "html":
+            print(f"html path, {row['workers']} workers: hit rate {row['html_hit_rate']:.0%} {row['fetch_counts']}")
+    return {"benchmark": "fetch", "login_rate": args.login_rate, "sizes_kb": args.sizes, "rows": rows}
+
+
+# Commands timed by `startup`, and the packages none of the non-browser ones may load
+STARTUP_COMMANDS = ("--help", "accounts list", "results export --limit 0", "serve --help", "scrape --help")
+HEAVY_MODULES = ("playwright", "flask")
+
+
+def bench_startup(command, runs, cwd):
+    """
+    Wall times of `runs` runs of `python xhs.py <command>`, its exit code,
+    and the heavy packages it imported (from one -X importtime run).
+    """
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "xhs.py")
+    argv = [script] + command.split() if command else []
+    times = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        proc = subprocess.run([sys.executable] + argv, cwd=cwd, stdout=subprocess.DEVNULL,
+                              stderr=subprocess.DEVNULL)
+        times.append(time.perf_counter() - started)
+    traced = subprocess.run([sys.executable, "-X", "importtime"] + argv, cwd=cwd, stdout=subprocess.DEVNULL,
+                            stderr=subprocess.PIPE, text=True)
+    imported = {line.rsplit("|", 1)[-1].strip().split(".")[0]
+                for line in traced.stderr.splitlines() if line.startswith("import time:")}
+    return times, proc.returncode, sorted(imported & set(HEAVY_MODULES))
+
+
+def cmd_startup(args):
+    commands = args.commands.split(",") if args.commands else STARTUP_COMMANDS
+    rows = []
+    tmp = tempfile.mkdtemp(prefix="xhs_bench_startup_")
+    try:
+        # The bare interpreter first, as the floor
+        for command in [None] + list(commands):
+            if command is None:
+                times = []
+                for _ in range(args.runs):
+                    started = time.perf_counter()
+                    subprocess.run([sys.executable, "-c", "pass"])
+                    times.append(time.perf_counter() - started)
+                code, heavy = 0, []
+            else:
+                times, code, heavy = bench_startup(command, args.runs, tmp)
+            rows.append({
+                "command": "(python -c pass)" if command is None else command,
+                "runs": args.runs,
+                "median_ms": round(_percentile(times, 0.5) * 1000, 1),
+                "min_ms": round(min(times) * 1000, 1),
+                "exit_code": code,
+                "heavy_imports": heavy,
+            })
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    print(f"{'command':28} {'median ms':>10} {'min ms':>8} {'exit':>5}  heavy imports")
+    for row in rows:
+        print(f"{row['command']:28} {row['median_ms']:>10} {row['min_ms']:>8} {row['exit_code']:>5}  "
+              f"{', '.join(row['heavy_imports']) or '-'}")
+    return {"benchmark": "startup", "rows": rows}
+
+
+class MediaServer:
+    """
+    Local static file server for media downloads.
+
+    Serves `files` files of `file_kb` KB at /media/<n>.webp, honouring
+    Range requests; a `dup_rate` share of them repeat the content of
+    another file, like images reused across notes. Counts requests,
+    connections and bytes served.
+    """
+
+    def __init__(self, files=200, file_kb=500, dup_rate=0.2, latency_ms=0, seed=0):
+        self.latency = latency_ms / 1000
+        rng = random.Random(seed)
+        distinct = [rng.randbytes(file_kb * 1024) for _ in range(max(1, round(files * (1 - dup_rate))))]
+        self.files = [distinct[i] if i < len(distinct) else rng.choice(distinct) for i in range(files)]
+        self.distinct = len(distinct)
+        self.requests = 0
+        self.connections = 0
+        self.bytes_served = 0
+        self._lock = threading.Lock()
+        self._server = None
+
+    @property
+    def urls(self):
+        host, port = self._server.server_address[:2]
+        return [f"http://{host}:{port}/media/{i}.webp" for i in range(len(self.files))]
+
+    def start(self):
+        media = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def setup(self):
+                super().setup()
+                # Keep-alive responses would otherwise wait ~40 ms on a delayed ACK
+                self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                with media._lock:
+                    media.connections += 1
+
+            def do_GET(self):
+                if media.latency:
+                    time.sleep(media.latency)
+                try:
+                    body = media.files[int(self.path.rsplit("/", 1)[-1].split(".")[0])]
+                except (ValueError, IndexError):
+                    self.send_error(404)
+                    return
+                start, status = 0, 200
+                ranged = (self.headers.get("Range") or "").removeprefix("bytes=").split("-")[0]
+                if ranged.isdigit():
+                    start = int(ranged)
+                    if start >= len(body):
+                        self.send_response(416)
+                        self.send_header("Content-Range", f"bytes */{len(body)}")
+                        self.send_header("Content-Length", "0")
+                        self.end_headers()
+                        return
+                    status = 206
+                self.send_response(status)
+                self.send_header("Content-Type", "image/webp")
+                self.send_header("Content-Length", str(len(body) - start))
+                if status == 206:
+                    self.send_header("Content-Range", f"bytes {start}-{len(body) - 1}/{len(body)}")
+                self.end_headers()
+                self.wfile.write(body[start:])
+                with media._lock:
+                    media.requests += 1
+                    media.bytes_served += len(body) - start
+
+        self._server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name="media-server", daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+
+def bench_media_naive(urls, directory):
+    """
+    Baseline: one file at a time, a new connection per file, the whole
+    body read into memory before it is written.
+    """
+    for i, url in enumerate(urls):
+        with urllib.request.urlopen(url) as response:
+            body = response.read()
+        with open(os.path.join(directory, f"{i}.webp"), "wb") as f:
+            f.write(body)
+
+
+def _stored(directory):
+    files = [os.path.join(root, name) for root, _, names in os.walk(directory) for name in names
+             if not name.startswith("index.db")]
+    return len(files), sum(os.path.getsize(path) for path in files)
+
+
+def cmd_media(args):
+    from media_downloader import MediaDownloader, aiohttp
+
+    modes = [("naive", 1)] + [(backend, concurrency)
+                              for backend in ["threads"] + (["aiohttp"] if aiohttp is not None else [])
+                              for concurrency in (int(c) for c in args.concurrency.split(","))]
+    rows = []
+    for mode, concurrency in modes:
+        tmp = tempfile.mkdtemp(prefix="xhs_bench_media_")
+        try:
+            with MediaServer(args.files, args.file_kb, args.dup_rate, args.latency_ms) as server, RssSampler() as rss:
+                started = time.perf_counter()
+                if mode == "naive":
+                    bench_media_naive(server.urls, tmp)
+                    failed = 0
+                else:
+                    downloader = MediaDownloader(tmp, concurrency=concurrency, per_host=concurrency, backend=mode)
+                    downloader.run(server.urls)
+                    downloader.close()
+                    failed = downloader.stats["failed"]
+                elapsed = time.perf_counter() - started
+            stored_files, stored_bytes = _stored(tmp)
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+        rows.append({
+            "mode": mode,
+            "concurrency": concurrency,
+            "files": args.files,
+            "failed": failed,
+            "seconds": round(elapsed, 3),
+            "files_per_sec": round(args.files / elapsed, 1),
+            "mb_per_sec": round(server.bytes_served / elapsed / 1024 / 1024, 1),
+            "connections": server.connections,
+            "stored_files": stored_files,
+            "stored_mb": round(stored_bytes / 1024 / 1024, 1),
+            "peak_rss_mb": round(rss.peak) if rss.peak is not None else None,
+        })
+
+    print(f"{'mode':8} {'conc':>5} {'files/s':>8} {'MB/s':>7} {'conns':>6} {'stored':>7} {'stored MB':>10} "
+          f"{'peak MB':>8} {'failed':>7}")
+    for row in rows:
+        print(f"{row['mode']:8} {row['concurrency']:>5} {row['files_per_sec']:>8} {row['mb_per_sec']:>7} "
+              f"{row['connections']:>6} {row['stored_files']:>7} {row['stored_mb']:>10} "
+              f"{row['peak_rss_mb']!s:>8} {row['failed']:>7}")
+    return {"benchmark": "media", "file_kb": args.file_kb, "dup_rate": args.dup_rate,
+            "latency_ms": args.latency_ms, "rows": rows}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline scraper benchmarks")
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--output", help="Also write the results as JSON to this file")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("sink", parents=[common], help="Results sink throughput and bytes per record")
+    p.add_argument("--input", help="Captured results (.jsonl[.gz|.zst]) to replay; synthetic states if omitted")
+    p.add_argument("--records", type=int, default=2000)
+    p.add_argument("--sample", type=int, default=20, help="Distinct states to cycle through")
+    p.add_argument("--state-kb", type=int, default=200, help="Size of synthetic states")
+    p.add_argument("--project", action="store_true", help="Write projected note fields instead of raw states")
+    p.set_defaults(func=cmd_sink)
+
+    fixture = argparse.ArgumentParser(add_help=False)
+    fixture.add_argument("--workers", default="1,2,4", help="Comma-separated worker counts to compare")
+    fixture.add_argument("--notes", type=int, default=40, help="Fixture note pages per run")
+    fixture.add_argument("--sizes", default="50,200,800", help="Comma-separated __INITIAL_STATE__ sizes (KB)")
+    fixture.add_argument("--images", type=int, default=6, help="Images per page")
+    fixture.add_argument("--image-kb", type=int, default=300, help="Size of each image")
+    fixture.add_argument("--latency-ms", type=int, default=0, help="Server delay per request")
+    fixture.add_argument("--no-block", action="store_true", help="Load images instead of aborting them")
+
+    p = sub.add_parser("scrape", parents=[common, fixture], help="Scraper throughput against local fixture pages")
+    p.add_argument("--login-rate", type=float, default=0.0, help="Share of notes that redirect to /login")
+    p.set_defaults(func=cmd_scrape)
+
+    p = sub.add_parser("run", parents=[common, fixture], help="End-to-end main.py runs against local fixture pages")
+    p.set_defaults(func=cmd_run)
+
+    p = sub.add_parser("fetch", parents=[common, fixture], help="HTML fetch path vs browser path per note")
+    p.add_argument("--login-rate", type=float, default=0.0, help="Share of notes that redirect to /login")
+    p.set_defaults(func=cmd_fetch)
+
+    p = sub.add_parser("startup", parents=[common], help="Start-up time of xhs.py commands")
+    p.add_argument("--runs", type=int, default=10, help="Runs per command")
+    p.add_argument("--commands", help=f"Comma-separated xhs.py commands (default: {', '.join(STARTUP_COMMANDS)})")
+    p.set_defaults(func=cmd_startup)
+
+    p = sub.add_parser("media", parents=[common], help="Media download throughput against a local file server")
+    p.add_argument("--files", type=int, default=200)
+    p.add_argument("--file-kb", type=int, default=500)
+    p.add_argument("--dup-rate", type=float, default=0.2, help="Share of files repeating another file's content")
+    p.add_argument("--concurrency", default="1,8,32", help="Comma-separated download concurrencies to compare")
+    p.add_argument("--latency-ms", type=int, default=0, help="Server delay per request")
+    p.set_defaults(func=cmd_media)
+
+    args = parser.parse_args(argv)
+    report = args.func(args)
+    report["timestamp"] = time.time()
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,6 @@
 import os
 import time
-from login_handler import LoginHandler
+from login_handler import LoginHandler, SCANNED
 from account_manager import AccountManager
 
 def run():
@@ -10,13 +10,11 @@ def run():
     print("=== CLI Login Tool ===")
     
     # Callback to handle QR code locally
-    def on_qr_code(page):
+    def on_qr_code(png):
         # Save locally
         qr_filename = "login_qr_cli.png"
-        if os.path.exists(qr_filename):
-            os.remove(qr_filename)
-            
-        page.screenshot(path=qr_filename)
+        with open(qr_filename, "wb") as f:
+            f.write(png)
         abs_path = os.path.abspath(qr_filename)
         print(f"\n[Action Required] QR Code saved to: {abs_path}")
         print("Please open this image and scan it with your Xiaohongshu App.")
@@ -32,13 +30,18 @@ def run():
     def on_status(msg):
         print(f"[Status] {msg}")
 
+    def on_state(state):
+        if state == SCANNED:
+            print("\n[Action Required] Scanned. Confirm the login on your phone.")
+
     # Generate a fresh UA for this login
     ua = manager.get_user_agent_for_session()
     
     result = handler.login(
         user_agent=ua,
         qr_callback=on_qr_code,
-        status_callback=on_status
+        status_callback=on_status,
+        state_callback=on_state
     )
     
     if result["success"]:
@@ -0,0 +1,253 @@
+import itertools
+import json
+import os
+import queue
+import random
+import threading
+import time
+from metrics import metrics
+from logging_setup import get_logger
+
+logger = get_logger("debug")
+
+SCREENSHOT_DIR = os.path.join("log", "debug_screenshots")
+
+POLICY_OFF = "off"
+POLICY_ON_ERROR = "on_error"
+POLICY_SAMPLE = "sample"
+POLICY_ALWAYS = "always"
+POLICIES = (POLICY_OFF, POLICY_ON_ERROR, POLICY_SAMPLE, POLICY_ALWAYS)
+
+# Retention for the capture directory
+DEFAULT_MAX_BYTES = 200 * 1024 * 1024
+DEFAULT_MAX_AGE_DAYS = 7
+PRUNE_EVERY = 50
+
+# Captures waiting for the writer; beyond this they are dropped, never blocking a scrape
+MAX_PENDING = 100
+
+
+def prune_directory(directory, max_bytes=DEFAULT_MAX_BYTES, max_age_days=DEFAULT_MAX_AGE_DAYS):
+    """
+    Deletes files older than `max_age_days`, then the oldest files until the
+    directory holds at most `max_bytes`. Returns the number of files removed.
+    """
+    if not os.path.isdir(directory):
+        return 0
+
+    files = []
+    for entry in os.scandir(directory):
+        if entry.is_file():
+            stat = entry.stat()
+            files.append((stat.st_mtime, stat.st_size, entry.path))
+    files.sort()
+
+    removed = 0
+    total = sum(size for _, size, _ in files)
+    cutoff = time.time() - max_age_days * 86400 if max_age_days else None
+    for mtime, size, path in files:
+        if (cutoff is not None and mtime < cutoff) or (max_bytes and total > max_bytes):
+            try:
+                os.remove(path)
+                removed += 1
+                total -= size
+            except OSError:
+                pass
+    return removed
+
+
+class RequestLog:
+    """
+    Lightweight request recorder for a page, dumped as a minimal HAR file
+    when a capture asks for it. Only reads event properties, so the same
+    handlers work with the sync and the async Playwright API.
+    """
+
+    def __init__(self):
+        self.entries = []
+
+    def reset(self):
+        self.entries = []
+
+    def attach(self, page):
+        page.on("response", self._on_response)
+        page.on("requestfailed", self._on_failed)
+        return self
+
+    def _entry(self, request, status, failure=None):
+        timing = request.timing or {}
+        entry = {
+            "startedDateTime": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime()),
+            "time": max(timing.get("responseEnd", -1), 0),
+            "request": {"method": request.method, "url": request.url},
+            "response": {"status": status},
+            "timings": timing,
+            "_resourceType": request.resource_type,
+        }
+        if failure:
+            entry["_failure"] = failure
+        return entry
+
+    def _on_response(self, response):
+        try:
+            self.entries.append(self._entry(response.request, response.status))
+        except Exception:
+            pass
+
+    def _on_failed(self, request):
+        try:
+            self.entries.append(self._entry(request, 0, request.failure))
+        except Exception:
+            pass
+
+    def to_har(self):
+        return {
+            "log": {
+                "version": "1.2",
+                "creator": {"name": "xhs-scraper", "version": "1"},
+                "entries": list(self.entries),
+            }
+        }
+
+
+class DebugCapture:
+    """
+    Debug capture policy for scrape pages.
+
+    policy:
+        "off"       never capture
+        "on_error"  capture failed pages only (default)
+        "sample"    failed pages plus `sample_percent` % of successful ones
+        "always"    capture every page
+
+    Page data (screenshot, optionally HTML and a HAR of the page's requests)
+    is grabbed on the scrape thread; encoding to disk and retention run on a
+    background writer thread.
+    """
+
+    def __init__(self, policy=POLICY_ON_ERROR, sample_percent=0.0, capture_html=False,
+                 capture_har=False, directory=SCREENSHOT_DIR,
+                 max_bytes=DEFAULT_MAX_BYTES, max_age_days=DEFAULT_MAX_AGE_DAYS):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown debug capture policy: {policy}")
+        self.policy = policy
+        self.sample_percent = sample_percent
+        self.capture_html = capture_html
+        self.capture_har = capture_har
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age_days = max_age_days
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=MAX_PENDING)
+        self._thread = None
+        self._thread_lock = threading.Lock()
+        self._counter = itertools.count()
+        self._written = 0
+
+    def wants(self, error=False):
+        if self.policy == POLICY_OFF:
+            return False
+        if self.policy == POLICY_ALWAYS or error:
+            return True
+        if self.policy == POLICY_SAMPLE:
+            return random.random() * 100 < self.sample_percent
+        return False
+
+    def attach(self, page):
+        """
+        Starts recording the page's requests when HAR capture is on.
+        Returns the RequestLog, or None.
+        """
+        if self.capture_har and self.policy != POLICY_OFF:
+            return RequestLog().attach(page)
+        return None
+
+    def _name(self, name_prefix):
+        timestamp = time.strftime("%Y%m%d_%H%M%S")
+        return f"{name_prefix}_{timestamp}_{next(self._counter)}"
+
+    def capture(self, page, name_prefix="debug", error=False, request_log=None):
+        """
+        Captures a sync API page if the policy wants it.
+        """
+        if not self.wants(error):
+            return
+        try:
+            with metrics.stage("screenshot"):
+                png = page.screenshot()
+                html = page.content() if self.capture_html else None
+        except Exception as e:
+            logger.warning("Failed to capture page: %s", e)
+            return
+        self._submit(self._name(name_prefix), png, html, request_log)
+
+    async def capture_async(self, page, name_prefix="debug", error=False, request_log=None):
+        """
+        Captures an async API page if the policy wants it.
+        """
+        if not self.wants(error):
+            return
+        try:
+            with metrics.stage("screenshot"):
+                png = await page.screenshot()
+                html = await page.content() if self.capture_html else None
+        except Exception as e:
+            logger.warning("Failed to capture page: %s", e)
+            return
+        self._submit(self._name(name_prefix), png, html, request_log)
+
+    def _submit(self, name, png, html, request_log):
+        har = request_log.to_har() if (self.capture_har and request_log is not None) else None
+        self._ensure_writer()
+        try:
+            self._queue.put_nowait((name, png, html, har))
+        except queue.Full:
+            self.dropped += 1
+
+    def _ensure_writer(self):
+        with self._thread_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._write_loop, name="debug-capture", daemon=True)
+                self._thread.start()
+
+    def _write_loop(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                self._write(*item)
+            finally:
+                self._queue.task_done()
+
+    def _write(self, name, png, html, har):
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory, exist_ok=True)
+        base = os.path.join(self.directory, name)
+        try:
+            with open(base + ".png", "wb") as f:
+                f.write(png)
+            if html is not None:
+                with open(base + ".html", "w", encoding="utf-8") as f:
+                    f.write(html)
+            if har is not None:
+                with open(base + ".har", "w", encoding="utf-8") as f:
+                    json.dump(har, f, ensure_ascii=False)
+            logger.info("Saved debug capture: %s.png", base)
+        except Exception as e:
+            logger.warning("Failed to save debug capture: %s", e)
+
+        self._written += 1
+        if self._written % PRUNE_EVERY == 1:
+            prune_directory(self.directory, self.max_bytes, self.max_age_days)
+
+    def close(self):
+        """
+        Waits for pending captures to be written and stops the writer.
+        """
+        with self._thread_lock:
+            thread = self._thread
+            self._thread = None
+        if thread is not None and thread.is_alive():
+            self._queue.put(None)
+            thread.join()
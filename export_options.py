@@ -0,0 +1,17 @@
+"""
+Command-line options of a notes export, shared by `note_store.py export`
+and `xhs.py results export`. Standard library only, so the xhs.py parser
+can build them without importing note_store.
+"""
+
+EXPORT_FORMATS = ("jsonl", "csv")
+
+
+def add_export_arguments(parser):
+    parser.add_argument("--format", choices=EXPORT_FORMATS, default="jsonl")
+    parser.add_argument("--output", help="Destination file (default: stdout)")
+    parser.add_argument("--author", help="Author user ID")
+    parser.add_argument("--account", help="Nickname of the account used")
+    parser.add_argument("--since-hours", type=float, help="Only notes scraped in the last H hours")
+    parser.add_argument("--min-likes", type=int, help="Only notes with at least N likes")
+    parser.add_argument("--limit", type=int, default=None, help="At most N notes (default: all)")
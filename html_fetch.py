@@ -0,0 +1,216 @@
+"""
+Browserless note scraping.
+
+Note pages are server-rendered with their whole window.__INITIAL_STATE__
+inlined as a script, so most notes need no browser at all: HtmlFetcher
+downloads the page over pooled keep-alive connections with the account's
+cookies (from its storage_state file) and extract_state() parses the
+state straight out of the HTML.
+
+    fetcher = HtmlFetcher()
+    result = fetcher.fetch(url, state_file, user_agent)
+    if result is None:
+        ...  # needs the browser
+
+fetch() returns a scrape_note-style result on a hit and None whenever
+the browser has to take over: the state is missing or empty, the page
+redirects to login, or the request fails. Both paths are counted in
+xhs_fetch_path_total.
+"""
+import gzip
+import threading
+import zlib
+from urllib.parse import urljoin, urlsplit
+from http_pool import ConnectionPool
+from projection import DEFAULT_SPEC, is_empty, project
+from results_sink import loads
+from session_health import cookie_header, load_cookies, state_version
+from metrics import metrics, FETCH_PATH_METRIC
+from logging_setup import get_logger
+
+logger = get_logger("fetch")
+
+FETCH_TIMEOUT = 15
+MAX_REDIRECTS = 3
+MAX_IDLE_PER_HOST = 8
+
+HTML = "html"
+BROWSER = "browser"
+
+# Why a note went to the browser
+FALLBACK_LOGIN = "login_redirect"
+FALLBACK_NO_STATE = "no_state"
+FALLBACK_EMPTY = "empty_state"
+FALLBACK_STATUS = "http_status"
+FALLBACK_ERROR = "error"
+
+STATE_MARKER = b"window.__INITIAL_STATE__"
+SCRIPT_END = b"</script>"
+
+# JS values the state may hold that JSON lacks
+JS_LITERALS = (b"undefined", b"NaN", b"Infinity")
+VALUE_BEFORE = (b":", b",", b"[")
+VALUE_AFTER = (b",", b"}", b"]")
+
+
+def null_literals(payload):
+    """
+    Replaces the bare JS literals (undefined, NaN, -Infinity...) standing
+    as values in `payload` with null. Plain substring scans: a regex that
+    skips over strings costs ~50x more on a large state. The price is
+    that a string containing e.g. `:undefined,` is rewritten too.
+    """
+    for literal in JS_LITERALS:
+        i = payload.find(literal)
+        if i < 0:
+            continue
+        parts, last = [], 0
+        while i >= 0:
+            start = i - 1 if literal == b"Infinity" and payload[i - 1:i] == b"-" else i
+            end = i + len(literal)
+            if (payload[max(start - 8, 0):start].rstrip()[-1:] in VALUE_BEFORE
+                    and payload[end:end + 8].lstrip()[:1] in VALUE_AFTER):
+                parts += (payload[last:start], b"null")
+                last = end
+            i = payload.find(literal, end)
+        parts.append(payload[last:])
+        payload = b"".join(parts)
+    return payload
+
+
+def extract_state(html):
+    """
+    The window.__INITIAL_STATE__ object inlined in a page's HTML (bytes),
+    or None. The state is parsed as JSON, after null_literals() when it
+    holds JS-only values.
+    """
+    start = html.find(STATE_MARKER)
+    if start < 0:
+        return None
+    start = html.find(b"=", start + len(STATE_MARKER))
+    end = html.find(SCRIPT_END, start)
+    if start < 0 or end < 0:
+        return None
+    payload = html[start + 1:end].strip().rstrip(b";")
+    try:
+        state = loads(payload)
+    except ValueError:
+        try:
+            state = loads(null_literals(payload))
+        except ValueError:
+            return None
+    return state if isinstance(state, dict) else None
+
+
+def _decode(response, body):
+    encoding = (response.getheader("Content-Encoding") or "").lower()
+    if encoding == "gzip":
+        return gzip.decompress(body)
+    if encoding == "deflate":
+        return zlib.decompress(body)
+    return body
+
+
+class HtmlFetcher:
+    """
+    Fetches note pages over plain HTTP and extracts their state. Thread
+    safe; cookies are re-read whenever an account's state file changes.
+    `counts` holds the hits and the fallbacks by reason.
+    """
+
+    def __init__(self, projection=DEFAULT_SPEC, timeout=FETCH_TIMEOUT, pool=None):
+        self.projection = projection
+        self.pool = pool or ConnectionPool(max_idle_per_host=MAX_IDLE_PER_HOST, timeout=timeout)
+        self.counts = {HTML: 0}
+        self._cookies = {}
+        self._lock = threading.Lock()
+
+    def close(self):
+        self.pool.close()
+
+    def _cookies_for(self, state_file):
+        version = state_version(state_file)
+        cached = self._cookies.get(state_file)
+        if cached is None or cached[0] != version:
+            cached = (version, load_cookies(state_file))
+            self._cookies[state_file] = cached
+        return cached[1]
+
+    def _count(self, path, reason=None):
+        with self._lock:
+            key = reason or path
+            self.counts[key] = self.counts.get(key, 0) + 1
+        metrics.inc(FETCH_PATH_METRIC, path=path, **({"reason": reason} if reason else {}))
+
+    def _fallback(self, url, reason, detail=""):
+        logger.debug("Falling back to the browser (%s%s)", reason, f": {detail}" if detail else "",
+                     extra={"url": url})
+        self._count(BROWSER, reason)
+        return None
+
+    def _get(self, url, cookies, user_agent):
+        """
+        (status, final URL, body) following non-login redirects; the status
+        is None when the page redirected to login.
+        """
+        for _ in range(MAX_REDIRECTS + 1):
+            response = self.pool.request("GET", url, headers={
+                "User-Agent": user_agent,
+                "Accept": "text/html,application/xhtml+xml",
+                "Accept-Encoding": "gzip, deflate",
+                "Accept-Language": "zh-CN,zh;q=0.9",
+                "Cookie": cookie_header(cookies, urlsplit(url).hostname or ""),
+            })
+            try:
+                body = response.read()
+            finally:
+                self.pool.release(response)
+            if response.status in (301, 302, 303, 307, 308):
+                url = urljoin(url, response.getheader("Location") or "")
+                if "login" in urlsplit(url).path:
+                    return None, url, b""
+                continue
+            return response.status, url, _decode(response, body)
+        return response.status, url, b""
+
+    def fetch(self, url, state_file, user_agent):
+        """
+        Result dict as XHSScraper.scrape_note returns it, or None when the
+        note needs the browser.
+        """
+        try:
+            with metrics.stage("fetch"):
+                status, final_url, html = self._get(url, self._cookies_for(state_file), user_agent)
+        except Exception as e:
+            return self._fallback(url, FALLBACK_ERROR, str(e))
+        if status is None:
+            return self._fallback(url, FALLBACK_LOGIN, final_url)
+        if status != 200:
+            return self._fallback(url, FALLBACK_STATUS, str(status))
+
+        with metrics.stage("extract"):
+            state = extract_state(html)
+            if state is None:
+                return self._fallback(url, FALLBACK_NO_STATE)
+            fields = project(state, self.projection or DEFAULT_SPEC)
+        # A client-rendered note ships a state without the note in it
+        if is_empty(fields) or ("note_id" in fields and not fields["note_id"]):
+            return self._fallback(url, FALLBACK_EMPTY)
+        data = state if self.projection is None else fields
+
+        self._count(HTML)
+        data["_scraped_url"] = url
+        return {"success": True, "data": data, "error": None, "error_class": None, "stats": {}}
+
+    def summary(self):
+        """
+        One line with the hit rate of each path, for the end of a run.
+        """
+        with self._lock:
+            counts = dict(self.counts)
+        total = sum(counts.values())
+        if not total:
+            return "HTML fetch: no notes"
+        fallbacks = ", ".join(f"{reason} {n}" for reason, n in counts.items() if reason != HTML)
+        return (f"HTML fetch: {counts[HTML]}/{total} notes without a browser "
+                f"({counts[HTML] / total:.0%}){f'; browser fallbacks: {fallbacks}' if fallbacks else ''}")
@@ -0,0 +1,94 @@
+import http.client
+import threading
+from urllib.parse import urlsplit
+
+DEFAULT_MAX_IDLE = 4
+DEFAULT_TIMEOUT = 30
+
+# Errors of a kept-alive connection the server closed in the meantime
+STALE_ERRORS = (http.client.RemoteDisconnected, http.client.CannotSendRequest, ConnectionResetError,
+                BrokenPipeError)
+
+
+class ConnectionPool:
+    """
+    Keep-alive http.client connections, pooled per (scheme, host, port) and
+    shared between threads.
+
+        response = pool.request("GET", url, headers)
+        body = response.read()
+        pool.release(response)
+
+    A connection goes back to the pool on release() once its response has
+    been read to the end; otherwise it is closed. `opened` and `reused`
+    count connection setups and pool hits.
+    """
+
+    def __init__(self, max_idle_per_host=DEFAULT_MAX_IDLE, timeout=DEFAULT_TIMEOUT):
+        self.max_idle_per_host = max_idle_per_host
+        self.timeout = timeout
+        self.opened = 0
+        self.reused = 0
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(url):
+        parts = urlsplit(url)
+        return parts.scheme, parts.hostname, parts.port or (443 if parts.scheme == "https" else 80)
+
+    def _take(self, key):
+        with self._lock:
+            idle = self._idle.get(key)
+            if idle:
+                self.reused += 1
+                return idle.pop(), True
+            self.opened += 1
+        scheme, host, port = key
+        cls = http.client.HTTPSConnection if scheme == "https" else http.client.HTTPConnection
+        return cls(host, port, timeout=self.timeout), False
+
+    def request(self, method, url, headers=None, body=None):
+        """
+        Sends a request on a pooled connection and returns the
+        http.client.HTTPResponse. A stale kept-alive connection is retried
+        once on a fresh one.
+        """
+        key = self._key(url)
+        parts = urlsplit(url)
+        path = (parts.path or "/") + (f"?{parts.query}" if parts.query else "")
+        while True:
+            conn, reused = self._take(key)
+            try:
+                conn.request(method, path, body=body, headers=headers or {})
+                response = conn.getresponse()
+            except STALE_ERRORS:
+                conn.close()
+                if reused:
+                    continue
+                raise
+            except Exception:
+                conn.close()
+                raise
+            response.pool_key = key
+            response.pool_conn = conn
+            return response
+
+    def release(self, response):
+        conn = response.pool_conn
+        if not response.isclosed() or response.will_close:
+            conn.close()
+            return
+        with self._lock:
+            idle = self._idle.setdefault(response.pool_key, [])
+            if len(idle) < self.max_idle_per_host:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for connections in idle.values():
+            for conn in connections:
+                conn.close()
@@ -0,0 +1,143 @@
+import re
+
+# Resource types the scraper never needs: it only reads window.__INITIAL_STATE__
+BLOCKED_RESOURCE_TYPES = {"image", "media", "font"}
+
+# Trackers / analytics / heavy media hosts, matched against the full URL
+BLOCKED_URL_PATTERNS = [
+    r"google-analytics\.com",
+    r"googletagmanager\.com",
+    r"sentry",
+    r"/apm/",
+    r"\.(png|jpe?g|gif|webp|avif|svg|ico|mp4|m3u8|ts|woff2?|ttf|otf)(\?|$)",
+]
+
+# Aborted requests are never downloaded, so their size is unknown. These
+# typical sizes give an estimate of what blocking saved.
+ESTIMATED_BYTES = {
+    "image": 80_000,
+    "media": 1_500_000,
+    "font": 40_000,
+}
+DEFAULT_ESTIMATED_BYTES = 5_000
+
+# Resolves as soon as the note state is present, or when we landed on a login page
+STATE_READY_JS = """() => {
+    if (location.href.includes('login')) return true;
+    const state = window.__INITIAL_STATE__;
+    if (!state) return false;
+    const unwrap = (v) => (v && typeof v === 'object' && '_value' in v) ? v._value : v;
+    const note = unwrap(state.note);
+    if (!note || !note.noteDetailMap) return true;
+    return Object.keys(unwrap(note.noteDetailMap) || {}).length > 0;
+}"""
+STATE_READY_TIMEOUT = 15000
+
+WAIT_NETWORKIDLE = "networkidle"
+WAIT_STATE = "state"
+WAIT_MODES = (WAIT_STATE, WAIT_NETWORKIDLE)
+
+
+class PageStats:
+    """
+    Per-page request counters. Call reset() before each note when a page is
+    reused for several notes.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.requests_allowed = 0
+        self.requests_blocked = 0
+        self.bytes_loaded = 0
+        self.bytes_saved_est = 0
+
+    def as_dict(self):
+        return {
+            "requests_allowed": self.requests_allowed,
+            "requests_blocked": self.requests_blocked,
+            "bytes_loaded": self.bytes_loaded,
+            "bytes_saved_est": self.bytes_saved_est,
+        }
+
+    def _on_response(self, response):
+        try:
+            length = response.headers.get("content-length")
+            if length:
+                self.bytes_loaded += int(length)
+        except Exception:
+            pass
+
+
+class ResourceBlocker:
+    """
+    Request interception layer for scrape pages.
+
+    Aborts requests whose resource type is in `resource_types` or whose URL
+    matches one of `url_patterns`, and counts what was allowed and blocked.
+
+        blocker = ResourceBlocker()
+        stats = blocker.install(page)          # sync API
+        stats = await blocker.install_async(page)
+    """
+
+    def __init__(self, resource_types=None, url_patterns=None, enabled=True):
+        self.resource_types = set(BLOCKED_RESOURCE_TYPES if resource_types is None else resource_types)
+        patterns = BLOCKED_URL_PATTERNS if url_patterns is None else url_patterns
+        self._pattern = re.compile("|".join(f"(?:{p})" for p in patterns)) if patterns else None
+        self.enabled = enabled
+
+    def should_block(self, resource_type, url):
+        if resource_type in self.resource_types:
+            return True
+        # Never block the document itself, whatever its URL looks like
+        if resource_type == "document":
+            return False
+        return bool(self._pattern and self._pattern.search(url))
+
+    def _record_block(self, stats, resource_type):
+        stats.requests_blocked += 1
+        stats.bytes_saved_est += ESTIMATED_BYTES.get(resource_type, DEFAULT_ESTIMATED_BYTES)
+
+    def install(self, page):
+        """
+        Installs the route handler on a sync API page. Returns its PageStats.
+        """
+        stats = PageStats()
+        page.on("response", stats._on_response)
+        if not self.enabled:
+            return stats
+
+        def handle(route):
+            request = route.request
+            if self.should_block(request.resource_type, request.url):
+                self._record_block(stats, request.resource_type)
+                route.abort()
+            else:
+                stats.requests_allowed += 1
+                route.continue_()
+
+        page.route("**/*", handle)
+        return stats
+
+    async def install_async(self, page):
+        """
+        Installs the route handler on an async API page. Returns its PageStats.
+        """
+        stats = PageStats()
+        page.on("response", stats._on_response)
+        if not self.enabled:
+            return stats
+
+        async def handle(route):
+            request = route.request
+            if self.should_block(request.resource_type, request.url):
+                self._record_block(stats, request.resource_type)
+                await route.abort()
+            else:
+                stats.requests_allowed += 1
+                await route.continue_()
+
+        await page.route("**/*", handle)
+        return stats
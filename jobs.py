@@ -0,0 +1,250 @@
+import collections
+import itertools
+import queue
+import threading
+import time
+import uuid
+from scraper import XHSScraper, ScraperEngine
+from session_health import SessionHealth, is_session_expired
+from retry_policy import RetryPolicy, classify_exception
+from metrics import metrics
+from logging_setup import get_logger
+
+logger = get_logger("jobs")
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+DEFAULT_MAX_QUEUE = 100
+DEFAULT_KEEP_FINISHED = 1000
+
+
+class QueueFull(Exception):
+    """
+    Raised by JobManager.submit when the queue has no room for the jobs.
+    """
+
+
+class Job:
+    def __init__(self, url, account_id=None, trace=False):
+        self.id = uuid.uuid4().hex[:12]
+        self.url = url
+        self.account_id = account_id
+        self.trace = trace
+        self.status = QUEUED
+        self.result = None
+        self.error = None
+        self.account_used = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self._done = threading.Event()
+        self._callbacks = []
+
+    @property
+    def finished(self):
+        return self.status in (DONE, FAILED)
+
+    def wait(self, timeout=None):
+        return self._done.wait(timeout)
+
+    def to_dict(self, include_result=True):
+        d = {
+            "id": self.id,
+            "url": self.url,
+            "status": self.status,
+            "trace": self.trace,
+            "account_used": self.account_used,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+        if include_result:
+            d["result"] = self.result
+        return d
+
+
+class JobManager:
+    """
+    Background scrape jobs for the web server.
+
+    submit() puts jobs on a bounded queue and returns immediately; when the
+    queue is full it raises QueueFull so the caller can answer 429.
+    Each worker thread owns its own ScraperEngine (the sync Playwright API
+    is thread-bound) and leases an account from the scheduler per job, so
+    a worker waits rather than exceed an account's limits. A job that hits
+    an expired session disables the account through `health` and moves on
+    to the next account, unless it asked for that account specifically.
+    Other failures are retried in place as `policy` (RetryPolicy) allows.
+    """
+
+    def __init__(self, scheduler, workers=1, max_queue=DEFAULT_MAX_QUEUE,
+                 keep_finished=DEFAULT_KEEP_FINISHED, scraper_options=None, engine_options=None, health=None,
+                 policy=None):
+        self.scheduler = scheduler
+        self.health = health or SessionHealth(scheduler.manager)
+        self.policy = policy or RetryPolicy()
+        self.workers = workers
+        self.max_queue = max_queue
+        self.keep_finished = keep_finished
+        self.scraper_options = scraper_options or {}
+        self.engine_options = engine_options or {}
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._jobs = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._threads = []
+        self._names = itertools.count(1)
+
+    def start(self):
+        with self._lock:
+            if self._threads:
+                return self
+            for _ in range(self.workers):
+                thread = threading.Thread(target=self._work, name=f"scrape-job-{next(self._names)}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+        return self
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        for _ in self._threads:
+            try:
+                self._queue.put_nowait(None)
+            except queue.Full:
+                pass
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+        self.scheduler.flush()
+
+    @property
+    def depth(self):
+        return self._queue.qsize()
+
+    def submit(self, urls, account_id=None, trace=False):
+        """
+        Enqueues one job per URL, all or none. With `trace`, each scrape is
+        recorded as a Playwright trace (result["trace"]). Returns the jobs.
+        """
+        with self._lock:
+            if self._queue.qsize() + len(urls) > self.max_queue:
+                raise QueueFull(f"Job queue full ({self._queue.qsize()}/{self.max_queue})")
+            jobs = [Job(url, account_id, trace) for url in urls]
+            for job in jobs:
+                self._jobs[job.id] = job
+                self._queue.put_nowait(job)
+            self._prune()
+        self.start()
+        return jobs
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def add_done_callback(self, job, callback):
+        """
+        Calls `callback(job)` once the job has finished (right away if it
+        already has). Runs on the worker thread.
+        """
+        with self._lock:
+            if not job.finished:
+                job._callbacks.append(callback)
+                return
+        callback(job)
+
+    def _prune(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.finished]
+        for job_id in finished[:max(len(finished) - self.keep_finished, 0)]:
+            del self._jobs[job_id]
+
+    def _finish(self, job, status, result=None, error=None):
+        with self._lock:
+            job.status = status
+            job.result = result
+            job.error = error
+            job.finished_at = time.time()
+            callbacks, job._callbacks = job._callbacks, []
+        job._done.set()
+        for callback in callbacks:
+            try:
+                callback(job)
+            except Exception as e:
+                logger.warning("Callback failed for %s: %s", job.id, e, extra={"job": job.id})
+
+    def _work(self):
+        engine = ScraperEngine(**self.engine_options)
+        scraper = XHSScraper(engine=engine, timeouts=self.policy.timeouts, **self.scraper_options)
+        try:
+            engine.warm(self.scheduler.usable_accounts())
+            while not self._stop.is_set():
+                job = self._queue.get()
+                if job is None:
+                    break
+                try:
+                    self._run(scraper, job)
+                except Exception as e:
+                    # One bad job must not take the worker and the queue behind it down
+                    logger.exception("Job %s crashed: %s", job.id, e, extra={"job": job.id, "url": job.url})
+                    if not job.finished:
+                        self._finish(job, FAILED, error=str(e))
+        finally:
+            engine.stop()
+
+    def _run(self, scraper, job):
+        job.status = RUNNING
+        job.started_at = time.time()
+
+        attempts = 0
+        while True:
+            result = self._attempt(scraper, job)
+            if result is None:
+                return
+            if result["success"]:
+                break
+            if is_session_expired(result):
+                if job.account_id:
+                    break
+                continue
+            attempts += 1
+            delay = self.policy.retry_delay(result.get("error_class"), attempts)
+            if delay is None or self._stop.wait(delay):
+                break
+
+        if result["success"]:
+            self._finish(job, DONE, result=result)
+        else:
+            self._finish(job, FAILED, result=result, error=result.get("error"))
+
+    def _attempt(self, scraper, job):
+        """
+        Scrapes the job on one leased account. Returns the result, or None
+        when the job was finished without one.
+        """
+        account_ids = {job.account_id} if job.account_id else None
+        wait = self.policy.host_wait(job.url)
+        if wait:
+            self._stop.wait(wait)
+        lease = self.scheduler.acquire_blocking(stop=self._stop, account_ids=account_ids)
+        if lease is None:
+            self._finish(job, FAILED, error="Shutting down" if self._stop.is_set() else "No usable account")
+            return
+
+        account = lease.account
+        job.account_used = account['nickname']
+        try:
+            result = scraper.scrape_note(job.url, account['state_file'], account['user_agent'], trace=job.trace)
+        except Exception as e:
+            result = {"success": False, "data": {}, "error": str(e), "error_class": classify_exception(e)}
+        finally:
+            self.scheduler.release(lease)
+        self.policy.record(result, account, job.url)
+        metrics.record_outcome(result, account)
+
+        result["account_used"] = account['nickname']
+        if is_session_expired(result):
+            self.health.mark_expired(account)
+        return result
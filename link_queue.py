@@ -0,0 +1,381 @@
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+from results_sink import open_results
+from note_index import canonical_key
+
+DATA_DIR = "data"
+QUEUE_FILE = os.path.join(DATA_DIR, "queue.db")
+
+PENDING = "pending"
+IN_FLIGHT = "in_flight"
+DONE = "done"
+FAILED = "failed"
+
+DEFAULT_MAX_ATTEMPTS = 3
+INGEST_BATCH = 5000
+# Seconds a connection waits for another process's write lock (--processes)
+BUSY_TIMEOUT = 30.0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS links (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    key TEXT NOT NULL UNIQUE,
+    url TEXT NOT NULL,
+    state TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT,
+    error_class TEXT,
+    not_before REAL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS links_state ON links (state, attempts, id);
+CREATE TABLE IF NOT EXISTS meta (
+    name TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+def link_key(url):
+    """
+    Dedup key for a link: share links that differ only in xsec_token or
+    query string collapse onto the same note.
+    """
+    return canonical_key(url)
+
+
+class LinkQueue:
+    """
+    Durable, resumable link queue backed by SQLite.
+
+    Each URL has a state (pending / in_flight / done / failed), an attempt
+    count and the last error. Link files are ingested as a stream and the
+    read offset is checkpointed, so re-ingesting an append-only file on
+    restart only reads the new tail.
+
+        queue = LinkQueue()
+        queue.recover()
+        queue.ingest("links.txt")
+        queue.skip_scraped("data/results.jsonl")
+        while (job := queue.claim()):
+            ...
+            queue.mark_done(job["id"])
+    """
+
+    def __init__(self, path=QUEUE_FILE, max_attempts=DEFAULT_MAX_ATTEMPTS):
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self.path = path
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        self._migrate()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def _migrate(self):
+        # Queues created before retry scheduling lack these columns
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(links)")}
+        for column, kind in (("error_class", "TEXT"), ("not_before", "REAL")):
+            if column not in columns:
+                self._conn.execute(f"ALTER TABLE links ADD COLUMN {column} {kind}")
+
+    def _get_meta(self, name):
+        row = self._conn.execute("SELECT value FROM meta WHERE name = ?", (name,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _set_meta(self, name, value):
+        self._conn.execute(
+            "INSERT OR REPLACE INTO meta (name, value) VALUES (?, ?)",
+            (name, json.dumps(value))
+        )
+
+    def _checkpoint(self, name, path, compressed=False):
+        """
+        Returns the byte offset to resume reading `path` from. Starts over
+        when the file was truncated or replaced. Offsets into compressed
+        files count uncompressed bytes, so only the inode is compared.
+        """
+        saved = self._get_meta(name)
+        if not saved:
+            return 0
+        stat = os.stat(path)
+        if stat.st_ino != saved.get("inode", stat.st_ino):
+            return 0
+        if not compressed and stat.st_size < saved["offset"]:
+            return 0
+        return saved["offset"]
+
+    def ingest(self, links_file, batch_size=INGEST_BATCH):
+        """
+        Streams URLs from a link file into the queue, one batch at a time.
+        Returns the number of new URLs added.
+        """
+        name = f"ingest:{os.path.abspath(links_file)}"
+        now = time.time()
+        added = 0
+
+        with open(links_file, "rb") as f:
+            offset = self._checkpoint(name, links_file)
+            f.seek(offset)
+            batch = []
+            for line in f:
+                url = line.decode("utf-8", errors="replace").strip()
+                if url and not url.startswith("#"):
+                    batch.append((link_key(url), url, now))
+                # A last line without newline may still be being written:
+                # take it, but read it again next time
+                if line.endswith(b"\n"):
+                    offset += len(line)
+                if len(batch) >= batch_size:
+                    added += self._insert(batch)
+                    batch = []
+            if batch:
+                added += self._insert(batch)
+
+        with self._lock:
+            self._set_meta(name, {"offset": offset, "inode": os.stat(links_file).st_ino})
+        return added
+
+    def _insert(self, rows):
+        with self._lock:
+            before = self._conn.total_changes
+            self._conn.execute("BEGIN")
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO links (key, url, updated_at) VALUES (?, ?, ?)",
+                rows
+            )
+            self._conn.execute("COMMIT")
+            return self._conn.total_changes - before
+
+    def add(self, url):
+        """
+        Enqueues a single URL. Returns False if it was already known.
+        """
+        return self._insert([(link_key(url), url.strip(), time.time())]) > 0
+
+    def enqueue_refresh(self, urls):
+        """
+        Queues notes for a re-scrape: done links go back to pending with
+        fresh attempts, unknown ones are added, pending / in-flight / failed
+        ones are left alone. Returns the number of links queued.
+        """
+        now = time.time()
+        rows = [(link_key(url), url.strip(), now) for url in urls]
+        with self._lock:
+            before = self._conn.total_changes
+            self._conn.execute("BEGIN")
+            self._conn.executemany("INSERT OR IGNORE INTO links (key, url, updated_at) VALUES (?, ?, ?)", rows)
+            self._conn.executemany(
+                "UPDATE links SET state = ?, attempts = 0, last_error = NULL, error_class = NULL, "
+                "not_before = NULL, updated_at = ? WHERE key = ? AND state = ?",
+                [(PENDING, now, key, DONE) for key, _, _ in rows]
+            )
+            self._conn.execute("COMMIT")
+            return self._conn.total_changes - before
+
+    def skip_scraped(self, results_file):
+        """
+        Marks every URL already present in the results file as done. Only
+        the part of the file appended since the last call is scanned.
+        Returns the number of queue entries that were marked done.
+        """
+        if not os.path.exists(results_file):
+            return 0
+
+        name = f"results:{os.path.abspath(results_file)}"
+        stat = os.stat(results_file)
+        saved = self._get_meta(name)
+        if saved and saved.get("size") == stat.st_size and saved.get("inode") == stat.st_ino:
+            return 0
+
+        compressed = results_file.endswith((".gz", ".zst"))
+        decoder = json.JSONDecoder()
+        marker = b'"_scraped_url"'
+        keys = []
+        marked = 0
+
+        with open_results(results_file) as f:
+            offset = self._checkpoint(name, results_file, compressed)
+            f.seek(offset)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                offset += len(line)
+                # The URL is injected near the end, so search backwards instead of parsing the whole record
+                pos = line.rfind(marker)
+                if pos < 0:
+                    continue
+                try:
+                    text = line[pos + len(marker):].decode("utf-8").lstrip(" :")
+                    url, _ = decoder.raw_decode(text)
+                except ValueError:
+                    continue
+                if isinstance(url, str):
+                    keys.append((time.time(), link_key(url)))
+                if len(keys) >= INGEST_BATCH:
+                    marked += self._mark_keys_done(keys)
+                    keys = []
+
+        if keys:
+            marked += self._mark_keys_done(keys)
+        with self._lock:
+            self._set_meta(name, {"offset": offset, "inode": stat.st_ino, "size": stat.st_size})
+        return marked
+
+    def _mark_keys_done(self, rows):
+        with self._lock:
+            before = self._conn.total_changes
+            self._conn.execute("BEGIN")
+            self._conn.executemany(
+                f"UPDATE links SET state = '{DONE}', updated_at = ? WHERE key = ? AND state != '{DONE}'",
+                rows
+            )
+            self._conn.execute("COMMIT")
+            return self._conn.total_changes - before
+
+    def sync_with_index(self, index_path, ttl=None):
+        """
+        Reconciles the queue with the note index (see note_index.py):
+        pending notes the index already holds a fresh scrape of are marked
+        done, and with a `ttl` (seconds) done notes whose last scrape is
+        older than that go back to pending for a refresh.
+        Returns (skipped, refreshed).
+        """
+        if not os.path.exists(index_path):
+            return 0, 0
+        now = time.time()
+        cutoff = now - ttl if ttl else 0
+        match = "EXISTS (SELECT 1 FROM idx.notes n WHERE n.note_id = substr(links.key, 6) AND n.scraped_at {} ?)"
+
+        with self._lock:
+            self._conn.execute("ATTACH DATABASE ? AS idx", (index_path,))
+            try:
+                refreshed = 0
+                if ttl:
+                    refreshed = self._conn.execute(
+                        f"UPDATE links SET state = ?, attempts = 0, updated_at = ? "
+                        f"WHERE state = ? AND key LIKE 'note:%' AND {match.format('<')}",
+                        (PENDING, now, DONE, cutoff)
+                    ).rowcount
+                skipped = self._conn.execute(
+                    f"UPDATE links SET state = ?, updated_at = ? "
+                    f"WHERE state = ? AND key LIKE 'note:%' AND {match.format('>=')}",
+                    (DONE, now, PENDING, cutoff)
+                ).rowcount
+            finally:
+                self._conn.execute("DETACH DATABASE idx")
+        return skipped, refreshed
+
+    def recover(self):
+        """
+        Puts links left in flight by a crashed run back to pending.
+        """
+        with self._lock:
+            cur = self._conn.execute(
+                "UPDATE links SET state = ?, updated_at = ? WHERE state = ?",
+                (PENDING, time.time(), IN_FLIGHT)
+            )
+            return cur.rowcount
+
+    def retry_failed(self):
+        """
+        Gives failed links a fresh set of attempts.
+        """
+        with self._lock:
+            cur = self._conn.execute(
+                "UPDATE links SET state = ?, attempts = 0, not_before = NULL, updated_at = ? WHERE state = ?",
+                (PENDING, time.time(), FAILED)
+            )
+            return cur.rowcount
+
+    def claim(self):
+        """
+        Takes the next pending link (fewest attempts first, then oldest)
+        whose retry backoff has passed, and marks it in flight.
+        Returns {"id", "url", "attempts"} or None when nothing is ready;
+        next_retry_at() tells whether backed-off links remain.
+        """
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            row = self._conn.execute(
+                "SELECT id, url, attempts FROM links WHERE state = ? AND (not_before IS NULL OR not_before <= ?) "
+                "ORDER BY attempts, id LIMIT 1",
+                (PENDING, time.time())
+            ).fetchone()
+            if row is None:
+                self._conn.execute("COMMIT")
+                return None
+            self._conn.execute(
+                "UPDATE links SET state = ?, attempts = attempts + 1, updated_at = ? WHERE id = ?",
+                (IN_FLIGHT, time.time(), row[0])
+            )
+            self._conn.execute("COMMIT")
+            return {"id": row[0], "url": row[1], "attempts": row[2] + 1}
+
+    async def claim_async(self):
+        """
+        claim() in a thread: the write lock may be held by another process.
+        """
+        return await asyncio.to_thread(self.claim)
+
+    def mark_done(self, job_id):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE links SET state = ?, last_error = NULL, error_class = NULL, not_before = NULL, "
+                "updated_at = ? WHERE id = ?",
+                (DONE, time.time(), job_id)
+            )
+
+    def mark_failed(self, job_id, error, error_class=None, retry_at=None, final=False):
+        """
+        Records a failed attempt. The link goes back to pending, not to be
+        claimed before `retry_at`, until it has used up `max_attempts` or
+        the retry policy gives up on it (`final`); then it stays failed.
+        """
+        with self._lock:
+            self._conn.execute(
+                "UPDATE links SET state = CASE WHEN ? OR attempts >= ? THEN ? ELSE ? END, "
+                "last_error = ?, error_class = ?, not_before = ?, updated_at = ? WHERE id = ?",
+                (bool(final), self.max_attempts, FAILED, PENDING, str(error), error_class, retry_at,
+                 time.time(), job_id)
+            )
+
+    def next_retry_at(self):
+        """
+        Earliest time a backed-off pending link becomes claimable, or None.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT MIN(not_before) FROM links WHERE state = ? AND not_before > ?",
+                (PENDING, time.time())
+            ).fetchone()
+        return row[0]
+
+    def requeue(self, job_id):
+        """
+        Returns an in-flight link to pending without counting the attempt,
+        e.g. when the account failed rather than the link.
+        """
+        with self._lock:
+            self._conn.execute(
+                "UPDATE links SET state = ?, attempts = MAX(attempts - 1, 0), updated_at = ? WHERE id = ?",
+                (PENDING, time.time(), job_id)
+            )
+
+    def counts(self):
+        with self._lock:
+            rows = self._conn.execute("SELECT state, COUNT(*) FROM links GROUP BY state").fetchall()
+        counts = {PENDING: 0, IN_FLIGHT: 0, DONE: 0, FAILED: 0}
+        counts.update(dict(rows))
+        return counts
@@ -0,0 +1,208 @@
+"""
+Shared logging for the CLI and the web server.
+
+Library modules log through standard loggers under "xhs" (xhs.engine,
+xhs.scraper, xhs.main, ...). setup_logging() routes them through a
+QueueHandler, so callers never wait on disk or the terminal; a
+QueueListener thread writes:
+
+- JSON lines to a size-rotated file, with the structured fields passed
+  as `extra` (job, account, url, worker, error_class, session)
+- short human-readable lines to the console
+
+RingBuffer handlers keep the last N records in memory for the web UI.
+Worker processes send their records to the parent with log_to_queue();
+the parent passes them on with relay_logs().
+Payloads (scraped data, raw state) are only ever logged at DEBUG.
+"""
+import atexit
+import collections
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import time
+
+ROOT_LOGGER = "xhs"
+LOG_FILE = os.path.join("data", "scraper.log")
+
+DEFAULT_MAX_BYTES = 10 * 1024 * 1024
+DEFAULT_BACKUPS = 5
+DEFAULT_RING_SIZE = 500
+
+# Structured fields copied from `extra` into each JSON record
+FIELDS = ("job", "account", "url", "worker", "error_class", "session")
+
+_listener = None
+_queue_handler = None
+_lock = threading.Lock()
+
+
+def get_logger(name):
+    return logging.getLogger(f"{ROOT_LOGGER}.{name}")
+
+
+def _fields(record):
+    return {field: getattr(record, field) for field in FIELDS if getattr(record, field, None) is not None}
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        entry.update(_fields(record))
+        if record.processName != "MainProcess":
+            entry["process"] = record.processName
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class ConsoleFormatter(logging.Formatter):
+    """
+    "[2024-01-01 12:00:00] [engine] message" -- the logger name without the
+    xhs prefix takes the place of the old [Engine]/[Scraper] tags.
+    """
+
+    def format(self, record):
+        timestamp = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(record.created))
+        area = record.name.split(".", 1)[-1] if record.name != ROOT_LOGGER else "xhs"
+        if record.processName != "MainProcess":
+            area += f"/{record.processName}"
+        level = f" {record.levelname}" if record.levelno >= logging.WARNING else ""
+        line = f"[{timestamp}]{level} [{area}] {record.getMessage()}"
+        if record.exc_info:
+            line += "\n" + self.formatException(record.exc_info)
+        return line
+
+
+class RingBuffer(logging.Handler):
+    """
+    Keeps the last `capacity` records in memory, for the web UI.
+    """
+
+    def __init__(self, capacity=DEFAULT_RING_SIZE, level=logging.INFO):
+        super().__init__(level)
+        self._records = collections.deque(maxlen=capacity)
+
+    def emit(self, record):
+        entry = {"ts": record.created, "level": record.levelname, "logger": record.name,
+                 "msg": record.getMessage()}
+        entry.update(_fields(record))
+        self._records.append(entry)
+
+    def clear(self):
+        self._records.clear()
+
+    def records(self, limit=None):
+        records = list(self._records)
+        return records[-limit:] if limit else records
+
+    def lines(self, limit=None):
+        """
+        "HH:MM:SS - message" strings, oldest first.
+        """
+        return [f"{time.strftime('%H:%M:%S', time.localtime(r['ts']))} - {r['msg']}" for r in self.records(limit)]
+
+
+def attach_ring_buffer(logger_name=ROOT_LOGGER, capacity=DEFAULT_RING_SIZE, level=logging.INFO):
+    """
+    Adds a RingBuffer to a logger (under "xhs" unless fully qualified) and
+    returns it.
+    """
+    buffer = RingBuffer(capacity, level)
+    logging.getLogger(logger_name).addHandler(buffer)
+    return buffer
+
+
+def setup_logging(log_file=LOG_FILE, level=logging.INFO, console=None, max_bytes=DEFAULT_MAX_BYTES,
+                  backups=DEFAULT_BACKUPS):
+    """
+    Installs the queue-based handlers on the "xhs" logger. Idempotent;
+    the first call wins. `console` is the stream for human-readable lines
+    (stdout by default, False for none); `log_file` None disables the file.
+    """
+    global _listener, _queue_handler
+    with _lock:
+        if _listener is not None:
+            return
+        handlers = []
+        if log_file:
+            directory = os.path.dirname(log_file)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory, exist_ok=True)
+            file_handler = logging.handlers.RotatingFileHandler(
+                log_file, maxBytes=max_bytes, backupCount=backups, encoding="utf-8", delay=True)
+            file_handler.setFormatter(JsonFormatter())
+            handlers.append(file_handler)
+        if console is not False:
+            console_handler = logging.StreamHandler(console or sys.stdout)
+            console_handler.setFormatter(ConsoleFormatter())
+            handlers.append(console_handler)
+
+        records = queue.SimpleQueue()
+        root = logging.getLogger(ROOT_LOGGER)
+        root.setLevel(level)
+        _queue_handler = logging.handlers.QueueHandler(records)
+        root.addHandler(_queue_handler)
+        root.propagate = False
+
+        _listener = logging.handlers.QueueListener(records, *handlers, respect_handler_level=True)
+        _listener.start()
+        atexit.register(shutdown_logging)
+
+
+def shutdown_logging():
+    """
+    Flushes queued records and stops the writer thread.
+    """
+    global _listener, _queue_handler
+    with _lock:
+        if _listener is None:
+            return
+        logging.getLogger(ROOT_LOGGER).removeHandler(_queue_handler)
+        _queue_handler = None
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+
+
+class _Relay(logging.Handler):
+    def emit(self, record):
+        logging.getLogger(record.name).handle(record)
+
+
+def log_to_queue(records, level=logging.INFO):
+    """
+    For a child process: sends its "xhs" records to `records` (a
+    multiprocessing queue) instead of writing them itself.
+    """
+    global _listener, _queue_handler
+    with _lock:
+        root = logging.getLogger(ROOT_LOGGER)
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        _listener = None
+        _queue_handler = None
+        root.setLevel(level)
+        root.addHandler(logging.handlers.QueueHandler(records))
+        root.propagate = False
+
+
+def relay_logs(records):
+    """
+    For the parent: hands records that child processes put on `records` to
+    the local "xhs" handlers. Returns the running QueueListener; stop() it
+    once the children have exited.
+    """
+    listener = logging.handlers.QueueListener(records, _Relay())
+    listener.start()
+    return listener
@@ -1,24 +1,71 @@
-import time
+import asyncio
 import os
-import json
-from playwright.sync_api import sync_playwright
+import time
+from playwright.async_api import async_playwright
+from scraper import BROWSER_ARGS, STEALTH_SCRIPT
+from session_health import ME_URL, is_logged_in
+from logging_setup import get_logger
+
+logger = get_logger("login")
+
+XHS_URL = "https://www.xiaohongshu.com"
+STATE_DIR = os.path.join("data", "accounts_state")
+
+# The login page polls this endpoint; its code_status tells how far the scan got
+QR_STATUS_PATH = "login/qrcode/status"
+QR_SCANNED = 1
+QR_CONFIRMED = 2
+
+# States reported to state_callback
+SCANNED = "scanned"
+PROCESSING = "processing"
+
+LOGIN_TIMEOUT = 120
+# Backup user/me check, in case the confirming status response is missed
+ME_CHECK_INTERVAL = 15
+QR_WAIT_TIMEOUT = 15000
+
+TIMEOUT_ERROR = "Timeout waiting for scan"
+
 
 class LoginHandler:
-    def __init__(self, headless=True):
+    def __init__(self, headless=True, timeout=LOGIN_TIMEOUT):
         self.headless = headless
+        self.timeout = timeout
 
-    def login(self, user_agent, qr_callback=None, status_callback=None):
+    def login(self, user_agent, qr_callback=None, status_callback=None, state_callback=None):
         """
-        Executes the login flow.
-        
+        Executes the login flow in a browser of its own (CLI use).
+
         Args:
             user_agent (str): The UA to use.
-            qr_callback (func): Called when QR code is ready. Args: (page_object) -> str (path to saved image)
-            status_callback (func): Called with status updates. Args: (msg)
-        
+            qr_callback (func): Called when the QR code is ready. Args: (png_bytes)
+            status_callback (func): Called with status messages. Args: (msg)
+            state_callback (func): Called when the scan progresses. Args: (SCANNED or PROCESSING)
+
         Returns:
             dict: {success: bool, user_id: str, nickname: str, state_path: str, error: str}
         """
+        return asyncio.run(self._login_own_browser(user_agent, qr_callback, status_callback, state_callback))
+
+    async def _login_own_browser(self, user_agent, qr_callback, status_callback, state_callback):
+        async with async_playwright() as p:
+            browser = await p.chromium.launch(headless=self.headless, args=BROWSER_ARGS)
+            try:
+                return await self.login_async(browser, user_agent, qr_callback, status_callback, state_callback)
+            finally:
+                await browser.close()
+
+    async def login_async(self, browser, user_agent, qr_callback=None, status_callback=None, state_callback=None):
+        """
+        Executes the login flow in a new context of `browser` (async
+        Playwright), so several logins can share one browser. Same callbacks
+        and result as login().
+
+        Completion is detected from the login/qrcode/status responses the
+        page itself polls for; user/me is only asked every
+        ME_CHECK_INTERVAL seconds as a backup.
+        """
         result = {
             "success": False,
             "user_id": None,
@@ -26,121 +73,119 @@ class LoginHandler:
             "state_path": None,
             "error": None
         }
+        log = status_callback or logger.info
+        loop = asyncio.get_running_loop()
+        confirmed = loop.create_future()
+        last_status = {"code": None}
 
-        def log(msg):
-            if status_callback:
-                status_callback(msg)
-            else:
-                print(f"[LoginHandler] {msg}")
+        async def on_response(response):
+            if QR_STATUS_PATH not in response.url:
+                return
+            try:
+                data = await response.json()
+            except Exception:
+                return
+            if data.get("code") != 0:
+                return
+            code = (data.get("data") or {}).get("code_status")
+            if code == last_status["code"]:
+                return
+            last_status["code"] = code
+            if code == QR_SCANNED:
+                log("QR code scanned, waiting for confirmation on the phone...")
+                if state_callback:
+                    state_callback(SCANNED)
+            elif code == QR_CONFIRMED and not confirmed.done():
+                confirmed.set_result(True)
 
+        context = await browser.new_context(user_agent=user_agent)
         try:
-            with sync_playwright() as p:
-                browser = p.chromium.launch(
-                    headless=self.headless,
-                    args=['--no-sandbox', '--disable-blink-features=AutomationControlled']
-                )
-                context = browser.new_context(user_agent=user_agent)
-                context.add_init_script("Object.defineProperty(navigator, 'webdriver', {get: () => undefined})")
-                
-                page = context.new_page()
-                
-                log("Opening Xiaohongshu...")
-                page.goto("https://www.xiaohongshu.com")
-                log("Page loaded.")
-                
-                # Setup network interception for QR status
-                qr_status = {"code": -1}
-                def handle_response(response):
-                    if "login/qrcode/status" in response.url:
-                        try:
-                            res = response.json()
-                            if res.get("code") == 0:
-                                qr_status["code"] = res.get("data", {}).get("code_status", -1)
-                        except:
-                            pass
-                page.on("response", handle_response)
-                
-                # Click login button
-                try:
-                    page.wait_for_load_state("networkidle")
-                    login_btn = page.get_by_text("登录", exact=True)
-                    if login_btn.count() > 0 and login_btn.is_visible():
-                        login_btn.click()
-                        time.sleep(1)
-                except:
-                    pass
-                
-                log("Waiting for QR code...")
-                try:
-                    qr_img = page.locator("img[src*='qr']").first
-                    qr_img.wait_for(state="visible", timeout=15000)
-                except:
-                    log("QR code element detection timed out, falling back to full page.")
-
-                # Callback to handle QR code (e.g., screenshot)
-                if qr_callback:
-                    qr_path = qr_callback(page)
-                    log(f"QR Code captured at: {qr_path}")
-                
-                log("Waiting for scan...")
-                
-                # Polling loop
-                start_time = time.time()
-                success = False
-                
-                while time.time() - start_time < 120:
-                    if qr_status["code"] == 2:
-                        success = True
-                        break
-                    
-                    # Double check via API
-                    if int(time.time()) % 5 == 0:
-                        try:
-                            me_res = page.request.get("https://edith.xiaohongshu.com/api/sns/web/v2/user/me")
-                            me_data = me_res.json()
-                            if me_data.get("code") == 0 and me_data.get("data", {}).get("user_id") and not me_data.get("data", {}).get("guest", True):
-                                success = True
-                                break
-                        except:
-                            pass
-                    
-                    time.sleep(1)
-                
-                if success:
-                    log("Login successful! Fetching user info...")
-                    
-                    # Get user info
-                    try:
-                        me_res = page.request.get("https://edith.xiaohongshu.com/api/sns/web/v2/user/me")
-                        me_data = me_res.json()
-                        user_data = me_data.get("data", {})
-                        user_id = user_data.get("user_id", f"user_{int(time.time())}")
-                        nickname = user_data.get("nickname", "Unknown")
-                    except:
-                        user_id = f"user_{int(time.time())}"
-                        nickname = "Unknown"
-                    
-                    # Save state
-                    if not os.path.exists(os.path.join("data", "accounts_state")):
-                         os.makedirs(os.path.join("data", "accounts_state"), exist_ok=True)
-                         
-                    state_filename = f"{user_id}_state.json"
-                    state_path = os.path.join("data", "accounts_state", state_filename)
-                    context.storage_state(path=state_path)
-                    
-                    result["success"] = True
-                    result["user_id"] = user_id
-                    result["nickname"] = nickname
-                    result["state_path"] = state_path
-                    
-                else:
-                    result["error"] = "Timeout waiting for scan"
-                    log("Login timed out.")
-
-                browser.close()
-                
+            await context.add_init_script(STEALTH_SCRIPT)
+            page = await context.new_page()
+            page.on("response", on_response)
+
+            log("Opening Xiaohongshu...")
+            await page.goto(XHS_URL)
+            log("Page loaded.")
+
+            # Click login button
+            try:
+                await page.wait_for_load_state("networkidle")
+                login_btn = page.get_by_text("登录", exact=True)
+                if await login_btn.count() > 0 and await login_btn.is_visible():
+                    await login_btn.click()
+            except Exception:
+                pass
+
+            log("Waiting for QR code...")
+            png = await self._capture_qr(page, log)
+            if qr_callback:
+                qr_callback(png)
+
+            log("Waiting for scan...")
+            if await self._wait_for_login(page, confirmed):
+                log("Login successful! Fetching user info...")
+                if state_callback:
+                    state_callback(PROCESSING)
+                result.update(await self._save_session(page, context))
+                result["success"] = True
+            else:
+                result["error"] = TIMEOUT_ERROR
+                log("Login timed out.")
+
         except Exception as e:
             result["error"] = str(e)
             log(f"Error: {e}")
+        finally:
+            await context.close()
 
         return result
+
+    async def _capture_qr(self, page, log):
+        """
+        PNG of the QR code: the QR image, else the login dialog, else the page.
+        """
+        qr_img = page.locator("img[src*='qr']").first
+        try:
+            await qr_img.wait_for(state="visible", timeout=QR_WAIT_TIMEOUT)
+            return await qr_img.screenshot()
+        except Exception:
+            log("QR code element detection timed out, falling back to the login dialog.")
+        try:
+            return await page.locator(".login-container").first.screenshot(timeout=5000)
+        except Exception:
+            log("Login dialog not found, using a full page screenshot.")
+            return await page.screenshot()
+
+    async def _wait_for_login(self, page, confirmed):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.timeout
+        while loop.time() < deadline:
+            try:
+                await asyncio.wait_for(asyncio.shield(confirmed),
+                                       min(ME_CHECK_INTERVAL, deadline - loop.time()))
+                return True
+            except asyncio.TimeoutError:
+                pass
+            try:
+                response = await page.request.get(ME_URL)
+                if is_logged_in(await response.json()):
+                    return True
+            except Exception:
+                pass
+        return False
+
+    async def _save_session(self, page, context):
+        try:
+            response = await page.request.get(ME_URL)
+            user_data = (await response.json()).get("data", {})
+            user_id = user_data.get("user_id", f"user_{int(time.time())}")
+            nickname = user_data.get("nickname", "Unknown")
+        except Exception:
+            user_id = f"user_{int(time.time())}"
+            nickname = "Unknown"
+
+        os.makedirs(STATE_DIR, exist_ok=True)
+        state_path = os.path.join(STATE_DIR, f"{user_id}_state.json")
+        await context.storage_state(path=state_path)
+        return {"user_id": user_id, "nickname": nickname, "state_path": state_path}
@@ -0,0 +1,249 @@
+"""
+Concurrent QR login sessions for the web UI.
+
+Every session gets an ID and runs LoginHandler.login_async() in its own
+context of one shared Chromium, driven by a background asyncio loop.
+The QR code stays in memory and is dropped when the session ends;
+finished sessions are forgotten after KEEP_FINISHED seconds. Changes are
+pushed to waiters (see LoginSession.events()) instead of being polled.
+
+    sessions = LoginSessions(manager)
+    session = sessions.start()
+    for snapshot in session.events():
+        ...
+"""
+import asyncio
+import collections
+import threading
+import time
+import uuid
+from playwright.async_api import async_playwright
+from scraper import BROWSER_ARGS
+from login_handler import LoginHandler, PROCESSING, SCANNED, TIMEOUT_ERROR
+from logging_setup import get_logger
+
+logger = get_logger("login")
+
+INITIALIZING = "initializing"
+WAITING_SCAN = "waiting_scan"
+SUCCESS = "success"
+FAILED = "failed"
+TIMEOUT = "timeout"
+CANCELLED = "cancelled"
+FINISHED = (SUCCESS, FAILED, TIMEOUT, CANCELLED)
+STATUSES = (INITIALIZING, WAITING_SCAN, SCANNED, PROCESSING) + FINISHED
+
+DEFAULT_MAX_SESSIONS = 4
+KEEP_FINISHED = 300
+LOG_LINES = 200
+# Seconds between SSE keep-alives while nothing changes
+HEARTBEAT = 15
+
+
+class TooManySessions(Exception):
+    """
+    Raised by LoginSessions.start when the maximum number of sessions is running.
+    """
+
+
+class LoginSession:
+    """
+    State of one QR login. Every change bumps `version` and wakes up the
+    threads waiting in wait() / events().
+    """
+
+    def __init__(self, user_agent):
+        self.id = uuid.uuid4().hex
+        self.user_agent = user_agent
+        self.status = INITIALIZING
+        self.message = ""
+        self.created_at = time.time()
+        self.finished_at = None
+        self.qr_png = None
+        self.qr_version = 0
+        self.logs = collections.deque(maxlen=LOG_LINES)
+        self.version = 0
+        self.task = None
+        self._changed = threading.Condition()
+
+    @property
+    def done(self):
+        return self.status in FINISHED
+
+    def _update(self, **changes):
+        with self._changed:
+            for name, value in changes.items():
+                setattr(self, name, value)
+            self.version += 1
+            self._changed.notify_all()
+
+    def log(self, msg):
+        logger.info(msg, extra={"session": self.id})
+        with self._changed:
+            self.logs.append(f"{time.strftime('%H:%M:%S')} - {msg}")
+            self.version += 1
+            self._changed.notify_all()
+
+    def set_qr(self, png):
+        self._update(qr_png=png, qr_version=self.qr_version + 1, status=WAITING_SCAN)
+
+    def set_state(self, state):
+        self._update(status=state)
+
+    def finish(self, status, message=""):
+        # The QR code is useless from here on
+        self._update(status=status, message=message, finished_at=time.time(), qr_png=None)
+
+    def to_dict(self):
+        with self._changed:
+            return {
+                "id": self.id,
+                "status": self.status,
+                "message": self.message,
+                "created_at": self.created_at,
+                "finished_at": self.finished_at,
+                "qr_url": f"/api/login/sessions/{self.id}/qr.png?v={self.qr_version}" if self.qr_png else None,
+                "logs": list(self.logs),
+                "version": self.version,
+            }
+
+    def wait(self, version, timeout=None):
+        """
+        Blocks until `version` is outdated or `timeout` passes. Returns the
+        current version.
+        """
+        with self._changed:
+            self._changed.wait_for(lambda: self.version != version, timeout)
+            return self.version
+
+    def events(self, heartbeat=HEARTBEAT):
+        """
+        Yields a snapshot (to_dict()) now and after every change, or None
+        when `heartbeat` seconds pass without one. Ends after the final
+        snapshot of a finished session.
+        """
+        version = None
+        while True:
+            current = self.wait(version, heartbeat)
+            if current == version:
+                yield None
+                continue
+            version = current
+            snapshot = self.to_dict()
+            yield snapshot
+            if snapshot["status"] in FINISHED:
+                return
+
+
+class LoginSessions:
+    """
+    Runs up to `max_sessions` logins at once on one shared browser and
+    registers every successful one with the AccountManager. The browser is
+    launched for the first session and closed once none is running.
+    """
+
+    def __init__(self, manager, headless=True, max_sessions=DEFAULT_MAX_SESSIONS, keep_finished=KEEP_FINISHED,
+                 handler=None):
+        self.manager = manager
+        self.headless = headless
+        self.max_sessions = max_sessions
+        self.keep_finished = keep_finished
+        self.handler = handler or LoginHandler(headless=headless)
+        self._sessions = {}
+        self._running = 0
+        self._lock = threading.Lock()
+        self._loop = None
+        self._playwright = None
+        self._browser = None
+
+    def _ensure_loop(self):
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, name="login-sessions", daemon=True).start()
+            return self._loop
+
+    def _prune(self):
+        cutoff = time.time() - self.keep_finished
+        for session_id, session in list(self._sessions.items()):
+            if session.done and session.finished_at < cutoff:
+                del self._sessions[session_id]
+
+    def start(self, user_agent=None):
+        """
+        Starts a login session. Raises TooManySessions when `max_sessions`
+        are already running.
+        """
+        with self._lock:
+            self._prune()
+            if self._running >= self.max_sessions:
+                raise TooManySessions(f"{self._running} logins already running")
+            session = LoginSession(user_agent or self.manager.get_user_agent_for_session())
+            self._sessions[session.id] = session
+            self._running += 1
+        session.log("Starting login session...")
+        asyncio.run_coroutine_threadsafe(self._run(session), self._ensure_loop())
+        return session
+
+    def get(self, session_id):
+        with self._lock:
+            self._prune()
+            return self._sessions.get(session_id)
+
+    def active(self):
+        with self._lock:
+            return [s for s in self._sessions.values() if not s.done]
+
+    def cancel(self, session_id):
+        session = self.get(session_id)
+        if session is None or session.done or session.task is None:
+            return False
+        self._loop.call_soon_threadsafe(session.task.cancel)
+        return True
+
+    async def _get_browser(self):
+        if self._browser is None or not self._browser.is_connected():
+            if self._playwright is None:
+                self._playwright = await async_playwright().start()
+            self._browser = await self._playwright.chromium.launch(headless=self.headless, args=BROWSER_ARGS)
+        return self._browser
+
+    async def _close_browser(self):
+        browser, playwright = self._browser, self._playwright
+        self._browser = self._playwright = None
+        try:
+            if browser is not None:
+                await browser.close()
+            if playwright is not None:
+                await playwright.stop()
+        except Exception as e:
+            logger.warning("Failed to close the login browser: %s", e)
+
+    async def _run(self, session):
+        session.task = asyncio.current_task()
+        try:
+            browser = await self._get_browser()
+            result = await self.handler.login_async(
+                browser, session.user_agent,
+                qr_callback=session.set_qr,
+                status_callback=session.log,
+                state_callback=session.set_state,
+            )
+            if result["success"]:
+                self.manager.add_account(result["user_id"], result["nickname"], result["state_path"],
+                                         session.user_agent)
+                session.finish(SUCCESS, f"Added account: {result['nickname']}")
+            elif result["error"] == TIMEOUT_ERROR:
+                session.finish(TIMEOUT, result["error"])
+            else:
+                session.finish(FAILED, result.get("error") or "Unknown error")
+        except asyncio.CancelledError:
+            session.finish(CANCELLED, "Cancelled")
+        except Exception as e:
+            session.finish(FAILED, str(e))
+        finally:
+            with self._lock:
+                self._running -= 1
+                idle = not self._running
+            if idle:
+                await self._close_browser()
@@ -1,75 +1,434 @@
-import json
 import time
 import os
 import random
+import argparse
+import asyncio
+import json
+import logging
+import sys
 from account_manager import AccountManager
-from scraper import XHSScraper
+from account_scheduler import AccountScheduler
+from scraper import XHSScraper, ScraperEngine, DEFAULT_MAX_PAGES, DEFAULT_MAX_RSS_MB
+from pipeline import DEFAULT_RATE, StreamQueue, run_concurrent, format_stats
+from process_pool import run_processes
+from async_scraper import AsyncXHSScraper
+from interception import ResourceBlocker, WAIT_MODES, WAIT_STATE
+from debug_capture import DebugCapture, POLICIES, POLICY_ON_ERROR
+from results_sink import JsonlSink, COMPRESSIONS, results_files
+from projection import DEFAULT_SPEC, record_title
+from note_index import NoteIndex, IndexedSink, INDEX_FILE
+from note_store import NoteStore, StoredSink
+from refresh_scheduler import RefreshScheduler, RefreshSink
+from media_downloader import MediaDownloader, MediaSink
+from html_fetch import HtmlFetcher
+from profiling import Tracer, SamplingProfiler
+from link_queue import LinkQueue, PENDING, DONE, FAILED
+from session_health import SessionHealth, is_session_expired
+from retry_policy import RetryPolicy
+from metrics import metrics
+from logging_setup import get_logger, setup_logging
 
 LINKS_FILE = "links.txt"
 RESULTS_FILE = os.path.join("data", "results.jsonl")
-LOG_FILE = os.path.join("data", "scraper.log")
-
-def log(message):
-    if not os.path.exists("data"):
-        os.makedirs("data")
-    timestamp = time.strftime("%Y-%m-%d %H:%M:%S")
-    entry = f"[{timestamp}] {message}"
-    print(entry)
-    with open(LOG_FILE, "a", encoding="utf-8") as f:
-        f.write(entry + "\n")
-
-def run():
+METRICS_FILE = os.path.join("data", "metrics_summary.json")
+
+logger = get_logger("main")
+
+def log(message, level=logging.INFO, **fields):
+    """
+    Logs a run message; `fields` (job, account, url, worker, error_class)
+    end up as keys of its JSON record in data/scraper.log.
+    """
+    logger.log(level, message, extra=fields)
+
+def run(max_pages=DEFAULT_MAX_PAGES, max_rss_mb=DEFAULT_MAX_RSS_MB, workers=None, rate=DEFAULT_RATE,
+        retry_failed=False, block_resources=True, wait_mode=WAIT_STATE, debug=None, sink=None,
+        raw=False, ttl=None, check_sessions=True, processes=None, refresh=False, refresh_limit=None, download_media=False,
+        html_fetch=False, tracer=None):
+    setup_logging()
     manager = AccountManager()
-    scraper = XHSScraper(headless=True)
-    
-    # Select an account
-    account = manager.get_random_active_account()
-    if not account:
-        log("Error: No active accounts found. Please add an account via the Web UI.")
+    # Retries, adaptive timeouts and circuit breakers for failing accounts and hosts
+    policy = RetryPolicy()
+    # Each page leases the account with the most remaining budget
+    scheduler = AccountScheduler(manager, breaker=policy.breaker)
+    # Disable accounts whose session already expired before any work goes to them
+    health = SessionHealth(manager, log=log)
+    if check_sessions:
+        health.check_all()
+
+    active = [a for a in manager.get_all_accounts() if a.get('status') == 'active']
+    if not active:
+        log("Error: No active accounts found. Please add an account via the Web UI.", logging.ERROR)
         return
 
-    log(f"Using account: {account['nickname']} (ID: {account['id']})")
-    state_file = account['state_file']
-    user_agent = account['user_agent']
+    for account in active:
+        if not os.path.exists(account['state_file']):
+            log(f"Warning: State file {account['state_file']} missing, skipping {account['nickname']}.", logging.WARNING,
+                account=account['id'])
+    log(f"Accounts: {', '.join(a['nickname'] for a in active)}")
 
-    if not os.path.exists(state_file):
-        log(f"Error: State file {state_file} missing.")
+    # A refresh-only run needs no links file
+    if not os.path.exists(LINKS_FILE) and not refresh:
+        log(f"Error: {LINKS_FILE} not found.", logging.ERROR)
         return
 
-    if not os.path.exists(LINKS_FILE):
-        log(f"Error: {LINKS_FILE} not found.")
+    # Durable queue: resumes after a crash and skips links already in results
+    queue = LinkQueue()
+    recovered = queue.recover()
+    if retry_failed:
+        queue.retry_failed()
+    added = queue.ingest(LINKS_FILE) if os.path.exists(LINKS_FILE) else 0
+    skipped = sum(queue.skip_scraped(path) for path in results_files(RESULTS_FILE))
+    # Skip notes the index already has, refresh the ones older than the TTL
+    already_indexed, refreshed = queue.sync_with_index(INDEX_FILE, ttl)
+    refresher = RefreshScheduler()
+    if refresh:
+        # Only the notes whose adaptive revisit interval has passed, most overdue first
+        refresher.seed()
+        refreshed += refresher.enqueue_due(queue, refresh_limit)
+    counts = queue.counts()
+    log(f"Queue: {added} new, {recovered} recovered, {skipped + already_indexed} already scraped, {refreshed} to refresh, "
+        f"{counts[PENDING]} pending, {counts[DONE]} done, {counts[FAILED]} failed")
+
+    if not counts[PENDING]:
+        log("No pending links in queue")
         return
 
-    with open(LINKS_FILE, "r", encoding="utf-8") as f:
-        links = [line.strip() for line in f if line.strip()]
+    blocker = ResourceBlocker(enabled=block_resources)
+    debug = debug or DebugCapture()
+    tracer = tracer or Tracer()
+    # Every record is also indexed for dedup and stored for queries (/api/notes); a
+    # re-scrape identical to the last one is not appended to the results again
+    index_sink = IndexedSink(sink or JsonlSink(RESULTS_FILE), NoteIndex(), skip_unchanged=True)
+    sink = StoredSink(index_sink, NoteStore())
+    # ... and diffed against the note's previous scrape to adapt its refresh interval
+    sink = RefreshSink(sink, refresher)
+    if download_media:
+        # Images and videos are fetched after the scrape, once the browsers are closed
+        sink = MediaSink(sink, MediaDownloader(), log=log)
+    metrics.gauge_fn("xhs_queue_links", queue.counts)
+
+    if check_sessions:
+        health.start()
+    try:
+        if processes:
+            _scrape_processes(queue, sink, processes, debug, tracer, max_pages=max_pages, max_rss_mb=max_rss_mb,
+                              workers=workers, rate=rate, block_resources=block_resources, wait_mode=wait_mode,
+                              raw=raw, html_fetch=html_fetch)
+        else:
+            _scrape_queue(queue, scheduler, health, policy, sink, max_pages, max_rss_mb, workers, rate, blocker,
+                          wait_mode, debug, None if raw else DEFAULT_SPEC, html_fetch, tracer)
+    finally:
+        health.stop()
+        sink.close()
+        if index_sink.skipped:
+            log(f"{index_sink.skipped} unchanged re-scrapes not appended to the results")
+        # Let the background writer flush pending debug captures
+        debug.close()
+        write_metrics_summary()
+
+def write_metrics_summary():
+    """
+    Logs the per-stage timings and outcome counts of the run and saves
+    them to data/metrics_summary.json.
+    """
+    for line in metrics.summary_lines():
+        log(f"Metrics: {line}")
+    with open(METRICS_FILE, "w", encoding="utf-8") as f:
+        json.dump(metrics.summary(), f, ensure_ascii=False, indent=2)
+
+def run_stdin(workers=None, rate=DEFAULT_RATE, max_pages=DEFAULT_MAX_PAGES, max_rss_mb=DEFAULT_MAX_RSS_MB,
+              block_resources=True, wait_mode=WAIT_STATE, debug=None, raw=False, urls=None, out=None,
+              html_fetch=False, tracer=None, check_sessions=True):
+    """
+    Batch mode: reads note URLs from stdin (one per line) and writes one
+    NDJSON result line per note to stdout as soon as it completes, in
+    completion order, with the input index attached. Logs go to stderr.
+    """
+    setup_logging(console=sys.stderr)
+    urls = sys.stdin if urls is None else urls
+    out = sys.stdout.buffer if out is None else out
+
+    manager = AccountManager()
+    policy = RetryPolicy()
+    scheduler = AccountScheduler(manager, breaker=policy.breaker)
+    health = SessionHealth(manager, log=log)
+    if check_sessions:
+        health.check_all()
+    stream = StreamQueue(urls, out)
+    debug = debug or DebugCapture()
+    workers = workers or 1
+    projection = None if raw else DEFAULT_SPEC
+    fetcher = HtmlFetcher(projection=projection) if html_fetch else None
+    tracer = tracer or Tracer()
+
+    log(f"Streaming batch from stdin: {workers} workers, {rate:.2f} req/s per host")
+    if check_sessions:
+        health.start()
+    try:
+        stats = asyncio.run(run_concurrent(
+            stream, scheduler, stream, log, workers=workers, rate=rate,
+            max_pages=max_pages, max_rss_mb=max_rss_mb, health=health, policy=policy,
+            scraper=AsyncXHSScraper(blocker=ResourceBlocker(enabled=block_resources), wait_mode=wait_mode,
+                                    debug=debug, projection=projection, timeouts=policy.timeouts,
+                                    fetcher=fetcher, tracer=tracer)
+        ))
+        if stats['no_accounts']:
+            log("Error: No usable accounts left.", logging.ERROR)
+    finally:
+        if fetcher is not None:
+            log(fetcher.summary())
+            fetcher.close()
+        log_traces(tracer)
+        scheduler.flush()
+        health.stop()
+        stream.close()
+        debug.close()
+        write_metrics_summary()
+    log(f"Done: {stream.counts['done']} scraped, {stream.counts['failed']} failed")
 
-    if not links:
-        log("No links found in links.txt")
+def log_traces(tracer):
+    if tracer.saved:
+        log(f"Saved {tracer.saved} Playwright traces to {tracer.directory} (open with `playwright show-trace`)")
+
+def _scrape_processes(queue, sink, processes, debug, tracer, **options):
+    """
+    --processes mode: shards the queue across worker processes (see
+    process_pool.py); this process writes every record to `sink`.
+    """
+    tabs = f", {options['workers']} tabs each" if options["workers"] else ""
+    log(f"Multi-process mode: {processes} processes{tabs}, {options['rate']:.2f} req/s per host per process")
+    # Workers build their own DebugCapture from the same settings
+    debug_options = {"policy": debug.policy, "sample_percent": debug.sample_percent,
+                     "capture_html": debug.capture_html, "capture_har": debug.capture_har}
+    # ... and their Tracer; the slow threshold is then per process
+    trace_options = {"slow_percentile": tracer.slow_percentile, "match": tracer.match}
+    stats = run_processes(_scrape_shard, processes, queue, sink, log, debug_options=debug_options,
+                          trace_options=trace_options, **options)
+    counts = queue.counts()
+    log(f"Done: {stats['written']} scraped, {counts[PENDING]} pending, {counts[FAILED]} failed")
+    if stats["recovered"]:
+        log(f"{stats['recovered']} links left in flight by killed workers went back to pending", logging.WARNING)
+    if any(stats["exit_codes"]):
+        log(f"Worker exit codes: {stats['exit_codes']}", logging.WARNING)
+
+def _scrape_shard(shard, max_pages, max_rss_mb, workers, rate, block_resources, wait_mode, raw, html_fetch,
+                  debug_options, trace_options):
+    """
+    Body of one --processes worker: its own account scheduler, retry policy
+    and browser, scraping the links it claims from the shared queue.
+    Account budgets are shared through accounts.json.
+    """
+    manager = AccountManager()
+    policy = RetryPolicy()
+    scheduler = AccountScheduler(manager, breaker=policy.breaker)
+    health = SessionHealth(manager, log=log)
+    debug = DebugCapture(**debug_options)
+    try:
+        _scrape_queue(shard, scheduler, health, policy, shard, max_pages, max_rss_mb, workers, rate,
+                      ResourceBlocker(enabled=block_resources), wait_mode, debug, None if raw else DEFAULT_SPEC,
+                      html_fetch, Tracer(**trace_options), stop=shard.stop)
+    finally:
+        debug.close()
+
+def _scrape_queue(queue, scheduler, health, policy, sink, max_pages, max_rss_mb, workers, rate, blocker, wait_mode,
+                  debug, projection, html_fetch=False, tracer=None, stop=None):
+    # Browserless first pass over each note; the browser only gets the ones it cannot read
+    fetcher = HtmlFetcher(projection=projection) if html_fetch else None
+    tracer = tracer or Tracer()
+    try:
+        _scrape_with(queue, scheduler, health, policy, sink, max_pages, max_rss_mb, workers, rate, blocker,
+                     wait_mode, debug, projection, fetcher, tracer, stop)
+    finally:
+        if fetcher is not None:
+            log(fetcher.summary())
+            fetcher.close()
+        log_traces(tracer)
+        scheduler.flush()
+
+def _scrape_with(queue, scheduler, health, policy, sink, max_pages, max_rss_mb, workers, rate, blocker, wait_mode,
+                 debug, projection, fetcher, tracer, stop=None):
+    if workers:
+        # Concurrent mode: tab pool on the async API, paced by the per-host rate limit
+        log(f"Concurrent mode: {workers} workers, {rate:.2f} req/s per host")
+        stats = asyncio.run(run_concurrent(
+            queue, scheduler, sink, log, workers=workers, rate=rate,
+            max_pages=max_pages, max_rss_mb=max_rss_mb, health=health, policy=policy,
+            scraper=AsyncXHSScraper(blocker=blocker, wait_mode=wait_mode, debug=debug, projection=projection,
+                                    timeouts=policy.timeouts, fetcher=fetcher, tracer=tracer)
+        ))
+        log(f"Done: {stats['written']} scraped, {stats['failed']} failed, {stats['retried']} retries")
+        if stats['no_accounts']:
+            log("Error: No usable accounts left.", logging.ERROR)
         return
 
-    for link in links:
-        log(f"Scraping: {link}")
-        
-        result = scraper.scrape_note(link, state_file, user_agent)
-        
-        if result["success"]:
-            data = result["data"]
-            data["account_used"] = account['nickname']
-            data["timestamp"] = time.time()
+    # A --processes worker's waits end as soon as the parent asks it to stop
+    sleep = time.sleep if stop is None else stop.wait
+
+    # One browser for the whole batch, recycled per the engine policy
+    with ScraperEngine(headless=True, max_pages=max_pages, max_rss_mb=max_rss_mb, lazy=fetcher is not None) as engine:
+        engine.warm(scheduler.usable_accounts())
+        scraper = XHSScraper(engine=engine, blocker=blocker, wait_mode=wait_mode, debug=debug,
+                             projection=projection, timeouts=policy.timeouts, fetcher=fetcher, tracer=tracer)
+
+        while True:
+            job = queue.claim()
+            if job is None:
+                retry_at = queue.next_retry_at()
+                if retry_at is None:
+                    break
+                # Only backed-off links are left
+                sleep(max(retry_at - time.time(), 0))
+                continue
+            link = job["url"]
+
+            # The host's circuit is open: hold off instead of burning attempts
+            wait = policy.host_wait(link)
+            if wait:
+                log(f"Host paused after repeated failures, waiting {wait:.0f}s", logging.WARNING, url=link)
+                sleep(wait)
+
+            # Sleeps until an account is within its limits
+            lease = scheduler.acquire_blocking(stop=stop, log=log)
+            if lease is None:
+                queue.requeue(job["id"])
+                if stop is None or not stop.is_set():
+                    log("Error: No usable accounts left.", logging.ERROR)
+                break
+            account = lease.account
+            fields = {"job": job["id"], "url": link, "account": account["id"]}
+            log(f"Scraping: {link} (account: {account['nickname']})", **fields)
             
-            # Append to results
-            with open(RESULTS_FILE, "a", encoding="utf-8") as f:
-                f.write(json.dumps(data, ensure_ascii=False) + "\n")
+            try:
+                result = scraper.scrape_note(link, account['state_file'], account['user_agent'])
+            finally:
+                scheduler.release(lease)
+            policy.record(result, account, link)
+            metrics.record_outcome(result, account)
             
-            log(f"Successfully scraped: {data.get('title', 'No Title')}")
-        else:
-            log(f"Failed: {result['error']}")
-            if "Session expired" in str(result['error']):
-                 # Could disable account here
-                 pass
-        
-        # Natural delay
-        time.sleep(random.uniform(2, 5))
+            if result["success"]:
+                data = result["data"]
+                data["account_used"] = account['nickname']
+                data["timestamp"] = time.time()
+                
+                sink.write(data)
+                queue.mark_done(job["id"])
+                
+                log(f"Successfully scraped: {record_title(data) or 'No Title'} {format_stats(result['stats'])}", **fields)
+            elif is_session_expired(result):
+                # The account failed, not the link: disable it and let another account retry
+                health.mark_expired(account)
+                queue.requeue(job["id"])
+                log(f"Session expired for {account['nickname']}, requeued {link}", logging.WARNING, **fields)
+            else:
+                delay = policy.retry_delay(result["error_class"], job["attempts"])
+                if delay is None:
+                    log(f"Failed ({result['error_class']}): {result['error']}", logging.WARNING,
+                        error_class=result["error_class"], **fields)
+                    queue.mark_failed(job["id"], result["error"], result["error_class"], final=True)
+                else:
+                    log(f"Failed ({result['error_class']}), retrying in {delay:.0f}s: {result['error']}",
+                        error_class=result["error_class"], **fields)
+                    queue.mark_failed(job["id"], result["error"], result["error_class"], retry_at=time.time() + delay)
+            
+            # Natural delay
+            sleep(random.uniform(2, 5))
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Scrape every note listed in links.txt (or piped to stdin with --stdin)")
+    parser.add_argument("--max-pages", type=int, default=DEFAULT_MAX_PAGES,
+                        help="Relaunch the browser after this many pages (0 = never)")
+    parser.add_argument("--max-rss-mb", type=int, default=DEFAULT_MAX_RSS_MB,
+                        help="Relaunch the browser when its memory exceeds this many MB (0 = never)")
+    parser.add_argument("--stdin", action="store_true",
+                        help="Read note URLs from stdin and stream NDJSON results to stdout instead of links.txt")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Scrape concurrently with N browser tabs (default: one link at a time)")
+    parser.add_argument("--processes", type=int, default=None,
+                        help="Shard the queue across N processes, each with its own browser (combines with --workers)")
+    parser.add_argument("--rate", type=float, default=DEFAULT_RATE,
+                        help="Polite request rate per host in requests/second for --workers mode")
+    parser.add_argument("--no-block", action="store_true",
+                        help="Load images, media, fonts and trackers instead of aborting them")
+    parser.add_argument("--wait", choices=WAIT_MODES, default=WAIT_STATE,
+                        help="'state': stop waiting once __INITIAL_STATE__ is ready; 'networkidle': wait for the network")
+    parser.add_argument("--debug-capture", choices=POLICIES, default=POLICY_ON_ERROR,
+                        help="When to save debug screenshots to log/debug_screenshots")
+    parser.add_argument("--debug-sample", type=float, default=1.0,
+                        help="Percentage of successful pages captured with --debug-capture sample")
+    parser.add_argument("--debug-html", action="store_true", help="Also save the page HTML with each capture")
+    parser.add_argument("--debug-har", action="store_true", help="Also save a HAR of the page requests with each capture")
+    parser.add_argument("--raw", action="store_true",
+                        help="Store the full raw __INITIAL_STATE__ instead of the projected note fields")
+    parser.add_argument("--compress", choices=COMPRESSIONS, default="none",
+                        help="Compress the results file with gzip or zstd")
+    parser.add_argument("--rotate-mb", type=int, default=None,
+                        help="Start a new results file after this many MB")
+    parser.add_argument("--rotate-minutes", type=int, default=None,
+                        help="Start a new results file after this many minutes")
+    parser.add_argument("--ttl-hours", type=float, default=None,
+                        help="Re-scrape notes whose last scrape is older than this (default: never)")
+    parser.add_argument("--refresh", action="store_true",
+                        help="Also re-scrape stored notes whose adaptive refresh interval has passed")
+    parser.add_argument("--refresh-limit", type=int, default=None,
+                        help="Re-scrape at most N due notes per run (most overdue first)")
+    parser.add_argument("--html-fetch", action="store_true",
+                        help="Read each note's state from its HTML over plain HTTP first and only fall back to "
+                             "the browser when the state is missing or the page redirects to login")
+    parser.add_argument("--download-media", action="store_true",
+                        help="After scraping, download note images and videos into data/media")
+    parser.add_argument("--trace", action="append", metavar="NOTE",
+                        help="Record a Playwright trace (network, screenshots, DOM snapshots) of the scrapes whose "
+                             "URL contains NOTE (a note ID or URL) into log/traces; repeatable")
+    parser.add_argument("--trace-slow", type=float, metavar="PCT", default=None,
+                        help="Also keep a Playwright trace of every scrape slower than this percentile of the "
+                             "recent page times, e.g. 95")
+    parser.add_argument("--profile", action="store_true",
+                        help="Sample the Python stacks of the run and save them to log/profiles")
+    parser.add_argument("--retry-failed", action="store_true",
+                        help="Give links that exhausted their attempts another try")
+    parser.add_argument("--skip-session-check", action="store_true",
+                        help="Do not check account sessions against user/me (offline runs, benchmarks)")
+    args = parser.parse_args(argv)
+    if args.stdin and args.processes:
+        parser.error("--processes cannot be combined with --stdin")
+    if args.trace_slow is not None and not 0 < args.trace_slow < 100:
+        parser.error("--trace-slow takes a percentile between 0 and 100")
+    return args
+
+def cli(argv=None):
+    """
+    Command line entry point, also behind `xhs.py scrape`.
+    """
+    args = parse_args(argv)
+    tracer = Tracer(slow_percentile=args.trace_slow, match=args.trace or ())
+    profiler = SamplingProfiler().start() if args.profile else None
+    try:
+        _run_cli(args, tracer)
+    finally:
+        if profiler is not None:
+            profiler.stop()
+
+def _run_cli(args, tracer):
+    if args.stdin:
+        run_stdin(workers=args.workers, rate=args.rate, max_pages=args.max_pages, max_rss_mb=args.max_rss_mb,
+                  block_resources=not args.no_block, wait_mode=args.wait,
+                  debug=DebugCapture(policy=args.debug_capture, sample_percent=args.debug_sample,
+                                     capture_html=args.debug_html, capture_har=args.debug_har),
+                  raw=args.raw, html_fetch=args.html_fetch, tracer=tracer,
+                  check_sessions=not args.skip_session_check)
+    else:
+        run(max_pages=args.max_pages, max_rss_mb=args.max_rss_mb, workers=args.workers, rate=args.rate,
+            retry_failed=args.retry_failed, block_resources=not args.no_block, wait_mode=args.wait,
+            debug=DebugCapture(policy=args.debug_capture, sample_percent=args.debug_sample,
+                               capture_html=args.debug_html, capture_har=args.debug_har),
+            sink=JsonlSink(RESULTS_FILE, compression=args.compress,
+                           rotate_bytes=args.rotate_mb * 1024 * 1024 if args.rotate_mb else None,
+                           rotate_seconds=args.rotate_minutes * 60 if args.rotate_minutes else None),
+            raw=args.raw, ttl=args.ttl_hours * 3600 if args.ttl_hours else None,
+            check_sessions=not args.skip_session_check, processes=args.processes,
+            refresh=args.refresh, refresh_limit=args.refresh_limit, download_media=args.download_media,
+            html_fetch=args.html_fetch, tracer=tracer)
 
 if __name__ == "__main__":
-    run()
+    cli()
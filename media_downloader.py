@@ -0,0 +1,463 @@
+"""
+Post-scrape download of note images and videos.
+
+    downloader = MediaDownloader()
+    results = downloader.run(urls)
+
+Downloads run on asyncio with a shared connection pool: aiohttp when it is
+installed, otherwise keep-alive http.client connections (http_pool.py) in
+a thread pool. Concurrency is capped overall and per host. Bodies stream
+to a .part file in CHUNK_SIZE pieces and are hashed on the way; an
+interrupted download resumes with an HTTP Range request. Finished files
+land in a content-addressed store, data/media/<sha[:2]>/<sha256><ext>, so
+an asset shared by several notes is stored once; data/media/index.db
+maps every URL to its file.
+"""
+import argparse
+import asyncio
+import concurrent.futures
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from urllib.parse import urljoin, urlsplit
+from http_pool import ConnectionPool
+from note_store import record_fields
+from results_sink import RESULTS_FILE, ResultsSink, loads, open_results, results_files
+from logging_setup import get_logger
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+logger = get_logger("media")
+
+MEDIA_DIR = os.path.join("data", "media")
+
+DEFAULT_CONCURRENCY = 16
+DEFAULT_PER_HOST = 4
+CHUNK_SIZE = 64 * 1024
+DEFAULT_TIMEOUT = 60
+DEFAULT_RETRIES = 2
+RETRY_DELAY = 1.0
+MAX_REDIRECTS = 3
+
+BACKENDS = ("aiohttp", "threads")
+
+# The CDN expects requests coming from the site
+HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) "
+                  "Chrome/120.0.0.0 Safari/537.36",
+    "Referer": "https://www.xiaohongshu.com/",
+}
+
+EXTENSIONS = {
+    "image/webp": ".webp",
+    "image/jpeg": ".jpg",
+    "image/png": ".png",
+    "image/gif": ".gif",
+    "image/heic": ".heic",
+    "video/mp4": ".mp4",
+    "video/quicktime": ".mov",
+}
+
+# File signatures, for parts whose response did not say what they hold
+MAGIC = (
+    (0, b"\xff\xd8\xff", "image/jpeg"),
+    (0, b"\x89PNG", "image/png"),
+    (0, b"GIF8", "image/gif"),
+    (8, b"WEBP", "image/webp"),
+    (8, b"heic", "image/heic"),
+    (8, b"qt  ", "video/quicktime"),
+    (4, b"ftyp", "video/mp4"),
+)
+
+DOWNLOADED = "downloaded"
+DEDUPED = "deduped"
+CACHED = "cached"
+FAILED = "failed"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS media (
+    url TEXT PRIMARY KEY,
+    sha256 TEXT NOT NULL,
+    path TEXT NOT NULL,
+    bytes INTEGER NOT NULL,
+    content_type TEXT,
+    fetched_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS media_sha ON media (sha256);
+"""
+
+
+class DownloadError(Exception):
+    pass
+
+
+def sniff_type(path):
+    """
+    Content type of a media file from its first bytes, or None.
+    """
+    with open(path, "rb") as f:
+        head = f.read(16)
+    for offset, signature, content_type in MAGIC:
+        if head[offset:offset + len(signature)] == signature:
+            return content_type
+    return None
+
+
+def media_urls(record):
+    """
+    Image and video URLs of a results record, projected or raw.
+    """
+    _, fields = record_fields(record)
+    urls = []
+    for value in (fields.get("image_urls"), fields.get("video_url")):
+        for url in [value] if isinstance(value, str) else value or []:
+            if isinstance(url, str) and url:
+                urls.append("https:" + url if url.startswith("//") else url)
+    return list(dict.fromkeys(urls))
+
+
+class _Part:
+    """
+    A download in progress in <store>/tmp, hashed as it is written. The
+    name derives from the URL, so a later attempt finds and resumes it.
+    The content type of the response that started it is kept next to it
+    (.type): a resume that finds the part complete gets a 416 without it.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.type_path = path + ".type"
+        self.size = os.path.getsize(path) if os.path.exists(path) else 0
+        self.hasher = None
+        self._file = None
+
+    def saved_type(self):
+        try:
+            with open(self.type_path, encoding="utf-8") as f:
+                return f.read().strip() or None
+        except OSError:
+            return None
+
+    def open(self, resume, content_type=None):
+        self.hasher = hashlib.sha256()
+        if resume and self.size:
+            with open(self.path, "rb") as f:
+                for chunk in iter(lambda: f.read(CHUNK_SIZE * 16), b""):
+                    self.hasher.update(chunk)
+            self._file = open(self.path, "ab")
+        else:
+            self.size = 0
+            self._file = open(self.path, "wb")
+            with open(self.type_path, "w", encoding="utf-8") as f:
+                f.write(content_type or "")
+
+    def write(self, chunk):
+        self._file.write(chunk)
+        self.hasher.update(chunk)
+        self.size += len(chunk)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def content_type(self, response_type, resume):
+        """
+        Content type of the finished part; `resume` as from _resume_from().
+        """
+        content_type = response_type if resume is not None else self.saved_type()
+        content_type = (content_type or "").split(";")[0].strip() or None
+        if content_type not in EXTENSIONS:
+            content_type = sniff_type(self.path) or content_type
+        return content_type
+
+
+def _resume_from(status, headers, offset):
+    """
+    How to treat a response to a request for bytes `offset`- of a file:
+    True to append to the part, False to start over, None when the part is
+    already complete. Raises DownloadError for anything else.
+    """
+    if status == 206 and (headers.get("Content-Range") or "").startswith(f"bytes {offset}-"):
+        return True
+    if status == 200:
+        return False
+    if status == 416 and offset:
+        return None
+    raise DownloadError(f"HTTP {status}")
+
+
+def _check_length(part, headers, resumed_from):
+    expected = headers.get("Content-Length")
+    if expected is not None and part.size - resumed_from != int(expected):
+        raise DownloadError(f"Connection closed after {part.size} bytes")
+
+
+class MediaIndex:
+    """
+    URL -> stored file, in SQLite.
+    """
+
+    def __init__(self, path):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+
+    def get(self, url):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT sha256, path, bytes, content_type FROM media WHERE url = ?", (url,)
+            ).fetchone()
+        return dict(zip(("sha256", "path", "bytes", "content_type"), row)) if row else None
+
+    def add(self, url, sha256, path, size, content_type):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO media (url, sha256, path, bytes, content_type, fetched_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (url, sha256, path, size, content_type, time.time())
+            )
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class MediaDownloader:
+    """
+    Downloads media URLs into the content-addressed store. Each result is
+    {"url", "status", "sha256", "path", "bytes"} with status DOWNLOADED,
+    DEDUPED (same content already stored), CACHED (URL fetched before) or
+    FAILED (plus "error").
+    """
+
+    def __init__(self, store_dir=MEDIA_DIR, concurrency=DEFAULT_CONCURRENCY, per_host=DEFAULT_PER_HOST,
+                 timeout=DEFAULT_TIMEOUT, retries=DEFAULT_RETRIES, backend=None, headers=None):
+        if backend is None:
+            backend = "aiohttp" if aiohttp is not None else "threads"
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown backend: {backend}")
+        if backend == "aiohttp" and aiohttp is None:
+            raise RuntimeError("The aiohttp backend requires aiohttp (pip install aiohttp)")
+        self.store_dir = store_dir
+        self.concurrency = concurrency
+        self.per_host = per_host
+        self.timeout = timeout
+        self.retries = retries
+        self.backend = backend
+        self.headers = dict(HEADERS, **(headers or {}))
+        self.stats = {DOWNLOADED: 0, DEDUPED: 0, CACHED: 0, FAILED: 0, "bytes": 0}
+
+        os.makedirs(os.path.join(store_dir, "tmp"), exist_ok=True)
+        self.index = MediaIndex(os.path.join(store_dir, "index.db"))
+        self.pool = None
+        self._session = None
+        self._executor = None
+        self._slots = None
+        self._host_slots = {}
+
+    async def __aenter__(self):
+        self._slots = asyncio.Semaphore(self.concurrency)
+        self._host_slots = {}
+        if self.backend == "aiohttp":
+            connector = aiohttp.TCPConnector(limit=self.concurrency, limit_per_host=self.per_host)
+            self._session = aiohttp.ClientSession(
+                connector=connector, timeout=aiohttp.ClientTimeout(total=None, sock_read=self.timeout))
+        else:
+            self.pool = ConnectionPool(max_idle_per_host=self.per_host, timeout=self.timeout)
+            self._executor = concurrent.futures.ThreadPoolExecutor(self.concurrency, thread_name_prefix="media")
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+            self.pool.close()
+
+    def close(self):
+        self.index.close()
+
+    def run(self, urls):
+        """
+        Downloads every URL; blocking wrapper around download_all().
+        """
+        return asyncio.run(self.download_all(urls))
+
+    async def download_all(self, urls):
+        async with self:
+            return await asyncio.gather(*(self.download(url) for url in dict.fromkeys(urls)))
+
+    def _host_slot(self, url):
+        host = urlsplit(url).hostname
+        if host not in self._host_slots:
+            self._host_slots[host] = asyncio.Semaphore(self.per_host)
+        return self._host_slots[host]
+
+    async def download(self, url):
+        known = self.index.get(url)
+        if known and os.path.exists(known["path"]):
+            self.stats[CACHED] += 1
+            return dict(known, url=url, status=CACHED)
+
+        error = None
+        # Host slot first: a download queued behind a busy host must not hold a global slot
+        async with self._host_slot(url):
+            async with self._slots:
+                for attempt in range(self.retries + 1):
+                    try:
+                        return await self._download(url)
+                    except Exception as e:
+                        error = e
+                        if attempt < self.retries:
+                            await asyncio.sleep(RETRY_DELAY * 2 ** attempt)
+        self.stats[FAILED] += 1
+        logger.warning("Failed to download %s: %s", url, error, extra={"url": url})
+        return {"url": url, "status": FAILED, "error": str(error)}
+
+    async def _download(self, url):
+        part = _Part(os.path.join(self.store_dir, "tmp", hashlib.sha1(url.encode()).hexdigest() + ".part"))
+        if self._session is not None:
+            content_type = await self._fetch_aiohttp(url, part)
+        else:
+            loop = asyncio.get_running_loop()
+            content_type = await loop.run_in_executor(self._executor, self._fetch_blocking, url, part)
+
+        sha256 = part.hasher.hexdigest()
+        path = os.path.join(self.store_dir, sha256[:2], sha256 + EXTENSIONS.get(content_type, ".bin"))
+        if os.path.exists(path):
+            os.remove(part.path)
+            status = DEDUPED
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(part.path, path)
+            status = DOWNLOADED
+            self.stats["bytes"] += part.size
+        if os.path.exists(part.type_path):
+            os.remove(part.type_path)
+        self.stats[status] += 1
+        self.index.add(url, sha256, path, part.size, content_type)
+        return {"url": url, "status": status, "sha256": sha256, "path": path, "bytes": part.size,
+                "content_type": content_type}
+
+    def _request_headers(self, offset):
+        return dict(self.headers, Range=f"bytes={offset}-") if offset else dict(self.headers)
+
+    async def _fetch_aiohttp(self, url, part):
+        offset = part.size
+        async with self._session.get(url, headers=self._request_headers(offset)) as response:
+            resume = _resume_from(response.status, response.headers, offset)
+            part.open(resume is not False, response.headers.get("Content-Type"))
+            if resume is not None:
+                try:
+                    async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                        part.write(chunk)
+                finally:
+                    part.close()
+                _check_length(part, response.headers, offset if resume else 0)
+            part.close()
+            return part.content_type(response.headers.get("Content-Type"), resume)
+
+    def _fetch_blocking(self, url, part):
+        offset = part.size
+        for _ in range(MAX_REDIRECTS + 1):
+            response = self.pool.request("GET", url, headers=self._request_headers(offset))
+            try:
+                if response.status in (301, 302, 303, 307, 308):
+                    url = urljoin(url, response.getheader("Location"))
+                    response.read()
+                    continue
+                resume = _resume_from(response.status, response.headers, offset)
+                part.open(resume is not False, response.getheader("Content-Type"))
+                if resume is not None:
+                    try:
+                        while chunk := response.read(CHUNK_SIZE):
+                            part.write(chunk)
+                    finally:
+                        part.close()
+                    _check_length(part, response.headers, offset if resume else 0)
+                else:
+                    response.read()
+                part.close()
+                return part.content_type(response.getheader("Content-Type"), resume)
+            finally:
+                self.pool.release(response)
+        raise DownloadError("Too many redirects")
+
+
+class MediaSink(ResultsSink):
+    """
+    Wraps a sink, collects the media URLs of every record it writes and
+    downloads them all when the sink is closed, after the scrape.
+    """
+
+    def __init__(self, sink, downloader, log=logger.info):
+        self.sink = sink
+        self.downloader = downloader
+        self.log = log
+        self.urls = {}
+
+    def write(self, record):
+        location = self.sink.write(record)
+        for url in media_urls(record):
+            self.urls[url] = None
+        return location
+
+    def flush(self):
+        self.sink.flush()
+
+    def close(self):
+        self.sink.close()
+        if self.urls:
+            self.log(f"Downloading {len(self.urls)} media files...")
+            self.downloader.run(list(self.urls))
+            self.log(format_stats(self.downloader.stats))
+        self.downloader.close()
+
+
+def format_stats(stats):
+    return (f"Media: {stats[DOWNLOADED]} downloaded ({stats['bytes'] / 1024 / 1024:.1f} MB), "
+            f"{stats[DEDUPED]} duplicates, {stats[CACHED]} already stored, {stats[FAILED]} failed")
+
+
+def run(argv=None):
+    """
+    python media_downloader.py [results files...]  -> downloads the media of stored results
+    """
+    parser = argparse.ArgumentParser(description="Download the images and videos of scraped notes")
+    parser.add_argument("files", nargs="*", help="Results files (default: every data/results*.jsonl segment)")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY)
+    parser.add_argument("--per-host", type=int, default=DEFAULT_PER_HOST)
+    parser.add_argument("--backend", choices=BACKENDS, default=None, help="Default: aiohttp if installed")
+    args = parser.parse_args(argv)
+
+    urls = {}
+    for path in args.files or results_files(RESULTS_FILE):
+        with open_results(path) as f:
+            for line in f:
+                try:
+                    record = loads(line)
+                except ValueError:
+                    continue
+                if isinstance(record, dict):
+                    urls.update(dict.fromkeys(media_urls(record)))
+
+    downloader = MediaDownloader(concurrency=args.concurrency, per_host=args.per_host, backend=args.backend)
+    print(f"{len(urls)} media URLs, {downloader.backend} backend")
+    started = time.perf_counter()
+    downloader.run(list(urls))
+    print(f"{format_stats(downloader.stats)} in {time.perf_counter() - started:.1f}s")
+    downloader.close()
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,284 @@
+"""
+Lightweight in-process metrics: counters, gauges and histograms rendered
+in the Prometheus text format, without depending on prometheus_client.
+
+    from metrics import metrics
+    with metrics.stage("navigate"):
+        page.goto(url)
+    metrics.inc("xhs_scrapes_total", outcome="success")
+    print(metrics.render())
+
+Everything goes to the module-level `metrics` registry, which the
+scrapers, engines, sinks and pipelines share.
+"""
+import contextlib
+import threading
+import time
+
+# Upper bounds (seconds) of the latency histogram buckets
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Stages of a scrape, timed into xhs_stage_seconds{stage=...}
+STAGES = ("launch", "context", "fetch", "navigate", "wait", "extract", "screenshot", "serialize")
+
+STAGE_METRIC = "xhs_stage_seconds"
+PAGE_METRIC = "xhs_page_seconds"
+SCRAPES_METRIC = "xhs_scrapes_total"
+ACCOUNT_SCRAPES_METRIC = "xhs_account_scrapes_total"
+FETCH_PATH_METRIC = "xhs_fetch_path_total"
+
+HELP = {
+    STAGE_METRIC: "Time spent per scrape stage",
+    PAGE_METRIC: "Total time per scraped page",
+    SCRAPES_METRIC: "Scrapes by outcome (success or error class)",
+    ACCOUNT_SCRAPES_METRIC: "Scrapes by account and outcome",
+    FETCH_PATH_METRIC: "Notes by scrape path (html or browser fallback, with its reason)",
+    "xhs_queue_links": "Links in the queue by state",
+    "xhs_job_queue_depth": "Web scrape jobs waiting to run",
+    "xhs_browser_rss_mb": "Resident memory of the browser process tree (MB)",
+}
+
+
+def _labels(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """
+        Estimates a quantile by linear interpolation inside its bucket.
+        """
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        lower = 0.0
+        for i, bound in enumerate(self.buckets):
+            if seen + self.counts[i] >= rank:
+                share = (rank - seen) / self.counts[i] if self.counts[i] else 0
+                return lower + (bound - lower) * share
+            seen += self.counts[i]
+            lower = bound
+        return self.buckets[-1]
+
+
+class Metrics:
+    """
+    Thread-safe registry of counters, gauges and histograms, each keyed by
+    metric name and label set. Gauges can also be callbacks that are
+    evaluated at render time (queue depth, RSS).
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.started_at = time.time()
+        self._counters = {}
+        self._gauges = {}
+        self._gauge_fns = {}
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def reset(self):
+        with self._lock:
+            self.started_at = time.time()
+            self._counters.clear()
+            self._gauges.clear()
+            self._histograms.clear()
+
+    def inc(self, name, value=1, **labels):
+        key = (name, _labels(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        with self._lock:
+            self._gauges[(name, _labels(labels))] = value
+
+    def gauge_fn(self, name, fn):
+        """
+        Registers a gauge computed on demand. `fn` returns a number, a
+        {label value: number} dict (labelled "state"), or None to skip.
+        """
+        with self._lock:
+            self._gauge_fns[name] = fn
+
+    def observe(self, name, value, **labels):
+        key = (name, _labels(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(self.buckets)
+            histogram.observe(value)
+
+    @contextlib.contextmanager
+    def timer(self, name, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def stage(self, stage):
+        """
+        Times one scrape stage (see STAGES).
+        """
+        return self.timer(STAGE_METRIC, stage=stage)
+
+    def record_outcome(self, result, account=None):
+        """
+        Counts a scrape result by outcome, and by account when given.
+        """
+        outcome = "success" if result.get("success") else (result.get("error_class") or "error")
+        self.inc(SCRAPES_METRIC, outcome=outcome)
+        if account is not None:
+            self.inc(ACCOUNT_SCRAPES_METRIC, account=account.get("nickname") or account["id"], outcome=outcome)
+
+    def snapshot(self):
+        """
+        Raw counters and histograms as plain, picklable data, for merge()
+        into the registry of another process.
+        """
+        with self._lock:
+            return {
+                "counters": list(self._counters.items()),
+                "histograms": [(key, list(h.counts), h.sum, h.count) for key, h in self._histograms.items()],
+            }
+
+    def merge(self, snapshot):
+        """
+        Adds a snapshot() taken in another process (e.g. a --processes
+        worker) to this registry.
+        """
+        with self._lock:
+            for key, value in snapshot["counters"]:
+                self._counters[key] = self._counters.get(key, 0) + value
+            for key, counts, total, count in snapshot["histograms"]:
+                histogram = self._histograms.get(key)
+                if histogram is None:
+                    histogram = self._histograms[key] = Histogram(self.buckets)
+                histogram.counts = [a + b for a, b in zip(histogram.counts, counts)]
+                histogram.sum += total
+                histogram.count += count
+
+    def _collect_gauges(self):
+        with self._lock:
+            gauges = dict(self._gauges)
+            fns = dict(self._gauge_fns)
+        for name, fn in fns.items():
+            try:
+                value = fn()
+            except Exception:
+                continue
+            if value is None:
+                continue
+            if isinstance(value, dict):
+                for label, v in value.items():
+                    gauges[(name, (("state", label),))] = v
+            else:
+                gauges[(name, ())] = value
+        return gauges
+
+    def render(self):
+        """
+        Prometheus text exposition format.
+        """
+        lines = []
+        described = set()
+
+        def describe(name, kind):
+            if name not in described:
+                described.add(name)
+                if name in HELP:
+                    lines.append(f"# HELP {name} {HELP[name]}")
+                lines.append(f"# TYPE {name} {kind}")
+
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted(self._histograms.items(), key=lambda item: item[0])
+        for (name, labels), value in counters:
+            describe(name, "counter")
+            lines.append(f"{name}{_format_labels(labels)} {value}")
+        for (name, labels), value in sorted(self._collect_gauges().items()):
+            describe(name, "gauge")
+            lines.append(f"{name}{_format_labels(labels)} {value}")
+        for (name, labels), histogram in histograms:
+            describe(name, "histogram")
+            cumulative = 0
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                cumulative += count
+                lines.append(f"{name}_bucket{_format_labels(labels, [('le', bound)])} {cumulative}")
+            lines.append(f"{name}_bucket{_format_labels(labels, [('le', '+Inf')])} {histogram.count}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {histogram.sum:.6f}")
+            lines.append(f"{name}_count{_format_labels(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self):
+        """
+        Compact dict of the current values: counters, gauges, and count /
+        mean / p50 / p95 per histogram.
+        """
+        def key_name(name, labels):
+            return name + _format_labels(labels)
+
+        with self._lock:
+            counters = {key_name(n, l): v for (n, l), v in sorted(self._counters.items())}
+            histograms = {
+                key_name(n, l): {
+                    "count": h.count,
+                    "mean": h.sum / h.count if h.count else None,
+                    "p50": h.quantile(0.5),
+                    "p95": h.quantile(0.95),
+                }
+                for (n, l), h in sorted(self._histograms.items(), key=lambda item: item[0])
+            }
+        gauges = {key_name(n, l): v for (n, l), v in sorted(self._collect_gauges().items())}
+        return {
+            "elapsed_seconds": time.time() - self.started_at,
+            "counters": counters,
+            "gauges": gauges,
+            "histograms": histograms,
+        }
+
+    def summary_lines(self):
+        """
+        Human-readable summary, one line per stage and outcome.
+        """
+        summary = self.summary()
+        lines = [f"Run time: {summary['elapsed_seconds']:.0f}s"]
+        for name, value in summary["counters"].items():
+            if name.startswith((SCRAPES_METRIC, FETCH_PATH_METRIC)):
+                lines.append(f"{name}: {value}")
+        for name, h in summary["histograms"].items():
+            if h["count"]:
+                lines.append(f"{name}: n={h['count']} mean={h['mean'] * 1000:.0f}ms "
+                             f"p50={h['p50'] * 1000:.0f}ms p95={h['p95'] * 1000:.0f}ms")
+        for name, value in summary["gauges"].items():
+            lines.append(f"{name}: {value:.0f}" if isinstance(value, float) else f"{name}: {value}")
+        return lines
+
+
+metrics = Metrics()
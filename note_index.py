@@ -0,0 +1,203 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+from urllib.parse import urlsplit
+from results_sink import ResultsSink, dumps, loads
+
+INDEX_FILE = os.path.join("data", "note_index.db")
+
+# Note IDs are 24 hex chars in every web URL form:
+#   /explore/<id>, /discovery/item/<id>, /user/profile/<user>/<id>
+NOTE_ID_RE = re.compile(r"/(?:explore|discovery/item|user/profile/[0-9a-zA-Z]+)/([0-9a-f]{24})(?:[/?#]|$)")
+
+# Fields that change on every scrape and must not affect the content hash
+VOLATILE_FIELDS = ("_scraped_url", "account_used", "timestamp")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS notes (
+    note_id TEXT PRIMARY KEY,
+    url TEXT,
+    scraped_at REAL NOT NULL,
+    content_hash TEXT,
+    file TEXT,
+    offset INTEGER,
+    length INTEGER
+);
+"""
+
+
+def canonical_note_id(url):
+    """
+    Extracts the note ID from a note URL, ignoring host, query string
+    (xsec_token, xsec_source, ...) and fragment. Returns None for URLs that
+    do not carry one, such as xhslink.com short links.
+    """
+    path = urlsplit(url.strip()).path
+    match = NOTE_ID_RE.search(path)
+    return match.group(1) if match else None
+
+
+def canonical_key(url):
+    """
+    Dedup key for a link: "note:<id>" when the note ID is known, otherwise
+    the URL itself.
+    """
+    note_id = canonical_note_id(url)
+    return f"note:{note_id}" if note_id else url.strip()
+
+
+def content_hash(record):
+    stable = {k: v for k, v in record.items() if k not in VOLATILE_FIELDS}
+    return hashlib.sha1(dumps(stable)).hexdigest()
+
+
+class NoteIndex:
+    """
+    On-disk index of scraped notes: note ID -> last scrape time, content
+    hash and where the record lives in the results files, so a stored
+    result can be read back with one seek instead of scanning results.jsonl.
+    """
+
+    def __init__(self, path=INDEX_FILE):
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def record(self, record, location=None):
+        """
+        Indexes a written record. `location` is what the sink returned.
+        Returns (note_id, changed) where `changed` tells whether the content
+        differs from the previous scrape; note_id is None if unknown.
+        """
+        url = record.get("_scraped_url", "")
+        note_id = canonical_note_id(url) or record.get("note_id")
+        if not note_id:
+            return None, True
+        digest = content_hash(record)
+        location = location or {}
+
+        with self._lock:
+            row = self._conn.execute("SELECT content_hash FROM notes WHERE note_id = ?", (note_id,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO notes (note_id, url, scraped_at, content_hash, file, offset, length) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (note_id, url, record.get("timestamp") or time.time(), digest,
+                 location.get("file"), location.get("offset"), location.get("length"))
+            )
+        return note_id, row is None or row[0] != digest
+
+    def touch(self, record):
+        """
+        For a re-scrape identical to the note's indexed record (same content
+        hash, results file still on disk): moves the indexed scrape time
+        forward, keeping the old record's location, and returns True.
+        Returns False when the record has to be written.
+        """
+        note_id = canonical_note_id(record.get("_scraped_url", "")) or record.get("note_id")
+        if not note_id:
+            return False
+        entry = self.get(note_id)
+        if entry is None or entry["content_hash"] != content_hash(record):
+            return False
+        if not entry["file"] or not os.path.exists(entry["file"]):
+            return False
+        with self._lock:
+            self._conn.execute("UPDATE notes SET scraped_at = ? WHERE note_id = ?",
+                               (record.get("timestamp") or time.time(), note_id))
+        return True
+
+    def get(self, note_id):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT note_id, url, scraped_at, content_hash, file, offset, length FROM notes WHERE note_id = ?",
+                (note_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        keys = ("note_id", "url", "scraped_at", "content_hash", "file", "offset", "length")
+        return dict(zip(keys, row))
+
+    def is_fresh(self, note_id, ttl):
+        entry = self.get(note_id)
+        return entry is not None and (ttl is None or time.time() - entry["scraped_at"] < ttl)
+
+    def load(self, note_id):
+        """
+        Reads the stored result for a note with a single seek.
+        Returns None when the note is unknown or its file is not addressable
+        (compressed or missing).
+        """
+        entry = self.get(note_id)
+        if not entry or entry["offset"] is None or not entry["file"] or not os.path.exists(entry["file"]):
+            return None
+        with open(entry["file"], "rb") as f:
+            f.seek(entry["offset"])
+            line = f.read(entry["length"]) if entry["length"] else f.readline()
+        return loads(line)
+
+
+class IndexedSink(ResultsSink):
+    """
+    Wraps a sink and indexes every record it writes. With `skip_unchanged`,
+    a re-scrape identical to the indexed record is not written again (see
+    NoteIndex.touch); `skipped` counts those.
+    """
+
+    def __init__(self, sink, index, skip_unchanged=False):
+        self.sink = sink
+        self.index = index
+        self.skip_unchanged = skip_unchanged
+        self.skipped = 0
+
+    def write(self, record):
+        if self.skip_unchanged and self.index.touch(record):
+            self.skipped += 1
+            return None
+        location = self.sink.write(record)
+        self.index.record(record, location)
+        return location
+
+    def flush(self):
+        self.sink.flush()
+
+    def close(self):
+        self.sink.close()
+
+
+def run(argv=None):
+    """
+    python note_index.py <note id or URL>  -> prints the stored result
+    """
+    args = sys.argv[1:] if argv is None else argv
+    if not args:
+        print("Usage: python note_index.py <note id or URL>")
+        return
+    index = NoteIndex()
+    note_id = canonical_note_id(args[0]) or args[0]
+    entry = index.get(note_id)
+    if entry is None:
+        print(f"Note {note_id} not indexed")
+        return
+    print(json.dumps(entry, ensure_ascii=False, indent=2))
+    stored = index.load(note_id)
+    if stored is not None:
+        print(json.dumps(stored, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,355 @@
+import argparse
+import csv
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from results_sink import RESULTS_FILE, ResultsSink, dumps, loads, open_results, results_files
+from note_index import canonical_note_id
+from projection import project
+from export_options import EXPORT_FORMATS, add_export_arguments
+
+STORE_FILE = os.path.join("data", "notes.db")
+
+# Writes are committed in batches: every COMMIT_EVERY records or
+# COMMIT_INTERVAL seconds, whichever comes first
+COMMIT_EVERY = 200
+COMMIT_INTERVAL = 2.0
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+COUNT_FIELDS = ("liked_count", "collected_count", "comment_count", "share_count")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS notes (
+    note_id TEXT PRIMARY KEY,
+    url TEXT,
+    title TEXT,
+    author_id TEXT,
+    author_nickname TEXT,
+    account_used TEXT,
+    published_at REAL,
+    scraped_at REAL NOT NULL,
+    liked_count INTEGER,
+    collected_count INTEGER,
+    comment_count INTEGER,
+    share_count INTEGER,
+    data TEXT NOT NULL CHECK (json_valid(data))
+);
+CREATE INDEX IF NOT EXISTS notes_author ON notes (author_id, scraped_at);
+CREATE INDEX IF NOT EXISTS notes_scraped ON notes (scraped_at, note_id);
+CREATE INDEX IF NOT EXISTS notes_account ON notes (account_used, scraped_at);
+CREATE INDEX IF NOT EXISTS notes_liked ON notes (liked_count);
+"""
+
+COLUMNS = ("note_id", "url", "title", "author_id", "author_nickname", "account_used", "published_at",
+           "scraped_at") + COUNT_FIELDS + ("data",)
+
+# Columns of a CSV export; the full record only goes into JSON lines exports
+EXPORT_COLUMNS = COLUMNS[:-1]
+
+UPSERT = (
+    f"INSERT INTO notes ({', '.join(COLUMNS)}) VALUES ({', '.join('?' for _ in COLUMNS)}) "
+    f"ON CONFLICT (note_id) DO UPDATE SET "
+    f"{', '.join(f'{c} = excluded.{c}' for c in COLUMNS[1:])} "
+    # Replaying old history must not overwrite a newer scrape
+    f"WHERE excluded.scraped_at >= notes.scraped_at"
+)
+
+
+def parse_count(value):
+    """
+    Interaction count as an int. The page shows "1.2万", "10+" or "1,234".
+    Returns None when there is no count.
+    """
+    if value is None or isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return int(value)
+    text = str(value).strip().replace(",", "").rstrip("+")
+    scale = 1
+    for suffix, factor in (("亿", 100_000_000), ("万", 10_000), ("w", 10_000), ("k", 1000)):
+        if text.lower().endswith(suffix):
+            text, scale = text[:-len(suffix)], factor
+            break
+    try:
+        return int(float(text) * scale)
+    except ValueError:
+        return None
+
+
+def record_fields(record):
+    """
+    (note_id, fields) of a results record, projected or raw (--raw);
+    note_id is None when the record does not identify a note.
+    """
+    url = record.get("_scraped_url") or ""
+    fields = record if "note_id" in record else (project(record) or {})
+    return fields.get("note_id") or canonical_note_id(url), fields
+
+
+def note_row(record):
+    """
+    Column values for a results record. Returns None when the record has
+    no note ID.
+    """
+    url = record.get("_scraped_url") or ""
+    note_id, fields = record_fields(record)
+    if not note_id:
+        return None
+    published = fields.get("time")
+    row = {
+        "note_id": note_id,
+        "url": url or None,
+        "title": fields.get("title"),
+        "author_id": fields.get("author_id"),
+        "author_nickname": fields.get("author_nickname"),
+        "account_used": record.get("account_used"),
+        "published_at": published / 1000 if isinstance(published, (int, float)) else None,
+        "scraped_at": record.get("timestamp") or time.time(),
+        "data": dumps(record).decode("utf-8"),
+    }
+    for field in COUNT_FIELDS:
+        row[field] = parse_count(fields.get(field))
+    return tuple(row[c] for c in COLUMNS)
+
+
+class NoteStore:
+    """
+    Queryable SQLite store of scraped notes: the latest scrape of each note,
+    with the full record as JSON and indexed columns for note ID, author,
+    scrape time, account used and interaction counts.
+
+        store = NoteStore()
+        store.add(record)
+        notes, cursor = store.query(author_id="5f...", min_likes=10000)
+
+    Fed live through StoredSink; import_results() loads existing JSONL
+    history. Queries page through notes newest first with a keyset cursor.
+    """
+
+    def __init__(self, path=STORE_FILE, commit_every=COMMIT_EVERY, commit_interval=COMMIT_INTERVAL):
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self.path = path
+        self.commit_every = commit_every
+        self.commit_interval = commit_interval
+        self._pending = []
+        self._last_commit = time.monotonic()
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+
+    def close(self):
+        self.flush()
+        with self._lock:
+            self._conn.close()
+
+    def add(self, record):
+        """
+        Queues a record for the next batch commit. Returns False when it
+        has no note ID and cannot be stored.
+        """
+        row = note_row(record)
+        if row is None:
+            return False
+        with self._lock:
+            self._pending.append(row)
+            due = (len(self._pending) >= self.commit_every
+                   or time.monotonic() - self._last_commit >= self.commit_interval)
+        if due:
+            self.flush()
+        return True
+
+    def flush(self):
+        with self._lock:
+            rows, self._pending = self._pending, []
+            self._last_commit = time.monotonic()
+            if not rows:
+                return
+            self._conn.execute("BEGIN")
+            self._conn.executemany(UPSERT, rows)
+            self._conn.execute("COMMIT")
+
+    def count(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM notes").fetchone()[0]
+
+    def get(self, note_id):
+        with self._lock:
+            row = self._conn.execute("SELECT data FROM notes WHERE note_id = ?", (note_id,)).fetchone()
+        return loads(row[0]) if row else None
+
+    def query(self, author_id=None, account=None, since=None, until=None, min_likes=None,
+              limit=DEFAULT_PAGE_SIZE, cursor=None):
+        """
+        Notes matching every given filter, newest scrape first. `since` and
+        `until` bound the scrape time (epoch seconds). Returns (notes,
+        next_cursor); pass next_cursor back for the following page, it is
+        None on the last one.
+        """
+        where = []
+        params = []
+        for clause, value in (("author_id = ?", author_id), ("account_used = ?", account),
+                              ("scraped_at >= ?", since), ("scraped_at < ?", until),
+                              ("liked_count >= ?", min_likes)):
+            if value is not None:
+                where.append(clause)
+                params.append(value)
+        if cursor:
+            scraped_at, note_id = decode_cursor(cursor)
+            where.append("(scraped_at < ? OR (scraped_at = ? AND note_id < ?))")
+            params += [scraped_at, scraped_at, note_id]
+        limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+
+        sql = "SELECT note_id, scraped_at, data FROM notes"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY scraped_at DESC, note_id DESC LIMIT ?"
+        with self._lock:
+            rows = self._conn.execute(sql, params + [limit + 1]).fetchall()
+
+        next_cursor = encode_cursor(rows[limit - 1][1], rows[limit - 1][0]) if len(rows) > limit else None
+        return [loads(data) for _, _, data in rows[:limit]], next_cursor
+
+    def import_results(self, paths=None, log=print):
+        """
+        One-shot import of JSONL results history (every results file by
+        default, compressed segments included). Returns the number of
+        records stored.
+        """
+        stored = 0
+        for path in paths or results_files(RESULTS_FILE):
+            with open_results(path) as f:
+                for line in f:
+                    try:
+                        record = loads(line)
+                    except ValueError:
+                        continue
+                    if isinstance(record, dict) and self.add(record):
+                        stored += 1
+            self.flush()
+            log(f"Imported {path} ({stored} records so far)")
+        return stored
+
+
+def export_notes(store, out, fmt="jsonl", limit=None, **filters):
+    """
+    Writes the notes matching `filters` (see NoteStore.query) to the text
+    stream `out`, newest first: full records as JSON lines, or the indexed
+    columns as CSV. Returns the number of notes written.
+    """
+    writer = None
+    if fmt == "csv":
+        writer = csv.writer(out)
+        writer.writerow(EXPORT_COLUMNS)
+    written = 0
+    cursor = None
+    while limit is None or written < limit:
+        page_size = MAX_PAGE_SIZE if limit is None else min(MAX_PAGE_SIZE, limit - written)
+        notes, cursor = store.query(limit=page_size, cursor=cursor, **filters)
+        for note in notes:
+            if writer is None:
+                out.write(json.dumps(note, ensure_ascii=False) + "\n")
+            else:
+                writer.writerow(note_row(note)[:len(EXPORT_COLUMNS)])
+        written += len(notes)
+        if cursor is None:
+            break
+    return written
+
+
+def encode_cursor(scraped_at, note_id):
+    return f"{scraped_at!r}:{note_id}"
+
+
+def decode_cursor(cursor):
+    scraped_at, _, note_id = cursor.partition(":")
+    try:
+        return float(scraped_at), note_id
+    except ValueError:
+        raise ValueError(f"Invalid cursor: {cursor}")
+
+
+class StoredSink(ResultsSink):
+    """
+    Wraps a sink and adds every record it writes to a NoteStore.
+    """
+
+    def __init__(self, sink, store):
+        self.sink = sink
+        self.store = store
+
+    def write(self, record):
+        location = self.sink.write(record)
+        self.store.add(record)
+        return location
+
+    def flush(self):
+        self.sink.flush()
+        self.store.flush()
+
+    def close(self):
+        self.sink.close()
+        self.store.close()
+
+
+def export_command(store, args):
+    """
+    Runs an export parsed with add_export_arguments(); the summary goes to
+    stderr so stdout can carry the data.
+    """
+    out = open(args.output, "w", encoding="utf-8", newline="") if args.output else sys.stdout
+    try:
+        written = export_notes(store, out, args.format, limit=args.limit, author_id=args.author,
+                               account=args.account, min_likes=args.min_likes,
+                               since=time.time() - args.since_hours * 3600 if args.since_hours else None)
+    finally:
+        if args.output:
+            out.close()
+    print(f"Exported {written} notes{f' to {args.output}' if args.output else ''}", file=sys.stderr)
+
+
+def run(argv=None):
+    """
+    python note_store.py import [results files...]
+    python note_store.py query [--author ID] [--account NAME] [--since-hours H] [--min-likes N] [--limit N]
+    python note_store.py export [--format jsonl|csv] [--output FILE] [query filters]
+    """
+    parser = argparse.ArgumentParser(description="Local store of scraped notes")
+    commands = parser.add_subparsers(dest="command", required=True)
+    importer = commands.add_parser("import", help="Load existing JSONL results into the store")
+    importer.add_argument("files", nargs="*", help="Results files (default: every data/results*.jsonl segment)")
+    query = commands.add_parser("query", help="Print matching notes as JSON lines, newest first")
+    query.add_argument("--author", help="Author user ID")
+    query.add_argument("--account", help="Nickname of the account used")
+    query.add_argument("--since-hours", type=float, help="Only notes scraped in the last H hours")
+    query.add_argument("--min-likes", type=int, help="Only notes with at least N likes")
+    query.add_argument("--limit", type=int, default=DEFAULT_PAGE_SIZE)
+    exporter = commands.add_parser("export", help="Write every matching note to a file, newest first")
+    add_export_arguments(exporter)
+    args = parser.parse_args(argv)
+
+    store = NoteStore()
+    if args.command == "import":
+        stored = store.import_results(args.files or None)
+        print(f"Done: {stored} records imported, {store.count()} notes in {store.path}")
+    elif args.command == "export":
+        export_command(store, args)
+    else:
+        notes, _ = store.query(author_id=args.author, account=args.account,
+                               since=time.time() - args.since_hours * 3600 if args.since_hours else None,
+                               min_likes=args.min_likes, limit=args.limit)
+        for note in notes:
+            sys.stdout.write(json.dumps(note, ensure_ascii=False) + "\n")
+    store.close()
+
+
+if __name__ == "__main__":
+    run()
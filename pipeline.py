@@ -0,0 +1,387 @@
+import asyncio
+import heapq
+import logging
+import queue as queue_module
+import threading
+import time
+from urllib.parse import urlsplit
+from async_scraper import AsyncScraperEngine, AsyncXHSScraper
+from scraper import DEFAULT_MAX_PAGES, DEFAULT_MAX_RSS_MB
+from projection import record_title
+from results_sink import ResultsSink, batch_line
+from session_health import SessionHealth, is_session_expired
+from retry_policy import RetryPolicy
+from metrics import metrics
+
+# Longest a stdin read waits in a thread before the producer checks on retries
+READ_POLL = 1.0
+
+# Polite default: one request every ~3.5 s per host, the same average pace
+# as the old sequential loop's random 2-5 s sleep.
+DEFAULT_RATE = 1 / 3.5
+DEFAULT_BURST = 1
+
+
+class TokenBucket:
+    """
+    Classic token bucket: `rate` tokens per second, holding at most `burst`.
+    acquire() waits until a token is available.
+    """
+
+    def __init__(self, rate, burst=DEFAULT_BURST):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        # The lock makes waiters queue up in arrival order
+        async with self._lock:
+            while True:
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class HostRateLimiter:
+    """
+    One TokenBucket per host, shared by every worker.
+    """
+
+    def __init__(self, rate=DEFAULT_RATE, burst=DEFAULT_BURST):
+        self.rate = rate
+        self.burst = burst
+        self._buckets = {}
+
+    async def acquire(self, url):
+        host = urlsplit(url).hostname or ""
+        bucket = self._buckets.get(host)
+        if bucket is None:
+            bucket = self._buckets[host] = TokenBucket(self.rate, self.burst)
+        await bucket.acquire()
+
+
+class StreamQueue(ResultsSink):
+    """
+    In-memory stand-in for LinkQueue that streams a batch: URLs are read
+    lazily from `urls` (any iterable, e.g. stdin) and every outcome is
+    written to `out` (a binary stream) as one NDJSON line as soon as it is
+    known, in completion order, tagged with the input index.
+
+    Pass it to run_concurrent() as both queue and sink: the single writer
+    calls write(record) and then mark_done(job_id) for the same job.
+    Failures scheduled for a retry are only reported once they are final.
+
+    `urls` is read by a background thread, so a slow or idle pipe never
+    blocks the event loop; run_concurrent() claims through claim_async().
+    """
+
+    def __init__(self, urls, out):
+        self.out = out
+        self._urls = urls
+        self._lines = queue_module.Queue()
+        self._reader = None
+        self._eof = False
+        self._index = 0
+        self._jobs = {}
+        self._attempts = {}
+        self._retries = []
+        self._requeued = []
+        self._record = None
+        self.counts = {"done": 0, "failed": 0}
+
+    def _job(self, index):
+        self._attempts[index] = self._attempts.get(index, 0) + 1
+        return {"id": index, "url": self._jobs[index], "attempts": self._attempts[index]}
+
+    def _read(self):
+        for line in self._urls:
+            self._lines.put(line)
+        self._lines.put(None)
+
+    def _next_line(self, timeout=None):
+        """
+        The next input line; None at the end of the input. Raises
+        queue.Empty when no line arrived within `timeout`.
+        """
+        if self._reader is None:
+            self._reader = threading.Thread(target=self._read, name="stdin-reader", daemon=True)
+            self._reader.start()
+        line = self._lines.get(timeout=timeout)
+        if line is None:
+            self._eof = True
+        return line
+
+    def _accept(self, line):
+        url = line.strip()
+        index = self._index
+        self._index += 1
+        if not url:
+            return None
+        self._jobs[index] = url
+        return self._job(index)
+
+    def _due_retry(self):
+        if self._retries and self._retries[0][0] <= time.time():
+            return self._job(heapq.heappop(self._retries)[1])
+        return None
+
+    def claim(self):
+        """
+        Next job, waiting for input as long as it takes; None once the
+        input is exhausted.
+        """
+        job = self._due_retry()
+        while job is None and not self._eof:
+            line = self._next_line()
+            if line is not None:
+                job = self._accept(line)
+        return job
+
+    async def claim_async(self):
+        """
+        claim() for the event loop: input is awaited in a thread, and a
+        retry that falls due meanwhile is handed out first.
+        """
+        while True:
+            job = self._due_retry()
+            if job is not None or self._eof:
+                return job
+            timeout = READ_POLL
+            if self._retries:
+                timeout = min(max(self._retries[0][0] - time.time(), 0), READ_POLL)
+            try:
+                line = await asyncio.to_thread(self._next_line, timeout)
+            except queue_module.Empty:
+                continue
+            if line is not None:
+                job = self._accept(line)
+                if job is not None:
+                    return job
+
+    def next_retry_at(self):
+        return self._retries[0][0] if self._retries else None
+
+    def _emit(self, job_id, result):
+        url = self._jobs.pop(job_id)
+        self._attempts.pop(job_id, None)
+        self.out.write(batch_line(job_id, url, result))
+        self.out.flush()
+
+    def write(self, record):
+        self._record = record
+        return None
+
+    def mark_done(self, job_id):
+        record, self._record = self._record, None
+        self.counts["done"] += 1
+        self._emit(job_id, {"success": True, "data": record, "account_used": record.get("account_used")})
+
+    def mark_failed(self, job_id, error, error_class=None, retry_at=None, final=False):
+        if retry_at is not None and not final:
+            heapq.heappush(self._retries, (retry_at, job_id))
+            return
+        self.counts["failed"] += 1
+        self._emit(job_id, {"success": False, "error": error, "error_class": error_class})
+
+    def requeue(self, job_id):
+        self._requeued.append(job_id)
+
+    def close(self):
+        """
+        Reports jobs handed back for lack of accounts or still waiting for
+        a retry, and the rest of the input, as failed.
+        """
+        for job_id in self._requeued:
+            self.mark_failed(job_id, "No usable account")
+        self._requeued = []
+        for _, job_id in self._retries:
+            self.mark_failed(job_id, "Retry not attempted before shutdown", final=True)
+        self._retries = []
+        while True:
+            job = self.claim()
+            if job is None:
+                break
+            self.mark_failed(job["id"], "No usable account")
+
+
+def format_stats(stats):
+    if not stats:
+        return ""
+    return (f"(requests: {stats['requests_allowed']} loaded / {stats['requests_blocked']} blocked, "
+            f"{stats['bytes_loaded'] // 1024} KB loaded, ~{stats['bytes_saved_est'] // 1024} KB saved)")
+
+
+async def _writer(results, sink, queue, stats):
+    """
+    Single writer so records never interleave in the results sink.
+    A link is only marked done once its record has been written.
+    """
+    while True:
+        item = await results.get()
+        if item is None:
+            break
+        job_id, data = item
+        sink.write(data)
+        queue.mark_done(job_id)
+        stats["written"] += 1
+    sink.flush()
+
+
+async def _worker(name, engine, scraper, jobs, results, limiter, queue, scheduler, health, policy, log, stats):
+    page = None
+    page_account = None
+    retry = None
+    try:
+        while True:
+            job, retry = retry or await jobs.get(), None
+            if job is None:
+                break
+            url = job["url"]
+
+            # The host's circuit is open: hold off instead of burning attempts
+            wait = policy.host_wait(url)
+            if wait:
+                await asyncio.sleep(wait)
+
+            # Once no account is usable, hand the remaining jobs back
+            lease = None if stats["no_accounts"] else await scheduler.acquire_async(log)
+            if lease is None:
+                stats["no_accounts"] = True
+                queue.requeue(job["id"])
+                stats["in_flight"] -= 1
+                continue
+            account = lease.account
+            fields = {"worker": name, "job": job["id"], "url": url, "account": account["id"]}
+
+            try:
+                await limiter.acquire(url)
+                log(f"[{name}] Scraping: {url} (account: {account['nickname']})", **fields)
+                result = await scraper.fetch_html(url, account['state_file'], account['user_agent'])
+                if result is None:
+                    # A tab lives in one account's context; switch tabs when the account changes
+                    if page is not None and page_account != account['id']:
+                        await engine.close_tab(page)
+                        page = None
+                    if page is None:
+                        page = await engine.open_tab(account['state_file'], account['user_agent'])
+                        page_account = account['id']
+                    if scraper.fetcher is not None:
+                        # The browser fetches the page again
+                        await limiter.acquire(url)
+                    result = await scraper.scrape_on_page(page, url)
+                    engine.page_done()
+            finally:
+                scheduler.release(lease)
+            policy.record(result, account, url)
+            metrics.record_outcome(result, account)
+
+            if result["success"]:
+                data = result["data"]
+                data["account_used"] = account['nickname']
+                data["timestamp"] = time.time()
+                await results.put((job["id"], data))
+                log(f"[{name}] Successfully scraped: {record_title(data) or 'No Title'} {format_stats(result['stats'])}",
+                    **fields)
+            elif is_session_expired(result):
+                # Not the link's fault: retire the account and retry the link on another one
+                log(f"[{name}] Session expired for {account['nickname']}, retrying {url}", logging.WARNING, **fields)
+                health.mark_expired(account)
+                await engine.close_tab(page)
+                page = None
+                await engine.drop_context(account['state_file'])
+                retry = job
+                continue
+            else:
+                delay = policy.retry_delay(result["error_class"], job["attempts"])
+                if delay is None:
+                    stats["failed"] += 1
+                    queue.mark_failed(job["id"], result["error"], result["error_class"], final=True)
+                    log(f"[{name}] Failed ({result['error_class']}): {result['error']}", logging.WARNING,
+                        error_class=result["error_class"], **fields)
+                else:
+                    stats["retried"] += 1
+                    queue.mark_failed(job["id"], result["error"], result["error_class"], retry_at=time.time() + delay)
+                    log(f"[{name}] Failed ({result['error_class']}), retrying in {delay:.0f}s: {result['error']}",
+                        error_class=result["error_class"], **fields)
+            stats["in_flight"] -= 1
+
+            if engine.recycle_pending and page is not None:
+                await engine.close_tab(page)
+                page = None
+    finally:
+        if page is not None:
+            await engine.close_tab(page)
+
+
+async def run_concurrent(queue, scheduler, sink, log, workers=4, rate=DEFAULT_RATE,
+                         burst=DEFAULT_BURST, headless=True, scraper=None,
+                         max_pages=DEFAULT_MAX_PAGES, max_rss_mb=DEFAULT_MAX_RSS_MB, health=None, policy=None):
+    """
+    Scrapes the pending links of `queue` (a LinkQueue, Shard or
+    StreamQueue, claimed through claim_async()) with a pool of
+    `workers` tabs in one shared browser, writing records to `sink`. Each
+    page runs on an account leased from `scheduler` (AccountScheduler).
+    Throughput is bounded by the per-host token bucket (`rate` requests per
+    second), not by the number of workers. `scraper` is an AsyncXHSScraper
+    carrying the page options (interception, wait mode). When a session
+    turns out to be expired, the account is disabled through `health`
+    (SessionHealth) and the link is retried on another account. Other
+    failures are retried with backoff or given up on as `policy`
+    (RetryPolicy) decides; the run lasts until no retry is outstanding.
+    `log(message, level=logging.INFO, **fields)` gets the job, url,
+    account and worker of each page as structured fields.
+    """
+    stats = {"written": 0, "failed": 0, "retried": 0, "in_flight": 0, "no_accounts": False}
+    jobs = asyncio.Queue(maxsize=workers * 2)
+    results = asyncio.Queue(maxsize=workers * 2)
+    limiter = HostRateLimiter(rate, burst)
+    scraper = scraper or AsyncXHSScraper()
+    health = health or SessionHealth(scheduler.manager, log=log)
+    policy = policy or RetryPolicy()
+
+    # With an HTML fetcher the browser only starts for the first note that falls back to it
+    async with AsyncScraperEngine(headless=headless, max_pages=max_pages, max_rss_mb=max_rss_mb,
+                                  lazy=scraper.fetcher is not None) as engine:
+        await engine.warm(scheduler.usable_accounts())
+        writer = asyncio.create_task(_writer(results, sink, queue, stats))
+        tasks = [
+            asyncio.create_task(_worker(f"w{i}", engine, scraper, jobs, results, limiter, queue, scheduler, health, policy, log, stats))
+            for i in range(workers)
+        ]
+
+        async def produce():
+            while not stats["no_accounts"]:
+                job = await queue.claim_async()
+                if job is None:
+                    # Wait for backed-off links and for in-flight ones that may still fail
+                    retry_at = queue.next_retry_at()
+                    if retry_at is None and not stats["in_flight"]:
+                        break
+                    await asyncio.sleep(min(retry_at - time.time(), 1.0) if retry_at else 1.0)
+                    continue
+                stats["in_flight"] += 1
+                await jobs.put(job)
+            for _ in tasks:
+                await jobs.put(None)
+
+        producer = asyncio.create_task(produce())
+        try:
+            await asyncio.gather(producer, *tasks)
+        finally:
+            # A crashed worker must not leave the producer blocked on a full queue
+            for task in [producer, *tasks]:
+                if not task.done():
+                    task.cancel()
+            await results.put(None)
+            await writer
+
+    return stats
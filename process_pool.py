@@ -0,0 +1,192 @@
+"""
+Multi-process scraping for large link lists.
+
+Worker processes share the durable LinkQueue (SQLite): each claims links
+on its own and runs its own browser engine, account scheduler and retry
+policy. Their records travel back to the parent, the single writer of
+the results sink, which marks a link done only once its record is
+written.
+
+    stats = run_processes(scrape_shard, 4, queue, sink, log, workers=2, ...)
+
+`scrape_shard(shard, **options)` runs in every worker; the Shard is both
+its link queue and its results sink. SIGINT/SIGTERM stop the workers
+from claiming new links; pages in flight finish and are written first.
+"""
+import asyncio
+import multiprocessing
+import queue as queue_module
+import signal
+import time
+from link_queue import LinkQueue
+from results_sink import ResultsSink
+from logging_setup import log_to_queue, relay_logs
+from metrics import metrics
+
+# Records in transit per worker; a full queue makes workers wait for the writer
+RESULTS_PER_PROCESS = 8
+POLL_INTERVAL = 0.5
+# How long workers get to finish their pages after a stop before being killed
+DRAIN_TIMEOUT = 120.0
+JOIN_TIMEOUT = 10.0
+
+RECORD = "record"
+STATS = "stats"
+
+
+class Shard(ResultsSink):
+    """
+    A worker process's handle on the shared LinkQueue. claim(),
+    mark_failed(), requeue() and next_retry_at() go straight to SQLite.
+    Like StreamQueue, write() stashes the record and mark_done() sends it
+    to the parent. Once `stop` is set, claim() and next_retry_at() report
+    nothing left, so the scrape loops wind down after their current pages.
+    """
+
+    def __init__(self, name, queue_path, results, logs, stop):
+        self.name = name
+        self.queue_path = queue_path
+        self.results = results
+        self.logs = logs
+        self.stop = stop
+        self._queue = None
+        self._record = None
+
+    def open(self):
+        self._queue = LinkQueue(self.queue_path)
+        return self
+
+    def claim(self):
+        if self.stop.is_set():
+            return None
+        return self._queue.claim()
+
+    async def claim_async(self):
+        return await asyncio.to_thread(self.claim)
+
+    def next_retry_at(self):
+        if self.stop.is_set():
+            return None
+        return self._queue.next_retry_at()
+
+    def mark_failed(self, job_id, error, error_class=None, retry_at=None, final=False):
+        self._queue.mark_failed(job_id, error, error_class, retry_at=retry_at, final=final)
+
+    def requeue(self, job_id):
+        self._queue.requeue(job_id)
+
+    def counts(self):
+        return self._queue.counts()
+
+    def write(self, record):
+        self._record = record
+
+    def mark_done(self, job_id):
+        record, self._record = self._record, None
+        self.results.put((RECORD, job_id, record))
+
+    def close(self):
+        if self._queue is not None:
+            self._queue.close()
+            self._queue = None
+
+
+def _bootstrap(target, shard, options):
+    # Ctrl+C reaches the whole process group; the parent decides when to stop
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, lambda signum, frame: shard.stop.set())
+    log_to_queue(shard.logs)
+    shard.open()
+    try:
+        target(shard, **options)
+    finally:
+        shard.results.put((STATS, shard.name, metrics.snapshot()))
+        shard.close()
+
+
+def run_processes(target, processes, queue, sink, log, **options):
+    """
+    Runs `target(shard, **options)` in `processes` worker processes over the
+    links of `queue` (a LinkQueue), writing their records to `sink` in
+    arrival order. Worker metrics are merged into the local registry.
+
+    The first SIGINT/SIGTERM lets pages in flight finish (up to
+    DRAIN_TIMEOUT), the second kills the workers. Links a killed worker was
+    holding go back to pending, so the next run resumes them.
+    Returns {"written", "recovered", "exit_codes"}.
+    """
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue(maxsize=processes * RESULTS_PER_PROCESS)
+    logs = context.Queue()
+    stop = context.Event()
+    relay = relay_logs(logs)
+    stats = {"written": 0, "recovered": 0, "exit_codes": []}
+    stopped_at = None
+
+    workers = []
+    for i in range(processes):
+        shard = Shard(f"p{i}", queue.path, results, logs, stop)
+        process = context.Process(target=_bootstrap, args=(target, shard, options), name=shard.name)
+        process.start()
+        workers.append(process)
+
+    def kill():
+        # SIGKILL: workers treat SIGTERM as a stop request
+        for process in workers:
+            if process.is_alive():
+                process.kill()
+
+    def request_stop(signum, frame):
+        if stop.is_set():
+            log("Stopping now, killing workers")
+            kill()
+            return
+        log("Stopping: finishing pages in flight (again to abort)")
+        stop.set()
+
+    previous = {sig: signal.signal(sig, request_stop) for sig in (signal.SIGINT, signal.SIGTERM)}
+
+    def handle(item):
+        if item[0] == RECORD:
+            _, job_id, record = item
+            sink.write(record)
+            queue.mark_done(job_id)
+            stats["written"] += 1
+        elif item[0] == STATS:
+            metrics.merge(item[2])
+
+    try:
+        while True:
+            try:
+                handle(results.get(timeout=POLL_INTERVAL))
+                continue
+            except queue_module.Empty:
+                pass
+            if not any(process.is_alive() for process in workers):
+                break
+            if stop.is_set():
+                stopped_at = stopped_at or time.time()
+                if time.time() - stopped_at > DRAIN_TIMEOUT:
+                    log(f"Workers still busy after {DRAIN_TIMEOUT:.0f}s, killing them")
+                    kill()
+        # Whatever the workers put before exiting
+        while True:
+            try:
+                handle(results.get(timeout=POLL_INTERVAL))
+            except queue_module.Empty:
+                break
+    finally:
+        for sig, handler in previous.items():
+            signal.signal(sig, handler)
+        stop.set()
+        for process in workers:
+            process.join(JOIN_TIMEOUT)
+            if process.is_alive():
+                process.kill()
+                process.join(JOIN_TIMEOUT)
+        relay.stop()
+        sink.flush()
+        stats["exit_codes"] = [process.exitcode for process in workers]
+        # Every worker has exited: anything still in flight was lost with a killed worker
+        stats["recovered"] = queue.recover()
+    return stats
@@ -0,0 +1,307 @@
+"""
+On-demand profiling of scrapes.
+
+Tracer records Playwright traces (network waterfall, screenshots, DOM
+snapshots; open them with `playwright show-trace <file>`) into log/traces:
+
+    - of the scrapes asked for: a job's `trace` flag, or a URL matching
+      one of `match` (main.py --trace);
+    - with `slow_percentile`, of every scrape slower than that percentile
+      of the recent page times. Slowness is only known at the end, so
+      every scrape is recorded and the chunk is kept only when it was slow.
+
+Tracing is started once per browser context and every scrape is one
+chunk of it. A context records one chunk at a time: a tab whose context
+is already recording another tab (concurrent pipeline) goes untraced.
+
+SamplingProfiler samples the Python stacks of every thread of the
+process, cheap enough to leave on for a whole main.run():
+
+    with SamplingProfiler():
+        main.run()
+"""
+import collections
+import os
+import sys
+import threading
+import time
+import weakref
+from debug_capture import prune_directory
+from note_index import canonical_note_id
+from logging_setup import get_logger
+
+logger = get_logger("profiling")
+
+TRACE_DIR = os.path.join("log", "traces")
+PROFILE_DIR = os.path.join("log", "profiles")
+
+# Retention per directory; a trace with snapshots runs into megabytes
+DEFAULT_MAX_BYTES = 500 * 1024 * 1024
+DEFAULT_MAX_AGE_DAYS = 7
+
+# Page times the slow threshold is computed over, and how many it needs first
+LATENCY_WINDOW = 500
+MIN_SAMPLES = 20
+
+SAMPLE_INTERVAL = 0.005
+TOP_FUNCTIONS = 15
+
+
+class Tracer:
+    """
+    Decides which scrapes get a Playwright trace and saves them. Shared by
+    the workers of a run; thread safe.
+
+        chunk = tracer.begin(page, url)
+        ...  # scrape
+        path = tracer.end(chunk, url, seconds)
+    """
+
+    def __init__(self, directory=TRACE_DIR, slow_percentile=None, match=(), max_bytes=DEFAULT_MAX_BYTES,
+                 max_age_days=DEFAULT_MAX_AGE_DAYS):
+        if slow_percentile is not None and not 0 < slow_percentile < 100:
+            raise ValueError(f"Percentile must be between 0 and 100: {slow_percentile}")
+        self.directory = directory
+        self.slow_percentile = slow_percentile
+        self.match = tuple(match)
+        self.max_bytes = max_bytes
+        self.max_age_days = max_age_days
+        self.saved = 0
+        self._latencies = collections.deque(maxlen=LATENCY_WINDOW)
+        self._started = weakref.WeakSet()
+        self._busy = weakref.WeakSet()
+        self._counter = 0
+        self._lock = threading.Lock()
+
+    def threshold(self):
+        """
+        Page time (seconds) above which a scrape counts as slow, or None
+        while there are too few samples (or no percentile was set).
+        """
+        with self._lock:
+            values = sorted(self._latencies)
+        if self.slow_percentile is None or len(values) < MIN_SAMPLES:
+            return None
+        return values[min(int(len(values) * self.slow_percentile / 100), len(values) - 1)]
+
+    def wanted(self, url, force=False):
+        """
+        Whether the scrape of `url` must be traced, whatever its speed.
+        """
+        return force or any(pattern in url for pattern in self.match)
+
+    def _claim(self, context, url, force):
+        """
+        None when this scrape goes untraced, else whether tracing still has
+        to be started on the context. Marks the context as recording.
+        """
+        if not self.wanted(url, force) and self.threshold() is None:
+            return None
+        with self._lock:
+            if context in self._busy:
+                return None
+            self._busy.add(context)
+            first = context not in self._started
+            self._started.add(context)
+        return first
+
+    def _release(self, context):
+        with self._lock:
+            self._busy.discard(context)
+
+    def _decide(self, chunk, url, seconds):
+        """
+        Records the page time and returns the path to save the chunk to, or
+        None to drop it.
+        """
+        threshold = self.threshold()
+        with self._lock:
+            self._latencies.append(seconds)
+            self._counter += 1
+            counter = self._counter
+        if chunk is None:
+            return None
+        if not (chunk["forced"] or (threshold is not None and seconds > threshold)):
+            return None
+        name = canonical_note_id(url) or "page"
+        return os.path.join(self.directory, f"trace_{name}_{time.strftime('%Y%m%d_%H%M%S')}_{counter}.zip")
+
+    def _saved(self, path, url, seconds, forced):
+        self.saved += 1
+        reason = "requested" if forced else f"slow, {seconds:.1f}s"
+        logger.info("Saved trace (%s): %s", reason, path, extra={"url": url})
+        prune_directory(self.directory, self.max_bytes, self.max_age_days)
+
+    def begin(self, page, url, force=False):
+        """
+        Starts a trace chunk for a scrape on a sync API page, if it may be
+        wanted. Returns the chunk to hand to end(), or None.
+        """
+        context = page.context
+        first = self._claim(context, url, force)
+        if first is None:
+            return None
+        try:
+            if first:
+                context.tracing.start(screenshots=True, snapshots=True)
+            context.tracing.start_chunk(title=url)
+        except Exception as e:
+            logger.warning("Failed to start tracing: %s", e, extra={"url": url})
+            self._release(context)
+            return None
+        return {"context": context, "forced": self.wanted(url, force)}
+
+    def end(self, chunk, url, seconds):
+        """
+        Counts the page time of a scrape and stops its chunk, if any.
+        Returns the path of the saved trace, or None.
+        """
+        path = self._decide(chunk, url, seconds)
+        if chunk is None:
+            return None
+        context = chunk["context"]
+        try:
+            if path:
+                os.makedirs(self.directory, exist_ok=True)
+                context.tracing.stop_chunk(path=path)
+            else:
+                context.tracing.stop_chunk()
+        except Exception as e:
+            logger.warning("Failed to stop tracing: %s", e, extra={"url": url})
+            path = None
+        finally:
+            self._release(context)
+        if path:
+            self._saved(path, url, seconds, chunk["forced"])
+        return path
+
+    async def begin_async(self, page, url, force=False):
+        """
+        begin() for an async API page.
+        """
+        context = page.context
+        first = self._claim(context, url, force)
+        if first is None:
+            return None
+        try:
+            if first:
+                await context.tracing.start(screenshots=True, snapshots=True)
+            await context.tracing.start_chunk(title=url)
+        except Exception as e:
+            logger.warning("Failed to start tracing: %s", e, extra={"url": url})
+            self._release(context)
+            return None
+        return {"context": context, "forced": self.wanted(url, force)}
+
+    async def end_async(self, chunk, url, seconds):
+        """
+        end() for an async API page.
+        """
+        path = self._decide(chunk, url, seconds)
+        if chunk is None:
+            return None
+        context = chunk["context"]
+        try:
+            if path:
+                os.makedirs(self.directory, exist_ok=True)
+                await context.tracing.stop_chunk(path=path)
+            else:
+                await context.tracing.stop_chunk()
+        except Exception as e:
+            logger.warning("Failed to stop tracing: %s", e, extra={"url": url})
+            path = None
+        finally:
+            self._release(context)
+        if path:
+            self._saved(path, url, seconds, chunk["forced"])
+        return path
+
+
+class SamplingProfiler:
+    """
+    Statistical wall-clock profiler for the Python side of a run: a
+    background thread records the stack of every other thread each
+    `interval` seconds, so waiting threads show up where they wait.
+
+    stop() writes the collapsed stacks ("thread;frame;frame count" per
+    line, the input of flamegraph.pl and speedscope) to log/profiles and
+    logs the functions seen in the most samples. Covers this process
+    only, not --processes workers.
+    """
+
+    def __init__(self, interval=SAMPLE_INTERVAL, directory=PROFILE_DIR, max_bytes=DEFAULT_MAX_BYTES,
+                 max_age_days=DEFAULT_MAX_AGE_DAYS):
+        self.interval = interval
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age_days = max_age_days
+        self.samples = 0
+        self.stacks = collections.Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self):
+        me = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self.stacks[tuple(reversed(stack))] += 1
+            self.samples += 1
+
+    def top(self, n=TOP_FUNCTIONS):
+        """
+        [(function, share of samples with it on the stack, share as the
+        innermost frame)], most frequent first.
+        """
+        total = sum(self.stacks.values()) or 1
+        inclusive = collections.Counter()
+        own = collections.Counter()
+        for stack, count in self.stacks.items():
+            for function in set(stack[1:]):
+                inclusive[function] += count
+            own[stack[-1]] += count
+        return [(function, count / total, own[function] / total) for function, count in inclusive.most_common(n)]
+
+    def stop(self):
+        """
+        Stops sampling and saves the profile. Returns its path, or None
+        when nothing was sampled.
+        """
+        if self._thread is None:
+            return None
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        if not self.stacks:
+            return None
+
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f"profile_{time.strftime('%Y%m%d_%H%M%S')}.folded")
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{';'.join(stack)} {count}\n")
+        logger.info("Saved profile (%d samples every %.0f ms): %s", self.samples, self.interval * 1000, path)
+        for function, total, own in self.top():
+            logger.info("Profile: %5.1f%% total %5.1f%% own  %s", total * 100, own * 100, function)
+        prune_directory(self.directory, self.max_bytes, self.max_age_days)
+        return path
@@ -0,0 +1,117 @@
+"""
+Declarative field projection of a note page's window.__INITIAL_STATE__.
+
+A spec maps output field names to paths into the state:
+
+    "a.b.c"        nested keys
+    "a.*.c"        `*` steps into the first value of an object (e.g. the
+                   single entry of noteDetailMap, keyed by note ID)
+    "a.list[].x"   `[]` maps the rest of the path over every array element
+
+Vue refs ({"_value": ...}) are unwrapped on the way. Missing paths yield
+None. The same spec is evaluated inside the page (PROJECT_JS) so only the
+selected fields cross the CDP bridge, and in Python (project()) for raw
+records read back from disk.
+"""
+
+NOTE = "note.noteDetailMap.*.note"
+
+DEFAULT_SPEC = {
+    "note_id": f"{NOTE}.noteId",
+    "title": f"{NOTE}.title",
+    "desc": f"{NOTE}.desc",
+    "type": f"{NOTE}.type",
+    "time": f"{NOTE}.time",
+    "ip_location": f"{NOTE}.ipLocation",
+    "author_id": f"{NOTE}.user.userId",
+    "author_nickname": f"{NOTE}.user.nickname",
+    "liked_count": f"{NOTE}.interactInfo.likedCount",
+    "collected_count": f"{NOTE}.interactInfo.collectedCount",
+    "comment_count": f"{NOTE}.interactInfo.commentCount",
+    "share_count": f"{NOTE}.interactInfo.shareCount",
+    "image_urls": f"{NOTE}.imageList[].urlDefault",
+    "video_url": f"{NOTE}.video.media.stream.h264[].masterUrl",
+    "tags": f"{NOTE}.tagList[].name",
+}
+
+# page.evaluate(PROJECT_JS, spec) -> projected object, or null without state
+PROJECT_JS = """(spec) => {
+    const state = window.__INITIAL_STATE__;
+    if (!state) return null;
+    const unwrap = (v) => (v && typeof v === 'object' && !Array.isArray(v) && '_value' in v) ? v._value : v;
+    const resolve = (value, parts, i) => {
+        value = unwrap(value);
+        if (i >= parts.length) return value === undefined ? null : value;
+        if (value === null || value === undefined || typeof value !== 'object') return null;
+        let part = parts[i];
+        if (part === '*') {
+            const keys = Object.keys(value);
+            return keys.length ? resolve(value[keys[0]], parts, i + 1) : null;
+        }
+        if (part.endsWith('[]')) {
+            const list = unwrap(part === '[]' ? value : value[part.slice(0, -2)]);
+            if (!Array.isArray(list)) return null;
+            return list.map((item) => resolve(item, parts, i + 1));
+        }
+        return resolve(value[part], parts, i + 1);
+    };
+    const out = {};
+    for (const [field, path] of Object.entries(spec)) {
+        out[field] = resolve(state, path.split('.'), 0);
+    }
+    return out;
+}"""
+
+
+def _unwrap(value):
+    if isinstance(value, dict) and "_value" in value:
+        return value["_value"]
+    return value
+
+
+def _resolve(value, parts, i):
+    value = _unwrap(value)
+    if i >= len(parts):
+        return value
+    if not isinstance(value, (dict, list)):
+        return None
+    part = parts[i]
+    if part == "*":
+        if not isinstance(value, dict) or not value:
+            return None
+        return _resolve(next(iter(value.values())), parts, i + 1)
+    if part.endswith("[]"):
+        items = value if part == "[]" else (value.get(part[:-2]) if isinstance(value, dict) else None)
+        items = _unwrap(items)
+        if not isinstance(items, list):
+            return None
+        return [_resolve(item, parts, i + 1) for item in items]
+    if not isinstance(value, dict):
+        return None
+    return _resolve(value.get(part), parts, i + 1)
+
+
+def project(state, spec=None):
+    """
+    Python twin of PROJECT_JS. Returns None when there is no state.
+    """
+    if not state:
+        return None
+    spec = spec or DEFAULT_SPEC
+    return {field: _resolve(state, path.split("."), 0) for field, path in spec.items()}
+
+
+def is_empty(projected):
+    """
+    True when the projection found no note at all.
+    """
+    return not projected or all(v is None for v in projected.values())
+
+
+def record_title(record):
+    """
+    Title of a stored record, projected or raw.
+    """
+    if "title" in record:
+        return record.get("title")
+    return _resolve(record, DEFAULT_SPEC["title"].split("."), 0)
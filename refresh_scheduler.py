@@ -0,0 +1,268 @@
+import os
+import sqlite3
+import sys
+import threading
+import time
+from results_sink import ResultsSink
+from note_store import COUNT_FIELDS, STORE_FILE, parse_count, record_fields
+
+REFRESH_FILE = os.path.join("data", "refresh.db")
+
+HOUR = 3600
+DAY = 86400
+
+# Revisit interval bounds; new notes start at DEFAULT_INTERVAL
+DEFAULT_INTERVAL = DAY
+MIN_INTERVAL = HOUR
+MAX_INTERVAL = 30 * DAY
+# A note should gain about this many likes + collects + comments between
+# two scrapes; faster-moving notes get shorter intervals
+TARGET_CHANGE = 50
+# The interval changes by at most this factor per scrape, and grows by it
+# when nothing changed
+STEP = 2.0
+
+# Counts that drive the interval (shares are tracked but too sparse)
+CHANGE_FIELDS = ("liked_count", "collected_count", "comment_count")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS refresh (
+    note_id TEXT PRIMARY KEY,
+    url TEXT NOT NULL,
+    scraped_at REAL NOT NULL,
+    interval REAL NOT NULL,
+    due_at REAL NOT NULL,
+    liked_count INTEGER,
+    collected_count INTEGER,
+    comment_count INTEGER,
+    share_count INTEGER
+);
+CREATE INDEX IF NOT EXISTS refresh_due ON refresh (due_at);
+CREATE TABLE IF NOT EXISTS count_deltas (
+    note_id TEXT NOT NULL,
+    scraped_at REAL NOT NULL,
+    elapsed REAL NOT NULL,
+    liked_count INTEGER,
+    collected_count INTEGER,
+    comment_count INTEGER,
+    share_count INTEGER,
+    PRIMARY KEY (note_id, scraped_at)
+);
+"""
+
+
+def next_interval(interval, change, elapsed):
+    """
+    Revisit interval after a scrape that saw `change` interactions over
+    `elapsed` seconds: aims at TARGET_CHANGE per interval, moving at most
+    STEP-fold from the current one, within [MIN_INTERVAL, MAX_INTERVAL].
+    """
+    if change <= 0 or elapsed <= 0:
+        wanted = interval * STEP
+    else:
+        wanted = TARGET_CHANGE / (change / elapsed)
+    wanted = min(max(wanted, interval / STEP), interval * STEP)
+    return min(max(wanted, MIN_INTERVAL), MAX_INTERVAL)
+
+
+class RefreshScheduler:
+    """
+    Decides which scraped notes are due for a re-scrape.
+
+    observe() sees every new scrape of a note: it diffs the interaction
+    counts against the previous scrape, keeps only the latest counts plus
+    a row of deltas when something changed, and adapts the note's revisit
+    interval to its change rate. Hot notes come back within hours, notes
+    that stopped moving drift out to MAX_INTERVAL.
+
+        scheduler = RefreshScheduler()
+        scheduler.enqueue_due(link_queue, limit=500)
+    """
+
+    def __init__(self, path=REFRESH_FILE):
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def observe(self, record):
+        """
+        Records a scrape. Returns the count deltas against the previous
+        scrape, or None for a note's first scrape (or an out-of-order one).
+        """
+        note_id, fields = record_fields(record)
+        if not note_id:
+            return None
+        url = record.get("_scraped_url") or f"https://www.xiaohongshu.com/explore/{note_id}"
+        scraped_at = record.get("timestamp") or time.time()
+        counts = [parse_count(fields.get(field)) for field in COUNT_FIELDS]
+
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                deltas = self._observe(note_id, url, scraped_at, counts)
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+        return deltas
+
+    def _observe(self, note_id, url, scraped_at, counts):
+        previous = self._conn.execute(
+            f"SELECT scraped_at, interval, {', '.join(COUNT_FIELDS)} FROM refresh WHERE note_id = ?",
+            (note_id,)
+        ).fetchone()
+        if previous is None:
+            self._conn.execute(
+                f"INSERT INTO refresh (note_id, url, scraped_at, interval, due_at, {', '.join(COUNT_FIELDS)}) "
+                f"VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (note_id, url, scraped_at, DEFAULT_INTERVAL, scraped_at + DEFAULT_INTERVAL, *counts)
+            )
+            return None
+        if scraped_at <= previous[0]:
+            return None
+
+        elapsed = scraped_at - previous[0]
+        deltas = {
+            field: new - old if new is not None and old is not None else 0
+            for field, new, old in zip(COUNT_FIELDS, counts, previous[2:])
+        }
+        change = sum(abs(deltas[field]) for field in CHANGE_FIELDS)
+        interval = next_interval(previous[1], change, elapsed)
+        if any(deltas.values()):
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO count_deltas (note_id, scraped_at, elapsed, {', '.join(COUNT_FIELDS)}) "
+                f"VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (note_id, scraped_at, elapsed, *(deltas[field] for field in COUNT_FIELDS))
+            )
+        # A missing count keeps the last known one as the base for the next diff
+        latest = [new if new is not None else old for new, old in zip(counts, previous[2:])]
+        self._conn.execute(
+            f"UPDATE refresh SET url = ?, scraped_at = ?, interval = ?, due_at = ?, "
+            f"{', '.join(f'{field} = ?' for field in COUNT_FIELDS)} WHERE note_id = ?",
+            (url, scraped_at, interval, scraped_at + interval, *latest, note_id)
+        )
+        return deltas
+
+    def seed(self, store_path=STORE_FILE):
+        """
+        Starts tracking the notes of the note store (note_store.py) that are
+        not tracked yet, from their last stored scrape. Returns how many.
+        """
+        if not os.path.exists(store_path):
+            return 0
+        with self._lock:
+            self._conn.execute("ATTACH DATABASE ? AS store", (store_path,))
+            try:
+                return self._conn.execute(
+                    f"INSERT OR IGNORE INTO refresh (note_id, url, scraped_at, interval, due_at, "
+                    f"{', '.join(COUNT_FIELDS)}) "
+                    f"SELECT note_id, COALESCE(url, 'https://www.xiaohongshu.com/explore/' || note_id), "
+                    f"scraped_at, ?, scraped_at + ?, {', '.join(COUNT_FIELDS)} FROM store.notes",
+                    (DEFAULT_INTERVAL, DEFAULT_INTERVAL)
+                ).rowcount
+            finally:
+                self._conn.execute("DETACH DATABASE store")
+
+    def due(self, now=None, limit=None):
+        """
+        URLs of the notes due for a re-scrape, most overdue first.
+        """
+        now = now or time.time()
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT url FROM refresh WHERE due_at <= ? ORDER BY due_at LIMIT ?",
+                (now, limit if limit else -1)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def enqueue_due(self, queue, limit=None):
+        """
+        Puts the due notes back into `queue` (a LinkQueue) as pending.
+        Returns the number of links queued for refresh.
+        """
+        return queue.enqueue_refresh(self.due(limit=limit))
+
+    def history(self, note_id):
+        """
+        Count deltas recorded for a note, oldest first.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT scraped_at, elapsed, {', '.join(COUNT_FIELDS)} FROM count_deltas "
+                f"WHERE note_id = ? ORDER BY scraped_at",
+                (note_id,)
+            ).fetchall()
+        keys = ("scraped_at", "elapsed") + COUNT_FIELDS
+        return [dict(zip(keys, row)) for row in rows]
+
+    def stats(self, now=None):
+        """
+        {"tracked", "due", "median_interval_hours"} for the status line.
+        """
+        now = now or time.time()
+        with self._lock:
+            tracked, due = self._conn.execute(
+                "SELECT COUNT(*), SUM(due_at <= ?) FROM refresh", (now,)
+            ).fetchone()
+            median = self._conn.execute(
+                "SELECT interval FROM refresh ORDER BY interval LIMIT 1 OFFSET ?", (max(tracked // 2, 0),)
+            ).fetchone()
+        return {
+            "tracked": tracked,
+            "due": due or 0,
+            "median_interval_hours": round(median[0] / HOUR, 1) if median else None,
+        }
+
+
+class RefreshSink(ResultsSink):
+    """
+    Wraps a sink and feeds every record it writes to a RefreshScheduler.
+    """
+
+    def __init__(self, sink, scheduler):
+        self.sink = sink
+        self.scheduler = scheduler
+
+    def write(self, record):
+        location = self.sink.write(record)
+        self.scheduler.observe(record)
+        return location
+
+    def flush(self):
+        self.sink.flush()
+
+    def close(self):
+        self.sink.close()
+        self.scheduler.close()
+
+
+def run(argv=None):
+    """
+    python refresh_scheduler.py [note id]  -> refresh status, or a note's count history
+    """
+    args = sys.argv[1:] if argv is None else argv
+    scheduler = RefreshScheduler()
+    if args:
+        for entry in scheduler.history(args[0]):
+            when = time.strftime("%Y-%m-%d %H:%M", time.localtime(entry["scraped_at"]))
+            changes = ", ".join(f"{field} {entry[field]:+d}" for field in COUNT_FIELDS if entry[field])
+            print(f"{when} (+{entry['elapsed'] / HOUR:.1f}h): {changes}")
+    else:
+        stats = scheduler.stats()
+        print(f"{stats['tracked']} notes tracked, {stats['due']} due, "
+              f"median interval {stats['median_interval_hours']}h")
+    scheduler.close()
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,222 @@
+"""
+Failure classes for scrapes and the policy that reacts to them.
+
+Scrapers tag every failed result with an `error_class`. RetryPolicy turns
+that into a decision: retry after an exponential, jittered backoff while
+the class's budget lasts, otherwise give up. It also owns the adaptive
+navigation timeout and the circuit breaker that pauses failing accounts
+and hosts.
+"""
+import collections
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+from logging_setup import get_logger
+
+logger = get_logger("breaker")
+
+ERROR_TIMEOUT = "timeout"
+ERROR_NAVIGATION = "navigation"
+ERROR_LOGIN_REDIRECT = "login_redirect"
+ERROR_EMPTY_STATE = "empty_state"
+ERROR_EXTRACTION = "extraction"
+ERROR_CLASSES = (ERROR_TIMEOUT, ERROR_NAVIGATION, ERROR_LOGIN_REDIRECT, ERROR_EMPTY_STATE, ERROR_EXTRACTION)
+
+# Total attempts a link gets when its latest failure is of this class.
+# Login redirects are the account's fault and are handled by switching
+# accounts, not by retrying the link.
+DEFAULT_BUDGETS = {
+    ERROR_TIMEOUT: 3,
+    ERROR_NAVIGATION: 3,
+    ERROR_LOGIN_REDIRECT: 3,
+    ERROR_EMPTY_STATE: 2,
+    ERROR_EXTRACTION: 1,
+}
+
+BACKOFF_BASE = 10.0
+BACKOFF_MAX = 600.0
+
+# Navigation timeout (ms): starts at the old fixed value and tightens to
+# a multiple of the observed p95 once there are enough samples
+NAV_TIMEOUT = 60000
+MIN_NAV_TIMEOUT = 15000
+TIMEOUT_P95_FACTOR = 2.0
+TIMEOUT_MIN_SAMPLES = 20
+TIMEOUT_WINDOW = 200
+
+# Which failures count against the account and the host
+ACCOUNT_FAILURES = (ERROR_TIMEOUT, ERROR_NAVIGATION, ERROR_EMPTY_STATE)
+HOST_FAILURES = (ERROR_TIMEOUT, ERROR_NAVIGATION)
+
+BREAKER_THRESHOLD = 5
+BREAKER_COOLDOWN = 120.0
+BREAKER_MAX_COOLDOWN = 1800.0
+
+
+def classify_exception(e):
+    """
+    Error class of an exception raised while loading a page.
+    """
+    if type(e).__name__ == "TimeoutError" or "Timeout" in str(e):
+        return ERROR_TIMEOUT
+    return ERROR_NAVIGATION
+
+
+def account_key(account):
+    return f"account:{account['id']}"
+
+
+def host_key(url):
+    return f"host:{urlsplit(url).hostname or ''}"
+
+
+class AdaptiveTimeout:
+    """
+    Navigation timeout derived from recent successful load times:
+    `factor` x p95, clamped to [minimum, maximum] ms.
+    """
+
+    def __init__(self, default=NAV_TIMEOUT, minimum=MIN_NAV_TIMEOUT, factor=TIMEOUT_P95_FACTOR,
+                 min_samples=TIMEOUT_MIN_SAMPLES, window=TIMEOUT_WINDOW):
+        self.default = default
+        self.minimum = minimum
+        self.factor = factor
+        self.min_samples = min_samples
+        self._samples = collections.deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def observe(self, seconds):
+        with self._lock:
+            self._samples.append(seconds * 1000)
+
+    def p95(self):
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return None
+        return samples[min(int(len(samples) * 0.95), len(samples) - 1)]
+
+    def current(self):
+        """
+        Timeout in ms for the next navigation.
+        """
+        with self._lock:
+            enough = len(self._samples) >= self.min_samples
+        if not enough:
+            return self.default
+        return int(min(max(self.p95() * self.factor, self.minimum), self.default))
+
+
+class CircuitBreaker:
+    """
+    Per-key circuit breaker (keys like "account:<id>" or "host:<name>").
+
+    After `threshold` consecutive failures the circuit opens for
+    `cooldown` seconds, doubling on every re-open up to `max_cooldown`.
+    Once the cooldown is over requests go through again (half-open): a
+    success closes the circuit, the first failure re-opens it.
+    """
+
+    def __init__(self, threshold=BREAKER_THRESHOLD, cooldown=BREAKER_COOLDOWN,
+                 max_cooldown=BREAKER_MAX_COOLDOWN, log=None):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.log = log or logger.warning
+        self._state = {}
+        self._lock = threading.Lock()
+
+    def _entry(self, key):
+        return self._state.setdefault(key, {"failures": 0, "open_until": 0.0, "trips": 0})
+
+    def open_until(self, key):
+        """
+        Time until which `key` is paused, or 0 when it may be used.
+        """
+        with self._lock:
+            entry = self._state.get(key)
+            if entry is None or entry["open_until"] <= time.time():
+                return 0.0
+            return entry["open_until"]
+
+    def wait_time(self, key):
+        until = self.open_until(key)
+        return max(until - time.time(), 0.0) if until else 0.0
+
+    def record_success(self, key):
+        with self._lock:
+            entry = self._state.get(key)
+            if entry is not None:
+                entry["failures"] = 0
+                entry["trips"] = 0
+
+    def record_failure(self, key):
+        with self._lock:
+            entry = self._entry(key)
+            entry["failures"] += 1
+            half_open = entry["trips"] and entry["open_until"] <= time.time()
+            if entry["failures"] < self.threshold and not half_open:
+                return
+            cooldown = min(self.cooldown * 2 ** entry["trips"], self.max_cooldown)
+            entry["open_until"] = time.time() + cooldown
+            entry["trips"] += 1
+            entry["failures"] = 0
+        self.log(f"{key} paused for {cooldown:.0f}s after repeated failures")
+
+
+class RetryPolicy:
+    """
+    Decides what happens after a failed scrape.
+
+        delay = policy.retry_delay(result["error_class"], attempts)
+        # None: give up; otherwise retry the link in `delay` seconds
+
+    record() feeds every outcome to the circuit breaker.
+    """
+
+    def __init__(self, budgets=None, backoff_base=BACKOFF_BASE, backoff_max=BACKOFF_MAX,
+                 breaker=None, timeouts=None):
+        self.budgets = dict(DEFAULT_BUDGETS, **(budgets or {}))
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.breaker = breaker or CircuitBreaker()
+        self.timeouts = timeouts or AdaptiveTimeout()
+
+    def backoff(self, attempts):
+        """
+        Exponential backoff with equal jitter: half fixed, half random.
+        """
+        delay = min(self.backoff_base * 2 ** max(attempts - 1, 0), self.backoff_max)
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def retry_delay(self, error_class, attempts):
+        """
+        Seconds to wait before retrying a link that has failed `attempts`
+        times, the last time with `error_class`. None when the class's
+        budget is spent.
+        """
+        budget = self.budgets.get(error_class, 1)
+        if attempts >= budget:
+            return None
+        return self.backoff(attempts)
+
+    def record(self, result, account, url):
+        """
+        Updates the account and host circuits with a scrape outcome.
+        """
+        if result.get("success"):
+            self.breaker.record_success(account_key(account))
+            self.breaker.record_success(host_key(url))
+            return
+        error_class = result.get("error_class")
+        if error_class in ACCOUNT_FAILURES:
+            self.breaker.record_failure(account_key(account))
+        if error_class in HOST_FAILURES:
+            self.breaker.record_failure(host_key(url))
+
+    def host_wait(self, url):
+        """
+        Seconds to hold off requests to the URL's host (0 if its circuit is closed).
+        """
+        return self.breaker.wait_time(host_key(url))
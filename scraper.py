@@ -2,98 +2,403 @@ import time
 import random
 import os
 from playwright.sync_api import sync_playwright
+from interception import ResourceBlocker, STATE_READY_JS, STATE_READY_TIMEOUT, WAIT_STATE
+from debug_capture import DebugCapture
+from profiling import Tracer
+from projection import DEFAULT_SPEC, PROJECT_JS, is_empty
+from session_health import SESSION_EXPIRED, state_version
+from metrics import metrics, PAGE_METRIC
+from logging_setup import get_logger
+from retry_policy import (AdaptiveTimeout, classify_exception, ERROR_LOGIN_REDIRECT, ERROR_EMPTY_STATE,
+                          ERROR_EXTRACTION)
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+engine_log = get_logger("engine")
+scraper_log = get_logger("scraper")
+
+BROWSER_ARGS = ['--no-sandbox', '--disable-blink-features=AutomationControlled']
+STEALTH_SCRIPT = "Object.defineProperty(navigator, 'webdriver', {get: () => undefined})"
+
+# Default recycle policy for long-lived engines
+DEFAULT_MAX_PAGES = 200
+DEFAULT_MAX_RSS_MB = 1500
+
+# Authenticated contexts kept per account
+DEFAULT_CONTEXTS_PER_ACCOUNT = 1
+
+
+def browser_rss_mb():
+    """
+    Returns the resident memory (MB) of this process and all of its children,
+    which includes the Playwright driver and every Chromium process.
+    Returns None when psutil is not installed.
+    """
+    if psutil is None:
+        return None
+    try:
+        proc = psutil.Process(os.getpid())
+        total = proc.memory_info().rss
+        for child in proc.children(recursive=True):
+            try:
+                total += child.memory_info().rss
+            except (psutil.NoSuchProcess, psutil.AccessDenied):
+                pass
+        return total / (1024 * 1024)
+    except Exception:
+        return None
+
+
+metrics.gauge_fn("xhs_browser_rss_mb", browser_rss_mb)
+
+
+class ScraperEngine:
+    """
+    Long-lived browser shared by many scrapes.
+
+    Keeps a single Chromium process alive and a pool of up to
+    `contexts_per_account` authenticated BrowserContexts per account state
+    file, so storage_state is loaded once rather than per note. warm()
+    creates an account's contexts ahead of time, and they are re-created
+    right after every relaunch. A context is rebuilt when its state file
+    changes on disk. The browser is relaunched after `max_pages` pages, or
+    when the browser process tree grows past `max_rss_mb`, so memory stays
+    bounded on long runs. A `lazy` engine launches nothing until the first
+    page needs it (HTML fetch mode, where most notes never do).
+
+    Playwright's sync API is bound to the thread that started it: create,
+    use and stop an engine from the same thread.
+
+        with ScraperEngine(headless=True) as engine:
+            scraper = XHSScraper(engine=engine)
+            scraper.scrape_note(url, state_file, user_agent)
+    """
+
+    def __init__(self, headless=True, max_pages=DEFAULT_MAX_PAGES, max_rss_mb=DEFAULT_MAX_RSS_MB,
+                 contexts_per_account=DEFAULT_CONTEXTS_PER_ACCOUNT, lazy=False):
+        self.headless = headless
+        self.max_pages = max_pages
+        self.max_rss_mb = max_rss_mb
+        self.contexts_per_account = max(contexts_per_account, 1)
+        self.lazy = lazy
+        self.browser = None
+        self.pages_since_launch = 0
+        self.launches = 0
+        self._playwright = None
+        self._contexts = {}
+        self._versions = {}
+        self._warm = {}
+
+        if self.max_rss_mb and psutil is None:
+            engine_log.warning("psutil not installed, RSS-based recycling disabled.")
+
+    def __enter__(self):
+        return self if self.lazy else self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+    @property
+    def running(self):
+        return self.browser is not None
+
+    def start(self):
+        if self._playwright is None:
+            self._playwright = sync_playwright().start()
+        if self.browser is None:
+            self._launch()
+            self._rewarm()
+        return self
+
+    def stop(self):
+        self._close_browser()
+        if self._playwright is not None:
+            try:
+                self._playwright.stop()
+            except Exception as e:
+                engine_log.warning("Failed to stop Playwright: %s", e)
+            self._playwright = None
+
+    def _launch(self):
+        with metrics.stage("launch"):
+            self.browser = self._playwright.chromium.launch(
+                headless=self.headless,
+                args=BROWSER_ARGS
+            )
+        self.pages_since_launch = 0
+        self.launches += 1
+        engine_log.info("Browser launched (#%d)", self.launches)
+
+    def _close_browser(self):
+        for pool in self._contexts.values():
+            for context in pool:
+                try:
+                    context.close()
+                except Exception:
+                    pass
+        self._contexts = {}
+        self._versions = {}
+        if self.browser is not None:
+            try:
+                self.browser.close()
+            except Exception as e:
+                engine_log.warning("Failed to close browser: %s", e)
+            self.browser = None
+
+    def recycle(self, reason=""):
+        engine_log.info(f"Recycling browser after {self.pages_since_launch} pages. {reason}".rstrip())
+        self._close_browser()
+        self._launch()
+        self._rewarm()
+
+    def _maybe_recycle(self):
+        if self.max_pages and self.pages_since_launch >= self.max_pages:
+            self.recycle(f"(page limit {self.max_pages})")
+            return
+        if self.max_rss_mb:
+            rss = browser_rss_mb()
+            if rss is not None and rss >= self.max_rss_mb:
+                self.recycle(f"(RSS {rss:.0f} MB >= {self.max_rss_mb} MB)")
+
+    def _fill_pool(self, state_file, user_agent):
+        version = state_version(state_file)
+        if state_file in self._versions and self._versions[state_file] != version:
+            engine_log.info("%s changed on disk, reloading its contexts", state_file)
+            self._close_pool(state_file)
+        pool = self._contexts.setdefault(state_file, [])
+        while len(pool) < self.contexts_per_account:
+            with metrics.stage("context"):
+                context = self.browser.new_context(
+                    storage_state=state_file,
+                    user_agent=user_agent
+                )
+                context.add_init_script(STEALTH_SCRIPT)
+            pool.append(context)
+        self._versions[state_file] = version
+        return pool
+
+    def _close_pool(self, state_file):
+        for context in self._contexts.pop(state_file, []):
+            try:
+                context.close()
+            except Exception:
+                pass
+        self._versions.pop(state_file, None)
+
+    def warm(self, accounts):
+        """
+        Creates the context pool of each account now, and again after every
+        relaunch, so the first page of an account does not pay for it.
+        A lazy engine that is not running yet only remembers the accounts.
+        """
+        for account in accounts:
+            self._warm[account['state_file']] = account['user_agent']
+        if self.running or not self.lazy:
+            self.start()
+            self._rewarm()
+        return self
+
+    def _rewarm(self):
+        for state_file, user_agent in list(self._warm.items()):
+            try:
+                self._fill_pool(state_file, user_agent)
+            except Exception as e:
+                engine_log.warning("Failed to warm %s: %s", state_file, e)
+                self._warm.pop(state_file, None)
+
+    def get_context(self, state_file, user_agent):
+        """
+        Returns the least busy context of an account's pool, creating the
+        pool on first use.
+        """
+        pool = self._fill_pool(state_file, user_agent)
+        return min(pool, key=lambda context: len(context.pages))
+
+    def drop_context(self, state_file):
+        """
+        Closes the contexts of an account, e.g. after its session expired.
+        The account is no longer kept warm; the next page reloads the state
+        file.
+        """
+        self._warm.pop(state_file, None)
+        self._close_pool(state_file)
+
+    def new_page(self, state_file, user_agent):
+        self.start()
+        self._maybe_recycle()
+        return self.get_context(state_file, user_agent).new_page()
+
+    def release_page(self, page):
+        try:
+            page.close()
+        except Exception:
+            pass
+        self.pages_since_launch += 1
+
 
 class XHSScraper:
-    def __init__(self, headless=True):
+    def __init__(self, headless=True, engine=None, blocker=None, wait_mode=WAIT_STATE, debug=None,
+                 projection=DEFAULT_SPEC, timeouts=None, fetcher=None, tracer=None):
+        """
+        Args:
+            engine (ScraperEngine): shared engine; a private one is used per call if None.
+            blocker (ResourceBlocker): request interception; defaults to blocking heavy resources.
+            wait_mode (str): "state" returns as soon as __INITIAL_STATE__ is populated,
+                "networkidle" waits for the network to go quiet.
+            debug (DebugCapture): debug capture policy; defaults to capturing failed pages only.
+            projection (dict): field spec evaluated in the page (see projection.py);
+                None returns the full raw __INITIAL_STATE__.
+            timeouts (AdaptiveTimeout): navigation timeout tracking observed load times.
+            fetcher (HtmlFetcher): tries each note over plain HTTP first; the browser
+                only handles the notes it hands back (see html_fetch.py).
+            tracer (Tracer): which browser scrapes get a Playwright trace; by default
+                only those asked for with `trace` (see profiling.py).
+        """
         self.headless = headless
+        self.engine = engine
+        self.blocker = blocker or ResourceBlocker()
+        self.wait_mode = wait_mode
+        self.debug = debug or DebugCapture()
+        self.projection = projection
+        self.timeouts = timeouts or AdaptiveTimeout()
+        self.fetcher = fetcher
+        self.tracer = tracer or Tracer()
+
+    def _save_debug_screenshot(self, page, name_prefix="debug", error=False, request_log=None):
+        """
+        Captures the current page for debugging, if the debug policy asks for it.
+        Files are written in the background.
+        """
+        self.debug.capture(page, name_prefix, error=error, request_log=request_log)
 
-    def _save_debug_screenshot(self, page, name_prefix="debug"):
+    def _wait_for_state(self, page):
         """
-        Saves a screenshot of the current page for debugging purposes.
+        Waits until __INITIAL_STATE__ is populated (or a login page shows up)
+        instead of waiting for every request to settle. A timeout or a
+        navigation during the wait is not fatal: extraction decides.
         """
-        screenshot_dir = os.path.join("log", "debug_screenshots")
-        if not os.path.exists(screenshot_dir):
-            os.makedirs(screenshot_dir)
-        
-        timestamp = time.strftime("%Y%m%d_%H%M%S")
-        filename = f"{name_prefix}_{timestamp}.png"
-        filepath = os.path.join(screenshot_dir, filename)
-        
         try:
-            page.screenshot(path=filepath)
-            print(f"[Scraper] Saved debug screenshot: {filepath}")
+            page.wait_for_function(STATE_READY_JS, timeout=STATE_READY_TIMEOUT)
         except Exception as e:
-            print(f"[Scraper] Failed to save screenshot: {e}")
+            scraper_log.debug("State wait ended early: %s", e)
+            page.wait_for_load_state("domcontentloaded")
 
-    def scrape_note(self, url, account_state_path, user_agent):
+    def scrape_note(self, url, account_state_path, user_agent, trace=False):
         """
         Scrapes a single XHS note.
+        Runs on the shared engine when one was given, otherwise launches a
+        private browser for this call only. With `trace`, the note skips the
+        HTML fetch and its browser scrape is recorded as a Playwright trace,
+        whose path is returned under "trace".
         Returns a dictionary with result or error.
         """
+        trace = self.tracer.wanted(url, trace)
+        if self.fetcher is not None and not trace:
+            started = time.perf_counter()
+            result = self.fetcher.fetch(url, account_state_path, user_agent)
+            if result is not None:
+                metrics.observe(PAGE_METRIC, time.perf_counter() - started)
+                return result
+        if self.engine is None:
+            with ScraperEngine(headless=self.headless, max_pages=0, max_rss_mb=None) as engine:
+                return self._scrape_note(engine, url, account_state_path, user_agent, trace)
+        with metrics.timer(PAGE_METRIC):
+            return self._scrape_note(self.engine, url, account_state_path, user_agent, trace)
+
+    def _scrape_note(self, engine, url, account_state_path, user_agent, trace=False):
         result = {
             "success": False,
             "data": {},
-            "error": None
+            "error": None,
+            "error_class": None,
+            "stats": {}
         }
-        
+
         try:
-            with sync_playwright() as p:
-                browser = p.chromium.launch(
-                    headless=self.headless,
-                    args=['--no-sandbox', '--disable-blink-features=AutomationControlled']
-                )
-                
-                context = browser.new_context(
-                    storage_state=account_state_path,
-                    user_agent=user_agent
-                )
-                
-                context.add_init_script("Object.defineProperty(navigator, 'webdriver', {get: () => undefined})")
-                
-                page = context.new_page()
-                
+            page = engine.new_page(account_state_path, user_agent)
+            stats = self.blocker.install(page)
+            request_log = self.debug.attach(page)
+            chunk = self.tracer.begin(page, url, force=trace)
+            page_started = time.perf_counter()
+
+            try:
+                scraper_log.info("Navigating to: %s", url, extra={"url": url})
+                timeout = self.timeouts.current()
+                started = time.time()
+                if self.wait_mode == WAIT_STATE:
+                    with metrics.stage("navigate"):
+                        page.goto(url, timeout=timeout, wait_until="domcontentloaded")
+                    with metrics.stage("wait"):
+                        self._wait_for_state(page)
+                else:
+                    with metrics.stage("navigate"):
+                        page.goto(url, timeout=timeout)
+                    with metrics.stage("wait"):
+                        page.wait_for_load_state("networkidle")
+                load_time = time.time() - started
+
+                scraper_log.debug("Page loaded. URL: %s", page.url, extra={"url": url})
+                self._save_debug_screenshot(page, "after_navigation", request_log=request_log)
+
+                # Check for login redirect
+                if "login" in page.url:
+                    scraper_log.warning("Detected login redirect. URL: %s", page.url, extra={"url": url})
+                    self._save_debug_screenshot(page, "login_redirect", error=True, request_log=request_log)
+                    result["error"] = SESSION_EXPIRED
+                    result["error_class"] = ERROR_LOGIN_REDIRECT
+                    # Reload the state file next time instead of reusing a dead session
+                    engine.drop_context(account_state_path)
+                    return result
+
+                # Extract Data from __INITIAL_STATE__
                 try:
-                    print(f"[Scraper] Navigating to: {url}")
-                    page.goto(url, timeout=60000)
-                    page.wait_for_load_state("networkidle")
-                    
-                    print(f"[Scraper] Page loaded. URL: {page.url}")
-                    self._save_debug_screenshot(page, "after_navigation")
-
-                    # Check for login redirect
-                    if "login" in page.url:
-                        print(f"[Scraper] Detected login redirect. URL: {page.url}")
-                        self._save_debug_screenshot(page, "login_redirect")
-                        result["error"] = "Session expired (Redirected to login)"
-                        browser.close()
-                        return result
-
-                    # Extract Data from __INITIAL_STATE__
-                    try:
-                        # Get the global state object
-                        initial_state = page.evaluate("() => window.__INITIAL_STATE__")
-                        
-                        if initial_state:
-                            # User requested full raw JSON without parsing
-                            result["data"] = initial_state
-                            result["data"]["_scraped_url"] = url # Inject metadata
-                            result["success"] = True
+                    if self.projection is None:
+                        # Full raw JSON without parsing
+                        with metrics.stage("extract"):
+                            data = page.evaluate("() => window.__INITIAL_STATE__")
+                        error = None if data else "window.__INITIAL_STATE__ is empty"
+                    else:
+                        # Only the projected fields cross the bridge
+                        with metrics.stage("extract"):
+                            data = page.evaluate(PROJECT_JS, self.projection)
+                        if data is None:
+                            error = "window.__INITIAL_STATE__ is empty"
+                        elif is_empty(data):
+                            error = "No note found in window.__INITIAL_STATE__"
                         else:
-                            result["error"] = "window.__INITIAL_STATE__ is empty"
-                            self._save_debug_screenshot(page, "empty_state")
-                            
-                    except Exception as e:
-                        result["error"] = f"Extraction error: {str(e)}"
-                        self._save_debug_screenshot(page, "extraction_error")
-                
+                            error = None
+
+                    if not error:
+                        result["data"] = data
+                        result["data"]["_scraped_url"] = url # Inject metadata
+                        result["success"] = True
+                        self.timeouts.observe(load_time)
+                    else:
+                        result["error"] = error
+                        result["error_class"] = ERROR_EMPTY_STATE
+                        self._save_debug_screenshot(page, "empty_state", error=True, request_log=request_log)
+
                 except Exception as e:
-                    self._save_debug_screenshot(page, "scrape_error")
-                    raise e
-                finally:
-                    browser.close()
-                
+                    result["error"] = f"Extraction error: {str(e)}"
+                    result["error_class"] = ERROR_EXTRACTION
+                    self._save_debug_screenshot(page, "extraction_error", error=True, request_log=request_log)
+
+            except Exception as e:
+                self._save_debug_screenshot(page, "scrape_error", error=True, request_log=request_log)
+                raise e
+            finally:
+                result["stats"] = stats.as_dict()
+                trace_path = self.tracer.end(chunk, url, time.perf_counter() - page_started)
+                if trace_path:
+                    result["trace"] = trace_path
+                engine.release_page(page)
+
         except Exception as e:
             result["error"] = str(e)
-        
-        print(f"[Scraper] Scrape result: {result}")
+            result["error_class"] = classify_exception(e)
+
+        scraper_log.debug("Scrape result: %s", result, extra={"url": url, "error_class": result.get("error_class")})
         return result
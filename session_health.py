@@ -0,0 +1,196 @@
+import json
+import os
+import threading
+import time
+import urllib.error
+import urllib.request
+from logging_setup import get_logger
+
+logger = get_logger("health")
+
+ME_URL = "https://edith.xiaohongshu.com/api/sns/web/v2/user/me"
+ORIGIN = "https://www.xiaohongshu.com"
+
+# Error the scrapers report when a note page redirects to login
+SESSION_EXPIRED = "Session expired (Redirected to login)"
+
+HEALTHY = "healthy"
+EXPIRED = "expired"
+UNKNOWN = "unknown"
+
+DEFAULT_CHECK_INTERVAL = 15 * 60
+CHECK_TIMEOUT = 10
+
+
+def is_logged_in(me_data):
+    """
+    True when a user/me response belongs to a logged-in (non-guest) user.
+    """
+    data = me_data.get("data") or {}
+    return me_data.get("code") == 0 and bool(data.get("user_id")) and not data.get("guest", True)
+
+
+def is_session_expired(result):
+    """
+    True when a scrape result failed because the account's session is gone.
+    """
+    return str(result.get("error") or "").startswith(SESSION_EXPIRED)
+
+
+def state_version(state_file):
+    """
+    Identity of a storage_state file on disk, to notice a re-login.
+    """
+    try:
+        stat = os.stat(state_file)
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+def load_cookies(state_file):
+    """
+    Cookies of a Playwright storage_state file, or [] if it cannot be read.
+    """
+    try:
+        with open(state_file, "r", encoding="utf-8") as f:
+            return json.load(f).get("cookies", [])
+    except (OSError, ValueError):
+        return []
+
+
+def cookie_header(cookies, host, now=None):
+    """
+    Cookie header value for a request to `host`: every unexpired cookie
+    whose domain matches.
+    """
+    now = now or time.time()
+    pairs = []
+    for cookie in cookies:
+        domain = cookie.get("domain", "").lstrip(".")
+        if not (host == domain or host.endswith("." + domain)):
+            continue
+        expires = cookie.get("expires", -1)
+        if expires not in (-1, None) and expires < now:
+            continue
+        pairs.append(f"{cookie['name']}={cookie['value']}")
+    return "; ".join(pairs)
+
+
+def check_session(state_file, user_agent, timeout=CHECK_TIMEOUT):
+    """
+    Asks user/me whether the session in `state_file` is still logged in.
+    Plain HTTP with the stored cookies, no browser. Returns HEALTHY,
+    EXPIRED, or UNKNOWN when the answer is inconclusive (network error,
+    unexpected response), which must not count against the account.
+    """
+    cookies = load_cookies(state_file)
+    if not cookies:
+        return EXPIRED
+    request = urllib.request.Request(ME_URL, headers={
+        "User-Agent": user_agent,
+        "Cookie": cookie_header(cookies, "edith.xiaohongshu.com"),
+        "Origin": ORIGIN,
+        "Referer": ORIGIN + "/",
+        "Accept": "application/json",
+    })
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            me_data = json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        return EXPIRED if e.code == 401 else UNKNOWN
+    except Exception:
+        return UNKNOWN
+    if is_logged_in(me_data):
+        return HEALTHY
+    # A well-formed answer for a guest or an explicit error code means logged out
+    if (me_data.get("data") or {}).get("guest") or me_data.get("code") not in (0, None):
+        return EXPIRED
+    return UNKNOWN
+
+
+class SessionHealth:
+    """
+    Tracks whether each account's saved session still works.
+
+    A background thread checks every active account through user/me every
+    `interval` seconds; check_all() can also be called up front. An account
+    whose session is gone, whether found by a check or reported by a scrape
+    via mark_expired(), is disabled in the AccountManager so the scheduler
+    stops handing it out before more work is sent to it.
+    """
+
+    def __init__(self, manager, interval=DEFAULT_CHECK_INTERVAL, log=None):
+        self.manager = manager
+        self.interval = interval
+        self.log = log or logger.info
+        self._status = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def status(self, account_id):
+        """
+        Returns {"state", "checked_at", "reason"} for an account, or None if
+        it has not been checked yet.
+        """
+        with self._lock:
+            entry = self._status.get(account_id)
+            return dict(entry) if entry else None
+
+    def is_healthy(self, account_id):
+        entry = self.status(account_id)
+        return entry is None or entry["state"] != EXPIRED
+
+    def _set(self, account_id, state, reason=None):
+        with self._lock:
+            self._status[account_id] = {"state": state, "checked_at": time.time(), "reason": reason}
+
+    def check(self, account):
+        state = check_session(account["state_file"], account["user_agent"])
+        if state == EXPIRED:
+            self.mark_expired(account, "user/me reports the session as logged out")
+        else:
+            self._set(account["id"], state)
+        return state
+
+    def check_all(self):
+        """
+        Checks every active account once. Returns {account_id: state}.
+        """
+        states = {}
+        for account in self.manager.get_all_accounts():
+            if account.get("status") != "active":
+                continue
+            states[account["id"]] = self.check(account)
+        return states
+
+    def mark_expired(self, account, reason=SESSION_EXPIRED):
+        """
+        Records an expired session and disables the account.
+        """
+        self._set(account["id"], EXPIRED, reason)
+        current = self.manager.get_account(account["id"])
+        if current and current.get("status") == "active":
+            self.manager.disable_account(account["id"])
+            self.log(f"Disabled {account.get('nickname', account['id'])}: {reason}")
+
+    def start(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="session-health", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(CHECK_TIMEOUT + 1)
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.check_all()
+            except Exception as e:
+                self.log(f"Health check failed: {e}")
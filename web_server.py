@@ -1,82 +1,44 @@
-from flask import Flask, render_template, jsonify, request, redirect, url_for
-import threading
+from flask import Flask, Response, render_template, jsonify, request, redirect, url_for, send_file
+import queue
 import time
 import os
 import json
 from account_manager import AccountManager
-from login_handler import LoginHandler
-from scraper import XHSScraper
+from account_scheduler import AccountScheduler
+from login_sessions import LoginSessions, TooManySessions
+from jobs import JobManager, QueueFull
+from session_health import SessionHealth
+from retry_policy import RetryPolicy
+from metrics import metrics
+from results_sink import batch_line
+from note_store import NoteStore, DEFAULT_PAGE_SIZE
+from logging_setup import attach_ring_buffer, setup_logging
+
+LOG_FILE = os.path.join("data", "web_server.log")
+DEFAULT_HOST = "0.0.0.0"
+DEFAULT_PORT = 5000
+
+setup_logging(log_file=LOG_FILE)
+# Recent records in memory for /api/logs
+recent_logs = attach_ring_buffer()
 
 app = Flask(__name__)
 manager = AccountManager()
+# Shared by the scheduler (paused accounts) and the jobs (retries, timeouts)
+policy = RetryPolicy()
+scheduler = AccountScheduler(manager, breaker=policy.breaker)
+# Periodic user/me checks disable accounts whose session expired
+health = SessionHealth(manager).start()
+
+# Scrape jobs run in the background on the shared engine; requests only
+# enqueue them and poll for the outcome.
+job_manager = JobManager(scheduler, health=health, policy=policy)
+metrics.gauge_fn("xhs_job_queue_depth", lambda: job_manager.depth)
+# Scraped notes, fed by main.py runs
+note_store = NoteStore()
 
-# Global state for the current login session
-login_session = {
-    "status": "idle", # idle, initializing, waiting_scan, processing, success, failed, timeout
-    "qr_path": None,
-    "message": "",
-    "logs": []
-}
-
-def log_msg(msg):
-    print(f"[WebLogin] {msg}")
-    login_session["logs"].append(f"{time.strftime('%H:%M:%S')} - {msg}")
-
-def login_worker_thread(user_agent):
-    global login_session
-    login_session["status"] = "initializing"
-    login_session["qr_path"] = None
-    login_session["logs"] = []
-    
-    log_msg("Starting login worker...")
-    
-    handler = LoginHandler(headless=True)
-    
-    def on_qr_code(page):
-        log_msg("QR code detected.")
-        # Screenshot to static folder
-        qr_filename = f"qr_{int(time.time())}.png"
-        qr_abs_path = os.path.join(app.root_path, "static", qr_filename)
-        
-        # Try to screenshot just the QR code or the login container
-        try:
-            # Try specific QR code image first
-            page.locator("img[src*='qr']").first.screenshot(path=qr_abs_path)
-            log_msg("QR code screenshot saved.")
-        except:
-            try:
-                # Fallback to login container
-                page.locator(".login-container").first.screenshot(path=qr_abs_path)
-                log_msg("Login container screenshot saved.")
-            except:
-                # Fallback to full page
-                page.screenshot(path=qr_abs_path)
-                log_msg("Full page screenshot saved.")
-        
-        login_session["qr_path"] = f"/static/{qr_filename}"
-        login_session["status"] = "waiting_scan"
-        return qr_abs_path
-    
-    def on_status(msg):
-        log_msg(msg)
-        
-    result = handler.login(
-        user_agent=user_agent,
-        qr_callback=on_qr_code,
-        status_callback=on_status
-    )
-    
-    if result["success"]:
-        login_session["status"] = "processing"
-        
-        # Register account
-        manager.add_account(result["user_id"], result["nickname"], result["state_path"], user_agent)
-        
-        login_session["status"] = "success"
-        login_session["message"] = f"Added account: {result['nickname']}"
-    else:
-        login_session["status"] = "failed"
-        login_session["message"] = result.get("error", "Unknown error")
+# QR logins: several can run at once, each with its own session ID
+login_sessions = LoginSessions(manager)
 
 
 @app.route('/')
@@ -88,49 +50,202 @@ def index():
 def add_account_page():
     return render_template('add_account.html')
 
-@app.route('/scrape', methods=['GET', 'POST'])
+@app.route('/scrape')
 def scrape_page():
-    result = None
-    if request.method == 'POST':
-        url = request.form.get('url')
-        account_id = request.form.get('account_id')
-        
-        account = None
-        if account_id:
-            accounts = manager.get_all_accounts()
-            account = next((a for a in accounts if a['id'] == account_id), None)
-        else:
-            account = manager.get_random_active_account()
-            
-        if account and url:
-            scraper = XHSScraper(headless=True)
-            scrape_res = scraper.scrape_note(url, account['state_file'], account['user_agent'])
-            result = scrape_res
-            result["account_used"] = account['nickname']
-            
     accounts = manager.get_all_accounts()
-    return render_template('scrape.html', accounts=accounts, result=result)
+    return render_template('scrape.html', accounts=accounts)
+
+@app.route('/api/scrape', methods=['POST'])
+def api_scrape():
+    """
+    Enqueues scrape jobs. Body (JSON or form): url or urls, optional
+    account_id, optional trace (record a Playwright trace of each scrape,
+    see /api/jobs/<id>/trace). Returns 202 with the job IDs, or 429 when
+    the queue is full.
+    """
+    payload = request.get_json(silent=True) or request.form
+    urls = payload.get('urls') or ([payload.get('url')] if payload.get('url') else [])
+    if isinstance(urls, str):
+        urls = urls.split()
+    urls = [u.strip() for u in urls if u and u.strip()]
+    account_id = payload.get('account_id') or None
+    trace = str(payload.get('trace') or '').lower() in ('1', 'true', 'on', 'yes')
+
+    if not urls:
+        return jsonify({"error": "No URL given"}), 400
+    if account_id and not manager.get_account(account_id):
+        return jsonify({"error": f"Unknown account {account_id}"}), 400
+
+    try:
+        submitted = job_manager.submit(urls, account_id, trace)
+    except QueueFull as e:
+        response = jsonify({"error": str(e)})
+        response.headers['Retry-After'] = '30'
+        return response, 429
+
+    return jsonify({"jobs": [job.to_dict(include_result=False) for job in submitted]}), 202
+
+@app.route('/api/scrape/batch', methods=['POST'])
+def api_scrape_batch():
+    """
+    Scrapes a list of URLs (JSON {"urls": [...], "account_id": optional})
+    and streams one NDJSON line per note as it completes, in completion
+    order, with the input index attached. URLs are fed to the job queue as
+    it has room, so batches larger than the queue are fine.
+    """
+    payload = request.get_json(silent=True) or {}
+    urls = payload.get('urls') or []
+    account_id = payload.get('account_id') or None
+    if not isinstance(urls, list) or not urls:
+        return jsonify({"error": "Expected a non-empty 'urls' list"}), 400
+    if account_id and not manager.get_account(account_id):
+        return jsonify({"error": f"Unknown account {account_id}"}), 400
+
+    def stream():
+        done = queue.Queue()
+        next_index = 0
+        outstanding = 0
+        while next_index < len(urls) or outstanding:
+            while next_index < len(urls):
+                url = str(urls[next_index] or '').strip()
+                if not url:
+                    yield batch_line(next_index, url, {"success": False, "error": "Empty URL"})
+                    next_index += 1
+                    continue
+                try:
+                    job, = job_manager.submit([url], account_id)
+                except QueueFull:
+                    break
+                job_manager.add_done_callback(job, lambda j, i=next_index: done.put((i, j)))
+                next_index += 1
+                outstanding += 1
+            if not outstanding:
+                # The queue is full of other clients' jobs
+                time.sleep(1)
+                continue
+            index, job = done.get()
+            outstanding -= 1
+            yield batch_line(index, job.url, job.result or {"success": False, "error": job.error})
+
+    return Response(stream(), mimetype='application/x-ndjson')
+
+@app.route('/api/notes')
+def list_notes():
+    """
+    Stored notes, newest scrape first. Filters: author_id, account,
+    since / until (epoch seconds), min_likes. Page with limit and the
+    returned next_cursor.
+    """
+    args = request.args
+    try:
+        notes, next_cursor = note_store.query(
+            author_id=args.get('author_id'),
+            account=args.get('account'),
+            since=args.get('since', type=float),
+            until=args.get('until', type=float),
+            min_likes=args.get('min_likes', type=int),
+            limit=args.get('limit', default=DEFAULT_PAGE_SIZE, type=int),
+            cursor=args.get('cursor'),
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({"notes": notes, "next_cursor": next_cursor})
+
+@app.route('/api/jobs/<job_id>')
+def api_job(job_id):
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job"}), 404
+    return jsonify(job.to_dict())
 
-@app.route('/api/start_login', methods=['POST'])
+@app.route('/api/jobs/<job_id>/trace')
+def api_job_trace(job_id):
+    """
+    The Playwright trace of a job submitted with trace (open it with
+    `playwright show-trace`).
+    """
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job"}), 404
+    path = (job.result or {}).get("trace")
+    if not path or not os.path.exists(path):
+        return jsonify({"error": "No trace for this job"}), 404
+    return send_file(os.path.abspath(path), mimetype='application/zip', as_attachment=True,
+                     download_name=os.path.basename(path))
+
+@app.route('/metrics')
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/login/sessions', methods=['POST'])
 def start_login():
-    if login_session["status"] in ["initializing", "waiting_scan"]:
-        return jsonify({"status": "busy", "message": "Login already in progress"})
-    
-    ua = manager.get_user_agent_for_session()
-    thread = threading.Thread(target=login_worker_thread, args=(ua,))
-    thread.daemon = True
-    thread.start()
-    
-    return jsonify({"status": "started"})
-
-@app.route('/api/login_status')
-def get_status():
-    return jsonify(login_session)
+    try:
+        session = login_sessions.start()
+    except TooManySessions as e:
+        return jsonify({"error": str(e)}), 429
+    return jsonify(session.to_dict()), 201
+
+@app.route('/api/login/sessions')
+def list_logins():
+    return jsonify({"sessions": [s.to_dict() for s in login_sessions.active()]})
+
+@app.route('/api/login/sessions/<session_id>')
+def get_login(session_id):
+    session = login_sessions.get(session_id)
+    if session is None:
+        return jsonify({"error": "Unknown session"}), 404
+    return jsonify(session.to_dict())
+
+@app.route('/api/login/sessions/<session_id>', methods=['DELETE'])
+def cancel_login(session_id):
+    return jsonify({"cancelled": login_sessions.cancel(session_id)})
+
+@app.route('/api/login/sessions/<session_id>/qr.png')
+def login_qr(session_id):
+    """
+    The session's QR code, served from memory until the session ends.
+    """
+    session = login_sessions.get(session_id)
+    png = session.qr_png if session is not None else None
+    if png is None:
+        return jsonify({"error": "No QR code for this session"}), 404
+    return Response(png, mimetype='image/png', headers={"Cache-Control": "no-store"})
+
+@app.route('/api/login/sessions/<session_id>/events')
+def login_events(session_id):
+    """
+    Server-sent events: a "status" event with the session snapshot on every
+    change, until the session finishes.
+    """
+    session = login_sessions.get(session_id)
+    if session is None:
+        return jsonify({"error": "Unknown session"}), 404
+
+    def stream():
+        for snapshot in session.events():
+            if snapshot is None:
+                yield ": keep-alive\n\n"
+            else:
+                yield f"event: status\ndata: {json.dumps(snapshot, ensure_ascii=False)}\n\n"
+
+    return Response(stream(), mimetype='text/event-stream',
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.route('/api/logs')
+def get_logs():
+    """
+    The latest in-memory log records (?n=, default 100), oldest first.
+    """
+    n = request.args.get('n', default=100, type=int)
+    return jsonify({"logs": recent_logs.records(max(n, 1))})
 
 @app.route('/delete/<user_id>')
 def delete_account(user_id):
     manager.delete_account(user_id)
     return redirect(url_for('index'))
 
+def serve(host=DEFAULT_HOST, port=DEFAULT_PORT, debug=True):
+    app.run(debug=debug, host=host, port=port, use_reloader=False)
+
 if __name__ == '__main__':
-    app.run(debug=True, host='0.0.0.0', port=5000, use_reloader=False) 
+    serve()
@@ -0,0 +1,135 @@
+"""
+Single command-line entry point.
+
+    python xhs.py scrape [main.py options]         scrape links.txt (or --stdin)
+    python xhs.py login                            add an account by QR code
+    python xhs.py serve [--host H] [--port P]      web UI
+    python xhs.py accounts list
+    python xhs.py accounts disable|delete <id>
+    python xhs.py results export [--format csv] [--output FILE] [filters]
+    python xhs.py bench <benchmark.py command>     e.g. `bench startup`
+
+Only the standard library is imported up front. Every command imports
+its own modules when it runs, so Playwright and Flask load only for the
+commands that use them and `accounts list` starts in tens of
+milliseconds (tracked by `bench startup`).
+"""
+import argparse
+import sys
+
+# Commands whose arguments are handed over untouched to the module behind them
+FORWARDED = {
+    "scrape": "Scrape every note listed in links.txt; takes the options of main.py",
+    "bench": "Offline benchmarks; takes the commands and options of benchmark.py",
+}
+
+
+def cmd_scrape(argv):
+    import main
+    main.cli(argv)
+
+
+def cmd_bench(argv):
+    import benchmark
+    benchmark.main(argv)
+
+
+def cmd_login(args):
+    import cli_login
+    cli_login.run()
+
+
+def cmd_serve(args):
+    import web_server
+    options = {name: value for name, value in (("host", args.host), ("port", args.port)) if value is not None}
+    web_server.serve(debug=args.debug, **options)
+
+
+def cmd_accounts_list(args):
+    from account_manager import AccountManager
+
+    accounts = AccountManager().get_all_accounts()
+    if not accounts:
+        print("No accounts. Add one with: python xhs.py login")
+        return
+    print(f"{'id':26} {'nickname':20} {'status':10} state file")
+    for account in accounts:
+        print(f"{account['id']:26} {account.get('nickname') or '':20} {account.get('status') or '':10} "
+              f"{account.get('state_file') or ''}")
+
+
+def _account_action(args, action):
+    from account_manager import AccountManager
+
+    manager = AccountManager()
+    account = manager.get_account(args.id)
+    if account is None:
+        raise SystemExit(f"No account with id {args.id}")
+    getattr(manager, f"{action}_account")(args.id)
+    print(f"{action.capitalize()}d account {account.get('nickname') or args.id}")
+
+
+def cmd_accounts_disable(args):
+    _account_action(args, "disable")
+
+
+def cmd_accounts_delete(args):
+    _account_action(args, "delete")
+
+
+def cmd_results_export(args):
+    from note_store import NoteStore, export_command
+
+    store = NoteStore()
+    try:
+        export_command(store, args)
+    finally:
+        store.close()
+
+
+def build_parser():
+    from export_options import add_export_arguments
+
+    parser = argparse.ArgumentParser(prog="xhs", description="Xiaohongshu note scraper")
+    commands = parser.add_subparsers(dest="command", required=True, metavar="command")
+    for name, help_text in FORWARDED.items():
+        commands.add_parser(name, help=help_text, add_help=False)
+
+    p = commands.add_parser("login", help="Add an account by scanning a QR code")
+    p.set_defaults(func=cmd_login)
+
+    p = commands.add_parser("serve", help="Run the web UI")
+    p.add_argument("--host", help="Interface to listen on (default: 0.0.0.0)")
+    p.add_argument("--port", type=int, help="Port to listen on (default: 5000)")
+    p.add_argument("--no-debug", dest="debug", action="store_false", help="Disable Flask debug mode")
+    p.set_defaults(func=cmd_serve)
+
+    accounts = commands.add_parser("accounts", help="Manage accounts")
+    actions = accounts.add_subparsers(dest="action", required=True, metavar="action")
+    p = actions.add_parser("list", help="List accounts and their status")
+    p.set_defaults(func=cmd_accounts_list)
+    p = actions.add_parser("disable", help="Stop using an account")
+    p.add_argument("id", help="Account (user) ID")
+    p.set_defaults(func=cmd_accounts_disable)
+    p = actions.add_parser("delete", help="Remove an account and its saved session")
+    p.add_argument("id", help="Account (user) ID")
+    p.set_defaults(func=cmd_accounts_delete)
+
+    results = commands.add_parser("results", help="Work with scraped notes")
+    actions = results.add_subparsers(dest="action", required=True, metavar="action")
+    p = actions.add_parser("export", help="Export stored notes (data/notes.db) as JSON lines or CSV")
+    add_export_arguments(p)
+    p.set_defaults(func=cmd_results_export)
+    return parser
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv and argv[0] in FORWARDED:
+        return globals()[f"cmd_{argv[0]}"](argv[1:])
+    args = build_parser().parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    main()